@@ -13,7 +13,23 @@ def create_app(config_class=Config):
     mail.init_app(app)
 
     # Import models
-    from app.models import user, article
+    from app.models import user, article, newsletter, search_index
+
+    # Keep in-memory search indexes in step with article writes
+    from app.services.search import indexing_service
+    indexing_service.init_app(app)
+
+    # Request, SQL and template timings for /admin/metrics
+    from app.services.monitoring import instrumentation
+    instrumentation.init_app(app)
+
+    # Rendered pages and fragments, versioned by article generation
+    from app.services.content import page_cache
+    page_cache.init_app(app)
+
+    # Background jobs: Celery when configured, local worker threads otherwise
+    from app.services.tasks import task_queue
+    task_queue.init_app(app)
 
     # Register Blueprints
     from app.views.auth import bp as auth_bp
@@ -33,7 +49,37 @@ def create_app(config_class=Config):
 
     # Home route
     @app.route('/')
+    @page_cache.cached_page()
     def index():
         return render_template('base/base.html')
 
-    return app
\ No newline at end of file
+    return app
+
+
+def preload(app):
+    """Load heavy subsystems before a pre-forking server starts workers.
+
+    Called from gunicorn's ``when_ready`` hook with ``preload_app``, so
+    every worker shares the imported libraries, the embedding model and
+    the built search indexes copy-on-write instead of loading its own
+    copy on its first request.
+    """
+    import gc
+
+    import PyPDF2  # noqa: F401 - imported lazily by pdf_processor otherwise
+
+    with app.app_context():
+        from app.services.search import autocomplete, keyword_search, search_manager
+        # Load the model and map the index, but run no inference here:
+        # torch thread pools do not survive fork
+        search_manager.semantic().get_engine(app)
+        if app.config.get('PRELOAD_SEARCH_INDEXES', True):
+            keyword_search.ensure_index()
+            search_manager.facets().ensure_index()
+            autocomplete.get_service().ensure()
+        # Workers must open their own database connections
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    # Keep the collector from writing to (and so copying) preloaded objects
+    gc.freeze()
\ No newline at end of file
@@ -1,10 +1,63 @@
+import click
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask_sqlalchemy.session import Session
 from flask_login import LoginManager
 from flask_mail import Mail
 
-db = SQLAlchemy()
-migrate = Migrate()
+
+
+class RoutingSession(Session):
+    """Sends reads to the ``replica`` bind inside read-only views.
+
+    Views opt in with ``app.utils.decorators.read_only``. Flushes, and
+    models with their own bind key, always use their normal engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self._flushing or not (has_app_context() and g.get('use_replica')):
+            return engine
+        engines = self._db.engines
+        if 'replica' in engines and engine is engines.get(None):
+            return engines['replica']
+        return engine
+
+
+class LazyMigrate:
+    """Flask-Migrate, imported when a ``db`` command first runs.
+
+    Importing Flask-Migrate loads Alembic, Mako and Pygments; web
+    workers and other CLI commands never migrate, so only the ``db``
+    command group pays for them.
+    """
+
+    def init_app(self, app, db):
+        app.cli.add_command(_LazyDbGroup(app, db), name='db')
+
+
+class _LazyDbGroup(click.Group):
+    def __init__(self, app, db):
+        super().__init__('db', help='Perform database migrations.')
+        self.app = app
+        self.db = db
+
+    def load(self):
+        if 'migrate' not in self.app.extensions:
+            from flask_migrate import Migrate
+            Migrate(self.app, self.db)
+        from flask_migrate.cli import db as group
+        return group
+
+    def list_commands(self, ctx):
+        return self.load().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self.load().get_command(ctx, name)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = LazyMigrate()
 login_manager = LoginManager()
 mail = Mail()
 
@@ -13,5 +66,5 @@ login_manager.login_message = 'Please log in to access this page.'
 
 @login_manager.user_loader
 def load_user(user_id):
-    from app.models.user import User
-    return User.query.get(int(user_id))
\ No newline at end of file
+    from app.services.auth.session_cache import load_principal
+    return load_principal(int(user_id))
\ No newline at end of file
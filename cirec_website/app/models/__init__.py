@@ -1,4 +1,7 @@
 from app.models.user import User
-from app.models.article import Article
+from app.models.article import Article, ArticleTermOffset, ArticleViewDaily, SourceFile
+from app.models.newsletter import Campaign, CampaignRecipient
+from app.models.search_index import ArticleEntity, ArticlePassage, Entity
 
-__all__ = ['User', 'Article']
+__all__ = ['User', 'Article', 'ArticleTermOffset', 'ArticleViewDaily', 'SourceFile', 'Campaign',
+           'CampaignRecipient', 'ArticlePassage', 'Entity', 'ArticleEntity']
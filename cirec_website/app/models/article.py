@@ -3,18 +3,74 @@ from app.extensions import db
 
 class Article(db.Model):
     __tablename__ = 'articles'
+    __table_args__ = (
+        # Newest-first listings of published articles (keyset pagination)
+        db.Index('ix_articles_published_created_id', 'is_published', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=True)
     summary = db.Column(db.Text, nullable=True)
+    # Derived from content when the article is written (article_service)
+    preview = db.Column(db.Text, nullable=True)
+    word_count = db.Column(db.Integer, default=0)
+    auto_summary = db.Column(db.Text, nullable=True)  # lead sentences; summary is the editor's
     author = db.Column(db.String(100), nullable=True)
     source_file = db.Column(db.String(255), nullable=True)  # PDF filename
-    file_path = db.Column(db.String(500), nullable=True)    # Full file path
+    file_path = db.Column(db.String(500), nullable=True, index=True)  # Full file path; keys re-ingests
+    legacy_id = db.Column(db.Integer, nullable=True, unique=True)  # id in the old site, for bulk loads
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     is_published = db.Column(db.Boolean, default=True)
     view_count = db.Column(db.Integer, default=0)
     
     def __repr__(self):
         return f'<Article {self.title}>'
+
+
+class ArticleTermOffset(db.Model):
+    """Where a term first occurs in an article's content.
+
+    Written with the article so search snippets can be cut from the
+    content without reading the whole body.
+    """
+    __tablename__ = 'article_term_offsets'
+
+    article_id = db.Column(db.Integer, db.ForeignKey('articles.id', ondelete='CASCADE'), primary_key=True)
+    term = db.Column(db.String(64), primary_key=True)
+    offsets = db.Column(db.String(100), nullable=False)  # comma-separated character offsets
+
+    def __repr__(self):
+        return f'<ArticleTermOffset {self.article_id} {self.term}>'
+
+
+class SourceFile(db.Model):
+    """An ingested PDF issue, keyed by content hash."""
+    __tablename__ = 'source_files'
+
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False, index=True)
+    file_path = db.Column(db.String(500), nullable=True, index=True)  # articles' file_path points here
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    page_count = db.Column(db.Integer, default=0)
+    article_count = db.Column(db.Integer, default=0)
+    issue_number = db.Column(db.Integer, nullable=True)
+    issue_date = db.Column(db.Date, nullable=True)
+    ingested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SourceFile {self.filename}>'
+
+
+class ArticleViewDaily(db.Model):
+    """Views per article per day, written by the view counter flush."""
+    __tablename__ = 'article_view_daily'
+
+    article_id = db.Column(db.Integer, db.ForeignKey('articles.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ArticleViewDaily {self.article_id} {self.day}>'
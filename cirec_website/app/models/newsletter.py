@@ -0,0 +1,42 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class Campaign(db.Model):
+    """A bulk mailing, e.g. the notice for a new CMN issue."""
+    __tablename__ = 'campaigns'
+
+    id = db.Column(db.Integer, primary_key=True)
+    template = db.Column(db.String(50), nullable=False)  # key in services/email/templates.py
+    audience = db.Column(db.String(50), nullable=False, default='active_subscribers')
+    context = db.Column(db.JSON, nullable=True)  # template variables, e.g. issue_number
+    status = db.Column(db.String(20), nullable=False, default='draft')  # draft, sending, done, failed
+    # Recipients are streamed in id order; everyone up to here has been claimed
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Campaign {self.id} {self.template}>'
+
+
+class CampaignRecipient(db.Model):
+    """One recipient of a campaign.
+
+    The row is written as ``claimed`` before the message is handed to
+    SMTP, so a resumed campaign never mails anyone twice.
+    """
+    __tablename__ = 'campaign_recipients'
+
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='claimed')  # claimed, sent, failed
+    error = db.Column(db.String(255), nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<CampaignRecipient {self.campaign_id} {self.user_id}>'
@@ -0,0 +1,47 @@
+from app.extensions import db
+
+
+class ArticlePassage(db.Model):
+    """An overlapping window of an article's content, by character offsets.
+
+    Long issues are indexed and scored passage by passage, so the keyword
+    index, the semantic index and search snippets all share these
+    boundaries. The text itself stays in ``articles.content``.
+    """
+    __tablename__ = 'article_passages'
+
+    article_id = db.Column(db.Integer, db.ForeignKey('articles.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    start_offset = db.Column(db.Integer, nullable=False)
+    end_offset = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<ArticlePassage {self.article_id} {self.position}>'
+
+
+class Entity(db.Model):
+    """A facet value: a company, product, region, category or document type."""
+    __tablename__ = 'entities'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'value', name='uq_entities_kind_value'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    value = db.Column(db.String(64), nullable=False, index=True)  # slug, as used in filter URLs
+    label = db.Column(db.String(100), nullable=False)
+
+    def __repr__(self):
+        return f'<Entity {self.kind}:{self.value}>'
+
+
+class ArticleEntity(db.Model):
+    """Links an article to each facet value extracted from it."""
+    __tablename__ = 'article_entities'
+
+    article_id = db.Column(db.Integer, db.ForeignKey('articles.id', ondelete='CASCADE'), primary_key=True)
+    entity_id = db.Column(db.Integer, db.ForeignKey('entities.id', ondelete='CASCADE'), primary_key=True,
+                          index=True)
+
+    def __repr__(self):
+        return f'<ArticleEntity {self.article_id} {self.entity_id}>'
@@ -1,11 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from app.extensions import db
+from app.utils.security import hash_password, verify_password
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Expiry and renewal sweeps (subscription_manager)
+        db.Index('ix_users_subscription_status_end', 'subscription_status', 'subscription_end'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
@@ -14,7 +18,7 @@ class User(UserMixin, db.Model):
     last_name = db.Column(db.String(50), nullable=False)
     company = db.Column(db.String(100), nullable=True)
     telephone = db.Column(db.String(20), nullable=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     is_admin = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -25,12 +29,16 @@ class User(UserMixin, db.Model):
     subscription_status = db.Column(db.String(20), default='inactive')  # active, inactive, expired
     subscription_start = db.Column(db.DateTime, nullable=True)
     subscription_end = db.Column(db.DateTime, nullable=True)
+    subscription_plan = db.Column(db.String(20), nullable=True)  # basic, full
+    auto_renew = db.Column(db.Boolean, default=False)
+    monthly_news = db.Column(db.String(20), nullable=True)  # 1_year, 2_year
+    newsletter = db.Column(db.Boolean, default=True)  # industry update mailings
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, inspect, select
+
+from app.extensions import db
+from app.models.article import Article
+from app.models.user import User
+from app.services.content import view_counter
+from app.services.search import indexing_service
+from app.utils.helpers import LRUCache
+
+_cache = LRUCache(maxsize=64)
+
+
+def invalidate(*args):
+    _cache.clear()
+
+
+def _cached(key, compute):
+    value = _cache.get(key)
+    if value is None:
+        value = compute()
+        _cache.set(key, value, ttl=current_app.config.get('ADMIN_STATS_TTL', 60))
+    return value
+
+
+def _totals():
+    users = select(func.count(User.id)).scalar_subquery()
+    articles = select(func.count(Article.id)).scalar_subquery()
+    active = (select(func.count(User.id))
+              .where(User.subscription_status == 'active')
+              .scalar_subquery())
+    total_users, total_articles, active_subscriptions = db.session.query(users, articles, active).one()
+    return {
+        'total_users': total_users,
+        'total_articles': total_articles,
+        'active_subscriptions': active_subscriptions,
+    }
+
+
+def dashboard_stats():
+    """Dashboard counters from one round trip, cached for ADMIN_STATS_TTL."""
+    return _cached('totals', _totals)
+
+
+def recent_users(limit=5):
+    return _cached(('recent_users', limit), lambda: (
+        db.session.query(User.id, User.first_name, User.last_name, User.created_at)
+        .order_by(User.created_at.desc())
+        .limit(limit)
+        .all()
+    ))
+
+
+def _fill_days(rows, days):
+    start = datetime.utcnow().date() - timedelta(days=days - 1)
+    counts = {str(day): int(n) for day, n in rows}
+    return [(start + timedelta(days=i), counts.get(str(start + timedelta(days=i)), 0))
+            for i in range(days)]
+
+
+def registrations_per_day(days=30):
+    def compute():
+        since = datetime.combine(datetime.utcnow().date() - timedelta(days=days - 1), datetime.min.time())
+        day = func.date(User.created_at)
+        rows = (db.session.query(day, func.count(User.id))
+                .filter(User.created_at >= since)
+                .group_by(day)
+                .all())
+        return _fill_days(rows, days)
+    return _cached(('registrations', days), compute)
+
+
+def views_per_day(days=30):
+    return _cached(('views', days), lambda: _fill_days(view_counter.daily_views(days), days))
+
+
+def _user_changed(mapper, connection, target):
+    invalidate()
+
+
+def _user_updated(mapper, connection, target):
+    if inspect(target).attrs.subscription_status.history.has_changes():
+        invalidate()
+
+
+event.listen(User, 'after_insert', _user_changed)
+event.listen(User, 'after_delete', _user_changed)
+event.listen(User, 'after_update', _user_updated)
+indexing_service.on_articles_changed(invalidate)
@@ -0,0 +1,145 @@
+import logging
+
+from flask import current_app
+
+from app.models.user import User
+from app.utils.helpers import LRUCache, TokenBucket
+from app.utils.security import hash_password, needs_rehash, verify_password
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBuckets:
+    """Buckets in an LRU in this process, so idle ones are dropped.
+
+    Each worker process counts attempts on its own: with N workers an
+    address or account gets up to N times the configured allowance.
+    """
+
+    def __init__(self, maxsize=65536):
+        self._buckets = LRUCache(maxsize=maxsize)
+
+    def take(self, key, rate, burst, consume=True):
+        """Take a token from ``key``'s bucket (or only check for one)."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity=burst)
+            self._buckets.set(key, bucket)
+        return bucket.consume() if consume else bucket.available()
+
+
+class RedisBuckets:
+    """Buckets in Redis hashes, shared by every worker.
+
+    The refill and take run as one script, on the Redis clock. While
+    Redis is unreachable, attempts are counted per process instead.
+    """
+
+    SCRIPT = """
+    redis.replicate_commands()
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local rate, burst, take = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    tokens = math.min(burst, tokens + (now - (tonumber(state[2]) or now)) * rate)
+    if tokens < 1 then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens - take, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return 1
+    """
+
+    def __init__(self, url, prefix='cirec:login:'):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.redis.register_script(self.SCRIPT)
+        self._fallback = MemoryBuckets()
+        self._errors = redis.exceptions.RedisError
+
+    def take(self, key, rate, burst, consume=True):
+        try:
+            return bool(self._script(keys=[self.prefix + key], args=[rate, burst, 1 if consume else 0]))
+        except self._errors as exc:
+            logger.warning('Login throttle store unavailable, counting in this process: %s', exc)
+            return self._fallback.take(key, rate, burst, consume)
+
+
+class LoginThrottle:
+    """Per-IP and per-account token buckets checked before any hashing.
+
+    Every attempt from an address takes a token from that address's
+    bucket; only failed attempts take one from the account's, so an
+    account's own successful logins never use up its allowance. Buckets
+    live in ``store``, a ``MemoryBuckets`` unless one is given.
+    """
+
+    def __init__(self, ip_rate, ip_burst, account_rate, account_burst, store=None):
+        self.ip_rate, self.ip_burst = ip_rate, ip_burst
+        self.account_rate, self.account_burst = account_rate, account_burst
+        self.store = store if store is not None else MemoryBuckets()
+
+    def allow(self, ip, account):
+        """Take this attempt's tokens; False if either bucket is empty."""
+        if not self.store.take('account:' + account, self.account_rate, self.account_burst, consume=False):
+            return False
+        return self.store.take('ip:' + ip, self.ip_rate, self.ip_burst)
+
+    def failed(self, account):
+        self.store.take('account:' + account, self.account_rate, self.account_burst)
+
+
+_throttle = None
+_dummy = {}
+
+
+def get_throttle():
+    global _throttle
+    if _throttle is None:
+        config = current_app.config
+        url = config.get('LOGIN_THROTTLE_REDIS_URL')
+        _throttle = LoginThrottle(
+            config.get('LOGIN_IP_RATE', 1.0), config.get('LOGIN_IP_BURST', 20),
+            config.get('LOGIN_ACCOUNT_RATE', 0.1), config.get('LOGIN_ACCOUNT_BURST', 5),
+            store=RedisBuckets(url) if url else MemoryBuckets(),
+        )
+    return _throttle
+
+
+def _dummy_hash():
+    """A hash made with the current settings, checked when no account matches."""
+    key = tuple(current_app.config.get(name) for name in (
+        'PASSWORD_HASH_METHOD', 'PASSWORD_BCRYPT_ROUNDS', 'PASSWORD_PBKDF2_ITERATIONS', 'PASSWORD_SCRYPT_N'))
+    if key not in _dummy:
+        _dummy[key] = hash_password('not the password of any account')
+    return _dummy[key]
+
+
+def authenticate(email, password, ip=None):
+    """Check a login attempt; returns ``(user, error)``.
+
+    ``error`` is None on success, ``'throttled'`` when the attempt was
+    refused without checking the password, or ``'invalid'``. Unknown
+    emails cost the same hash check as known ones, and hashes made with
+    outdated settings are replaced while the plain password is at hand.
+    """
+    # The account is looked up and throttled under the same spelling
+    account = (email or '').strip()
+    throttle = get_throttle()
+    if not throttle.allow(ip or 'unknown', account):
+        logger.warning('Login throttled for %s from %s', account, ip)
+        return None, 'throttled'
+
+    user = User.query.filter_by(email=account).first() if account else None
+    if user is None:
+        verify_password(_dummy_hash(), password or '')
+        throttle.failed(account)
+        return None, 'invalid'
+    if not user.check_password(password or ''):
+        throttle.failed(account)
+        return None, 'invalid'
+    if needs_rehash(user.password_hash):
+        user.set_password(password)
+    return user, None
@@ -0,0 +1,29 @@
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from app.extensions import db
+from app.models.user import User
+
+RESET_TOKEN_MAX_AGE = 3600
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='password-reset')
+
+
+def generate_reset_token(user):
+    # Part of the current hash goes into the token, so it stops working
+    # once the password has been changed
+    return _serializer().dumps({'id': user.id, 'hash': (user.password_hash or '')[-12:]})
+
+
+def verify_reset_token(token, max_age=RESET_TOKEN_MAX_AGE):
+    """The user a reset token was issued to, or None if it is invalid or used."""
+    try:
+        data = _serializer().loads(token, max_age=max_age)
+    except BadSignature:
+        return None
+    user = db.session.get(User, data.get('id'))
+    if user is None or (user.password_hash or '')[-12:] != data.get('hash'):
+        return None
+    return user
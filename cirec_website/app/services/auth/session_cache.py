@@ -0,0 +1,152 @@
+from flask import current_app, has_app_context
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models.user import User
+from app.services.content import page_cache
+from app.utils.helpers import LRUCache
+
+PRINCIPAL_FIELDS = (
+    'id', 'email', 'username', 'first_name', 'last_name', 'is_admin', 'active',
+    'account_type', 'subscription_status', 'subscription_start', 'subscription_end', 'created_at',
+)
+
+# Columns read by the principal, plus credentials: a password change
+# drops the cached entry so the next request reloads the account
+COLUMNS = ('id', 'email', 'username', 'first_name', 'last_name', 'is_admin', 'is_active',
+           'account_type', 'subscription_status', 'subscription_start', 'subscription_end', 'created_at')
+WATCHED_FIELDS = COLUMNS + ('password_hash',)
+
+# Principals cached in this process; each entry records the user's
+# generation in the shared page-cache store when it was loaded
+_cache = LRUCache(maxsize=4096)
+
+
+class UserPrincipal:
+    """The slice of a User that most requests need, without an ORM instance.
+
+    Flask-Login keeps one of these as ``current_user``. Anything outside
+    ``PRINCIPAL_FIELDS`` is read from the full User row, which is loaded
+    once per request on first access; views that modify the user should
+    call ``hydrate()`` and change that instance.
+    """
+
+    __slots__ = PRINCIPAL_FIELDS + ('_user',)
+
+    def __init__(self, row):
+        for name, value in zip(PRINCIPAL_FIELDS, row):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def is_active(self):
+        return bool(self.active)
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+    def hydrate(self):
+        if self._user is None:
+            object.__setattr__(self, '_user', db.session.get(User, self.id))
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.hydrate(), name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserPrincipal is read-only; change hydrate() instead')
+
+    def __repr__(self):
+        return f'<UserPrincipal {self.username}>'
+
+
+def user_generation(user_id):
+    return 'user:%d' % user_id
+
+
+def _generation(user_id):
+    """The user's generation, or None when the store cannot be reached."""
+    if 'page_cache' not in current_app.extensions:
+        return 0
+    generations = page_cache.get_store().generations([user_generation(user_id)])
+    return generations[0] if generations is not None else None
+
+
+def load_principal(user_id):
+    """The user's principal, cached until any process changes the account.
+
+    Changes bump the user's generation in the page-cache store, which
+    the Redis backend shares between workers, CLI commands and tasks.
+    """
+    generation = _generation(user_id)
+    # Without a generation a cached entry may be stale; read the row
+    cached = _cache.get(user_id) if generation is not None else None
+    if cached is not None and cached[0] == generation:
+        return UserPrincipal(cached[1])
+    row = (db.session.query(*[getattr(User, name) for name in COLUMNS])
+           .filter(User.id == user_id)
+           .first())
+    if row is None:
+        return None
+    row = tuple(row)
+    if generation is not None:
+        _cache.set(user_id, (generation, row), ttl=current_app.config.get('USER_CACHE_TTL', 60))
+    return UserPrincipal(row)
+
+
+def get_current_user_model():
+    """The full User row for ``current_user``, for views that change it."""
+    if isinstance(current_user, UserPrincipal):
+        return current_user.hydrate()
+    return current_user._get_current_object()
+
+
+def invalidate(*user_ids):
+    """Drop the cached principals of ``user_ids`` in every process."""
+    for user_id in user_ids:
+        _cache.pop(user_id)
+    if user_ids and has_app_context() and 'page_cache' in current_app.extensions:
+        page_cache.get_store().bump([user_generation(user_id) for user_id in user_ids])
+
+
+def _track(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_users', set()).add(target.id)
+    invalidate(target.id)
+
+
+def _after_commit(session):
+    # Drop again after commit in case a concurrent request re-cached
+    # the row between the flush and the commit
+    invalidate(*session.info.pop('changed_users', ()))
+
+
+def _after_rollback(session, previous_transaction):
+    # A savepoint rollback leaves the outer transaction's changes pending
+    if not previous_transaction.nested:
+        session.info.pop('changed_users', None)
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in WATCHED_FIELDS):
+        _track(mapper, connection, target)
+
+
+event.listen(User, 'after_update', _after_update)
+event.listen(User, 'after_delete', _track)
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_soft_rollback', _after_rollback)
@@ -0,0 +1,390 @@
+import base64
+import re
+from collections import defaultdict
+from datetime import datetime
+
+from markupsafe import Markup, escape
+from sqlalchemy import and_, case, event, func, inspect, or_, tuple_
+from sqlalchemy.orm import load_only
+
+from app.extensions import db
+from app.models.article import Article, ArticleTermOffset
+from app.models.search_index import ArticleEntity, ArticlePassage
+from app.services.content.entity_extractor import store_entities
+from app.utils.text_processing import STOPWORDS, TOKEN_RE, chunk_spans, tokenize
+
+PREVIEW_LENGTH = 300
+SUMMARY_LENGTH = 200
+SNIPPET_LENGTH = 220
+SNIPPET_LEAD = 60
+MAX_TERM_OFFSETS = 4
+MAX_TERM_LENGTH = 64
+PASSAGE_WORDS = 200
+PASSAGE_OVERLAP = 50
+
+TAG_RE = re.compile(r'<[^>]+>')
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Columns a listing renders; content and summary stay unloaded
+LISTING_COLUMNS = (
+    Article.id, Article.title, Article.author, Article.source_file,
+    Article.created_at, Article.view_count, Article.is_published,
+)
+
+# Columns a search result or preview renders; content stays unloaded
+RESULT_COLUMNS = LISTING_COLUMNS + (Article.summary, Article.auto_summary, Article.preview, Article.word_count)
+
+
+def get_articles_by_ids(ids, published_only=True, columns=None):
+    """Load articles for ``ids`` in one query, keeping the order of ``ids``."""
+    ids = list(ids)
+    if not ids:
+        return []
+    query = Article.query.filter(Article.id.in_(ids))
+    if columns is not None:
+        query = query.options(load_only(*columns))
+    if published_only:
+        query = query.filter(Article.is_published.is_(True))
+    by_id = {article.id: article for article in query}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def plain_text(text):
+    return ' '.join(TAG_RE.sub(' ', text or '').split())
+
+
+def truncate(text, length):
+    """Cut ``text`` at a word boundary, marking the cut with '...'."""
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(' ', 1)[0].rstrip(' ,;:-')
+    return cut + '...'
+
+
+def lead_summary(text, length=SUMMARY_LENGTH):
+    """The opening sentences of ``text`` that fit in ``length`` characters."""
+    summary = ''
+    for sentence in SENTENCE_END_RE.split(text):
+        if summary and len(summary) + len(sentence) + 1 > length:
+            break
+        summary = (summary + ' ' + sentence).strip()
+    return truncate(summary, length)
+
+
+def derived_fields(content):
+    """Preview, word count and lead-sentence summary for an article body.
+
+    The lead goes to ``auto_summary``; ``summary`` is only ever written
+    by editors, so recomputing these on every content change never
+    overwrites their text.
+    """
+    text = plain_text(content)
+    return {
+        'preview': truncate(text, PREVIEW_LENGTH) or None,
+        'word_count': len(text.split()),
+        'auto_summary': lead_summary(text) if text else None,
+    }
+
+
+def term_offsets(content):
+    """``{term: [offset, ...]}`` for the first occurrences of each term."""
+    offsets = defaultdict(list)
+    for match in TOKEN_RE.finditer(content or ''):
+        term = match.group(0).lower()
+        if term in STOPWORDS or len(term) > MAX_TERM_LENGTH:
+            continue
+        positions = offsets[term]
+        if len(positions) < MAX_TERM_OFFSETS:
+            positions.append(match.start())
+    return offsets
+
+
+def store_term_offsets(connection, articles):
+    """Replace the recorded offsets of ``articles``, given as ``(id, content)``."""
+    write_term_offsets(connection, [(article_id, term_offsets(content)) for article_id, content in articles])
+
+
+def write_term_offsets(connection, offsets):
+    """Replace recorded offsets with ``(id, term_offsets(content))`` computed elsewhere."""
+    table = ArticleTermOffset.__table__
+    if not offsets:
+        return
+    connection.execute(table.delete().where(table.c.article_id.in_([aid for aid, _ in offsets])))
+    rows = [{'article_id': article_id, 'term': term, 'offsets': ','.join(map(str, positions))}
+            for article_id, terms in offsets
+            for term, positions in terms.items()]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def passage_spans(content):
+    """``[(position, start, end), ...]`` of the overlapping passages of ``content``."""
+    spans = chunk_spans(content, PASSAGE_WORDS, PASSAGE_OVERLAP)
+    return [(position, start, end) for position, (start, end) in enumerate(spans)]
+
+
+def store_passages(connection, articles):
+    """Replace the recorded passages of ``articles``, given as ``(id, content)``."""
+    write_passages(connection, [(article_id, passage_spans(content)) for article_id, content in articles])
+
+
+def write_passages(connection, passages):
+    """Replace recorded passages with ``(id, passage_spans(content))`` computed elsewhere."""
+    table = ArticlePassage.__table__
+    if not passages:
+        return
+    connection.execute(table.delete().where(table.c.article_id.in_([aid for aid, _ in passages])))
+    rows = [{'article_id': article_id, 'position': position, 'start_offset': start, 'end_offset': end}
+            for article_id, spans in passages
+            for position, start, end in spans]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def load_passages(article_ids):
+    """``{article_id: [(position, start, end), ...]}`` from the passages table."""
+    passages = defaultdict(list)
+    rows = (db.session.query(ArticlePassage.article_id, ArticlePassage.position,
+                             ArticlePassage.start_offset, ArticlePassage.end_offset)
+            .filter(ArticlePassage.article_id.in_(list(article_ids)))
+            .order_by(ArticlePassage.article_id, ArticlePassage.position))
+    for article_id, position, start, end in rows:
+        passages[article_id].append((position, start, end))
+    return passages
+
+
+def with_passages(rows, batch_size=500):
+    """Pair each article row (``id``, ``content``) with its passage spans.
+
+    Spans are read from the passages table a batch at a time; articles
+    written before it existed are split on the fly.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield from _pair_passages(batch)
+            batch = []
+    if batch:
+        yield from _pair_passages(batch)
+
+
+def _pair_passages(batch):
+    stored = load_passages(row.id for row in batch)
+    for row in batch:
+        yield row, stored.get(row.id) or passage_spans(row.content)
+
+
+def refresh_derived_fields(batch_size=500):
+    """Recompute previews, summaries, offsets, passages and facets for every article."""
+    table = Article.__table__
+    last_id = 0
+    count = 0
+    while True:
+        rows = (db.session.query(Article.id, Article.title, Article.content)
+                .filter(Article.id > last_id)
+                .order_by(Article.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        for row in rows:
+            # Never touches summary: that is the editor's
+            db.session.execute(table.update().where(table.c.id == row.id)
+                               .values(updated_at=table.c.updated_at, **derived_fields(row.content)))
+        store_term_offsets(db.session.connection(), [(row.id, row.content) for row in rows])
+        store_passages(db.session.connection(), [(row.id, row.content) for row in rows])
+        store_entities(db.session.connection(), [(row.id, row.title, row.content) for row in rows])
+        db.session.commit()
+        count += len(rows)
+        last_id = rows[-1].id
+    return count
+
+
+def _best_window(positions):
+    """Start of the window of ``SNIPPET_LENGTH`` covering the most terms."""
+    hits = sorted((offset, term) for term, offsets in positions.items() for offset in offsets)
+    best, best_terms = hits[0][0], 0
+    for i, (start, _) in enumerate(hits):
+        terms = {term for offset, term in hits[i:] if offset < start + SNIPPET_LENGTH - SNIPPET_LEAD}
+        if len(terms) > best_terms:
+            best, best_terms = start, len(terms)
+    return max(best - SNIPPET_LEAD, 0)
+
+
+def highlight(text, terms):
+    """Escape ``text`` and wrap whole-word matches of ``terms`` in <mark>."""
+    parts = []
+    last = 0
+    for match in TOKEN_RE.finditer(text):
+        if match.group(0).lower() in terms:
+            parts.append(escape(text[last:match.start()]))
+            parts.append(Markup('<mark>%s</mark>') % match.group(0))
+            last = match.end()
+    parts.append(escape(text[last:]))
+    return Markup('').join(parts)
+
+
+def _content_slices(slices):
+    """``{article_id: text}`` for ``{article_id: (start, length)}``, cut in the database."""
+    # substr is 1-based
+    start = case({article_id: offset + 1 for article_id, (offset, _) in slices.items()}, value=Article.id)
+    length = case({article_id: size for article_id, (_, size) in slices.items()}, value=Article.id)
+    rows = (db.session.query(Article.id, func.substr(Article.content, start, length))
+            .filter(Article.id.in_(list(slices))))
+    return dict(rows)
+
+
+def _offset_windows(article_ids, terms):
+    """Snippet starts from the recorded term offsets."""
+    positions = defaultdict(dict)
+    rows = (db.session.query(ArticleTermOffset)
+            .filter(ArticleTermOffset.article_id.in_(article_ids), ArticleTermOffset.term.in_(terms)))
+    for row in rows:
+        positions[row.article_id][row.term] = [int(o) for o in row.offsets.split(',')]
+    return {article_id: _best_window(found) for article_id, found in positions.items()}
+
+
+def _passage_windows(passages, terms):
+    """Snippet starts inside the best passage of each article.
+
+    Only the passage itself is read; without a query term in it (a
+    semantic match) the snippet opens the passage.
+    """
+    best = [(article_id, positions[0]) for article_id, positions in passages.items()]
+    spans = {article_id: (start, end - start) for article_id, start, end in
+             db.session.query(ArticlePassage.article_id, ArticlePassage.start_offset, ArticlePassage.end_offset)
+             .filter(tuple_(ArticlePassage.article_id, ArticlePassage.position).in_(best))}
+    if not spans:
+        return {}
+    starts = {}
+    for article_id, text in _content_slices(spans).items():
+        found = defaultdict(list)
+        for match in TOKEN_RE.finditer(text or ''):
+            term = match.group(0).lower()
+            if term in terms and len(found[term]) < MAX_TERM_OFFSETS:
+                found[term].append(match.start())
+        offset = _best_window(found) if found else 0
+        start = spans[article_id][0] + offset
+        if offset == 0 and start:
+            # The passage opens on a whole word: step back onto the space
+            # before it so the word is not trimmed
+            start -= 1
+        starts[article_id] = start
+    return starts
+
+
+def snippets(article_ids, query, passages=None):
+    """Highlighted content excerpts around the query terms, by article id.
+
+    ``passages`` maps article ids to their best passage positions, as
+    returned by search; the window is then found inside the best passage.
+    Other articles fall back to the recorded term offsets, and get no
+    snippet when they contain no query term. Only the windows of
+    ``content`` are read from the database.
+    """
+    terms = set(tokenize(query))
+    article_ids = list(article_ids)
+    if not terms or not article_ids:
+        return {}
+    starts = {}
+    if passages:
+        starts.update(_passage_windows(
+            {article_id: passages[article_id] for article_id in article_ids if passages.get(article_id)}, terms))
+    rest = [article_id for article_id in article_ids if article_id not in starts]
+    if rest:
+        starts.update(_offset_windows(rest, terms))
+    if not starts:
+        return {}
+
+    # Read a little extra to trim back to whole words
+    fragments = _content_slices({article_id: (start, SNIPPET_LENGTH + 20) for article_id, start in starts.items()})
+    results = {}
+    for article_id, fragment in fragments.items():
+        if not fragment:
+            continue
+        text = fragment
+        if starts[article_id] > 0 and not fragment[0].isspace():
+            text = text.split(None, 1)[-1]
+        if len(fragment) >= SNIPPET_LENGTH:
+            text = text[:SNIPPET_LENGTH].rsplit(' ', 1)[0]
+        text = ' '.join(text.split())
+        prefix = '...' if starts[article_id] > 0 else ''
+        suffix = '...' if len(fragment) >= SNIPPET_LENGTH else ''
+        results[article_id] = Markup(prefix) + highlight(text, terms) + Markup(suffix)
+    return results
+
+
+def encode_cursor(article):
+    # Undated articles (legacy imports) have an empty date in their cursor
+    raw = '%s|%d' % (article.created_at.isoformat() if article.created_at else '', article.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, article_id = raw.rsplit('|', 1)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(article_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def list_articles(cursor=None, limit=20):
+    """One page of published articles, newest first.
+
+    Pages are addressed by the ``(created_at, id)`` of the last row seen,
+    so every page is an index range scan on
+    ``ix_articles_published_created_id`` however deep the reader goes.
+    Undated articles come first, as in a backward scan of that index.
+    Returns ``(articles, next_cursor)``.
+    """
+    query = (Article.query
+             .options(load_only(*LISTING_COLUMNS))
+             .filter_by(is_published=True))
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        created_at, article_id = position
+        if created_at is None:
+            query = query.filter(or_(and_(Article.created_at.is_(None), Article.id < article_id),
+                                     Article.created_at.isnot(None)))
+        else:
+            query = query.filter(tuple_(Article.created_at, Article.id) < position)
+    rows = (query.order_by(Article.created_at.desc().nullsfirst(), Article.id.desc())
+            .limit(limit + 1).all())
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _derive_on_write(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.content.history.has_changes() or target.word_count is None:
+        for name, value in derived_fields(target.content).items():
+            setattr(target, name, value)
+
+
+def _offsets_on_write(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.content.history.has_changes():
+        store_term_offsets(connection, [(target.id, target.content)])
+        store_passages(connection, [(target.id, target.content)])
+
+
+def _entities_on_write(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.content.history.has_changes() or state.attrs.title.history.has_changes():
+        store_entities(connection, [(target.id, target.title, target.content)])
+
+
+def _offsets_on_delete(mapper, connection, target):
+    for table in (ArticleTermOffset.__table__, ArticlePassage.__table__, ArticleEntity.__table__):
+        connection.execute(table.delete().where(table.c.article_id == target.id))
+
+
+event.listen(Article, 'before_insert', _derive_on_write)
+event.listen(Article, 'before_update', _derive_on_write)
+event.listen(Article, 'after_insert', _offsets_on_write)
+event.listen(Article, 'after_update', _offsets_on_write)
+event.listen(Article, 'after_insert', _entities_on_write)
+event.listen(Article, 'after_update', _entities_on_write)
+event.listen(Article, 'after_delete', _offsets_on_delete)
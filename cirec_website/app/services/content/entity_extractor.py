@@ -0,0 +1,301 @@
+"""Facet values of an article: companies, products, regions, category and type.
+
+Extraction is dictionary-driven: CMN items name a known set of producers,
+products and places, so a gazetteer matched over the token stream finds
+them without a language model. Runs when an article is written; the
+search facet index reads the stored rows.
+"""
+import re
+
+from app.models.search_index import ArticleEntity, Entity
+from app.utils.text_processing import TOKEN_RE
+
+FACET_KINDS = ('category', 'region', 'doc_type', 'company', 'product')
+
+CATEGORIES = [
+    ('petrochemicals', 'Petrochemicals'),
+    ('polymers', 'Polymers'),
+    ('fertilizers', 'Fertilizers'),
+    ('specialty_chemicals', 'Specialty Chemicals'),
+    ('market_analysis', 'Market Analysis'),
+]
+
+DOC_TYPES = [
+    ('report', 'Market Report'),
+    ('news', 'News Article'),
+    ('analysis', 'Analysis'),
+    ('statistics', 'Statistics'),
+]
+
+# (value, label, aliases); Russian regions by their chemical centres
+REGIONS = [
+    ('moscow', 'Moscow', ('moscow',)),
+    ('st_petersburg', 'St. Petersburg', ('st petersburg', 'saint petersburg', 'leningrad')),
+    ('volga', 'Volga', ('volga', 'tatarstan', 'kazan', 'nizhnekamsk', 'samara', 'togliatti', 'tolyatti',
+                        'dzerzhinsk', 'nizhny novgorod', 'novokuibyshevsk', 'saratov', 'volgograd')),
+    ('ural', 'Ural', ('ural', 'urals', 'perm', 'bashkortostan', 'bashkiria', 'ufa', 'salavat',
+                      'sterlitamak', 'yekaterinburg', 'chelyabinsk', 'orenburg', 'berezniki')),
+    ('siberia', 'Siberia', ('siberia', 'siberian', 'tomsk', 'omsk', 'novosibirsk', 'tobolsk', 'irkutsk',
+                            'angarsk', 'krasnoyarsk', 'kemerovo', 'usolye')),
+    ('far_east', 'Far East', ('far east', 'vladivostok', 'khabarovsk', 'sakhalin', 'amur', 'nakhodka',
+                              'primorye')),
+    ('russia', 'Russia', ('russia', 'russian')),
+    ('ukraine', 'Ukraine', ('ukraine', 'ukrainian')),
+    ('belarus', 'Belarus', ('belarus', 'belarusian')),
+    ('kazakhstan', 'Kazakhstan', ('kazakhstan', 'kazakh')),
+    ('uzbekistan', 'Uzbekistan', ('uzbekistan', 'uzbek')),
+    ('turkmenistan', 'Turkmenistan', ('turkmenistan', 'turkmen')),
+    ('azerbaijan', 'Azerbaijan', ('azerbaijan', 'azeri')),
+    ('poland', 'Poland', ('poland', 'polish')),
+    ('czech_republic', 'Czech Republic', ('czech republic', 'czech')),
+    ('slovakia', 'Slovakia', ('slovakia', 'slovak')),
+    ('hungary', 'Hungary', ('hungary', 'hungarian')),
+    ('romania', 'Romania', ('romania', 'romanian')),
+    ('bulgaria', 'Bulgaria', ('bulgaria', 'bulgarian')),
+    ('serbia', 'Serbia', ('serbia', 'serbian')),
+    ('croatia', 'Croatia', ('croatia', 'croatian')),
+]
+
+COMPANIES = [
+    ('sibur', 'Sibur', ()),
+    ('gazprom', 'Gazprom', ('gazprom neft',)),
+    ('lukoil', 'LUKOIL', ()),
+    ('rosneft', 'Rosneft', ()),
+    ('tatneft', 'Tatneft', ()),
+    ('nizhnekamskneftekhim', 'Nizhnekamskneftekhim', ()),
+    ('kazanorgsintez', 'Kazanorgsintez', ()),
+    ('tomskneftekhim', 'Tomskneftekhim', ()),
+    ('salavatnefteorgsintez', 'Salavatnefteorgsintez', ('gazprom neftekhim salavat',)),
+    ('stavrolen', 'Stavrolen', ()),
+    ('acron', 'Acron', ('akron',)),
+    ('eurochem', 'EuroChem', ()),
+    ('phosagro', 'PhosAgro', ()),
+    ('uralchem', 'Uralchem', ()),
+    ('uralkali', 'Uralkali', ()),
+    ('togliattiazot', 'Togliattiazot', ()),
+    ('kuibyshevazot', 'Kuibyshevazot', ()),
+    ('metafrax', 'Metafrax Chemicals', ('metafrax chemicals',)),
+    ('shchekinoazot', 'Shchekinoazot', ()),
+    ('pkn_orlen', 'PKN Orlen', ('orlen',)),
+    ('unipetrol', 'Unipetrol', ('orlen unipetrol',)),
+    ('grupa_azoty', 'Grupa Azoty', ('azoty',)),
+    ('synthos', 'Synthos', ()),
+    ('ciech', 'Ciech', ()),
+    ('anwil', 'Anwil', ()),
+    ('mol', 'MOL', ('mol group',)),
+    ('spolana', 'Spolana', ()),
+    ('slovnaft', 'Slovnaft', ()),
+    ('duslo', 'Duslo', ()),
+    ('borsodchem', 'BorsodChem', ()),
+    ('nitrogenmuvek', 'Nitrogenmuvek', ()),
+    ('azomures', 'Azomures', ()),
+    ('oltchim', 'Oltchim', ()),
+    ('neochim', 'Neochim', ()),
+    ('petrohemija', 'Petrohemija', ()),
+    ('kazmunaygas', 'KazMunayGas', ()),
+    ('navoiyazot', 'Navoiyazot', ()),
+    ('socar', 'SOCAR', ()),
+    ('grodno_azot', 'Grodno Azot', ()),
+    ('naftan', 'Naftan', ()),
+    ('belaruskali', 'Belaruskali', ()),
+    ('rivneazot', 'Rivneazot', ()),
+    ('karpatneftekhim', 'Karpatneftekhim', ()),
+    ('ostchem', 'Ostchem', ()),
+]
+
+# (value, label, category, aliases)
+PRODUCTS = [
+    ('polyethylene', 'Polyethylene', 'polymers', ('ldpe', 'hdpe', 'lldpe', 'low density polyethylene',
+                                                  'high density polyethylene')),
+    ('polypropylene', 'Polypropylene', 'polymers', ()),
+    ('pvc', 'PVC', 'polymers', ('polyvinyl chloride', 'suspension pvc')),
+    ('polystyrene', 'Polystyrene', 'polymers', ('eps', 'expandable polystyrene')),
+    ('pet', 'PET', 'polymers', ('polyethylene terephthalate',)),
+    ('abs', 'ABS', 'polymers', ()),
+    ('synthetic_rubber', 'Synthetic rubber', 'polymers', ('synthetic rubber', 'synthetic rubbers',
+                                                          'butyl rubber', 'sbr', 'polybutadiene')),
+    ('ethylene', 'Ethylene', 'petrochemicals', ()),
+    ('propylene', 'Propylene', 'petrochemicals', ()),
+    ('butadiene', 'Butadiene', 'petrochemicals', ()),
+    ('benzene', 'Benzene', 'petrochemicals', ()),
+    ('toluene', 'Toluene', 'petrochemicals', ()),
+    ('xylenes', 'Xylenes', 'petrochemicals', ('xylene', 'paraxylene', 'orthoxylene')),
+    ('styrene', 'Styrene', 'petrochemicals', ()),
+    ('methanol', 'Methanol', 'petrochemicals', ()),
+    ('mtbe', 'MTBE', 'petrochemicals', ()),
+    ('glycols', 'Glycols', 'petrochemicals', ('glycol', 'ethylene glycol', 'monoethylene glycol', 'meg')),
+    ('phenol', 'Phenol', 'petrochemicals', ()),
+    ('acetone', 'Acetone', 'petrochemicals', ()),
+    ('acetic_acid', 'Acetic acid', 'petrochemicals', ('acetic acid',)),
+    ('caprolactam', 'Caprolactam', 'petrochemicals', ()),
+    ('ammonia', 'Ammonia', 'fertilizers', ()),
+    ('urea', 'Urea', 'fertilizers', ()),
+    ('ammonium_nitrate', 'Ammonium nitrate', 'fertilizers', ('ammonium nitrate',)),
+    ('nitrogen_fertilizers', 'Nitrogen fertilizers', 'fertilizers', ('nitrogen fertilizers',
+                                                                     'nitrogen fertilisers')),
+    ('potash', 'Potash fertilizers', 'fertilizers', ('potash fertilizers', 'potash fertilisers',
+                                                     'potassium chloride')),
+    ('phosphates', 'Phosphate fertilizers', 'fertilizers', ('phosphate fertilizers', 'phosphate fertilisers',
+                                                            'phosphates', 'phosphate')),
+    ('sulphuric_acid', 'Sulphuric acid', 'fertilizers', ('sulphuric acid', 'sulfuric acid')),
+    ('melamine', 'Melamine', 'specialty_chemicals', ()),
+    ('caustic_soda', 'Caustic soda', 'specialty_chemicals', ('caustic soda',)),
+    ('soda_ash', 'Soda ash', 'specialty_chemicals', ('soda ash',)),
+    ('chlorine', 'Chlorine', 'specialty_chemicals', ()),
+    ('carbon_black', 'Carbon black', 'specialty_chemicals', ('carbon black',)),
+    ('titanium_dioxide', 'Titanium dioxide', 'specialty_chemicals', ('titanium dioxide',)),
+    ('catalysts', 'Catalysts', 'specialty_chemicals', ('catalyst',)),
+]
+
+MARKET_WORDS = frozenset(('price', 'prices', 'market', 'markets', 'demand', 'forecast', 'outlook',
+                          'consumption', 'supply', 'balance'))
+ANALYSIS_WORDS = frozenset(('analysis', 'outlook', 'forecast', 'overview', 'review', 'perspectives',
+                            'prospects', 'comment'))
+REPORT_WORDS = frozenset(('report', 'survey', 'conference', 'annual'))
+# "Jan-Mar" style periods mark CMN's statistical items
+PERIOD_RE = re.compile(r'\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\s*-\s*'
+                       r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b', re.IGNORECASE)
+# Companies outside the gazetteer, by their legal form
+LEGAL_FORM_RE = re.compile(r'\b([A-Z][\w-]+(?: [A-Z][\w-]+){0,2}) (?:PJSC|OJSC|CJSC|JSC|OAO|PAO|ZAO|LLC|a\.s\.)')
+
+MARKET_MIN_HITS = 3
+CATEGORY_MIN_HITS = 2
+MAX_VALUE_LENGTH = 64
+
+
+def slugify(text):
+    return '_'.join(TOKEN_RE.findall((text or '').lower()))[:MAX_VALUE_LENGTH]
+
+
+def _gazetteer():
+    """``{first_token: [(alias_tokens, kind, value), ...]}``, longest aliases first."""
+    entries = {}
+
+    def add(kind, value, names):
+        for name in names:
+            tokens = tuple(TOKEN_RE.findall(name.lower()))
+            if tokens:
+                entries.setdefault(tokens[0], []).append((tokens, kind, value))
+
+    for value, label, aliases in REGIONS:
+        add('region', value, (label,) + aliases)
+    for value, label, aliases in COMPANIES:
+        add('company', value, (label,) + aliases)
+    for value, label, category, aliases in PRODUCTS:
+        add('product', value, (label,) + aliases)
+    for candidates in entries.values():
+        candidates.sort(key=lambda entry: -len(entry[0]))
+    return entries
+
+
+GAZETTEER = _gazetteer()
+LABELS = {
+    'category': dict(CATEGORIES),
+    'doc_type': dict(DOC_TYPES),
+    'region': {value: label for value, label, _ in REGIONS},
+    'company': {value: label for value, label, _ in COMPANIES},
+    'product': {value: label for value, label, _, _ in PRODUCTS},
+}
+PRODUCT_CATEGORIES = {value: category for value, _, category, _ in PRODUCTS}
+
+
+def _scan(tokens):
+    """Count gazetteer hits per ``(kind, value)``, matching the longest alias."""
+    hits = {}
+    i = 0
+    while i < len(tokens):
+        for alias, kind, value in GAZETTEER.get(tokens[i], ()):
+            if tuple(tokens[i:i + len(alias)]) == alias:
+                hits[(kind, value)] = hits.get((kind, value), 0) + 1
+                i += len(alias)
+                break
+        else:
+            i += 1
+    return hits
+
+
+def _doc_type(title, lead):
+    title_tokens = set(TOKEN_RE.findall(title.lower()))
+    if title_tokens & REPORT_WORDS:
+        return 'report'
+    if title_tokens & ANALYSIS_WORDS:
+        return 'analysis'
+    if PERIOD_RE.search(title) or 'statistics' in title_tokens:
+        return 'statistics'
+    if set(TOKEN_RE.findall(lead.lower())) & ANALYSIS_WORDS:
+        return 'analysis'
+    return 'news'
+
+
+def extract(title, content):
+    """``{(kind, value): label}`` for an article's facets."""
+    title = title or ''
+    content = content or ''
+    title_hits = _scan(TOKEN_RE.findall(title.lower()))
+    tokens = TOKEN_RE.findall(content.lower())
+    hits = _scan(tokens)
+
+    found = {}
+    for (kind, value) in set(title_hits) | set(hits):
+        found[(kind, value)] = LABELS[kind][value]
+    for name in LEGAL_FORM_RE.findall(content):
+        value = slugify(name)
+        if value and ('company', value) not in found:
+            found[('company', value)] = name
+
+    # Products in the title set the category; in the body they need to recur
+    categories = {}
+    for (kind, value), count in hits.items():
+        if kind == 'product':
+            category = PRODUCT_CATEGORIES[value]
+            categories[category] = categories.get(category, 0) + count
+    for (kind, value) in title_hits:
+        if kind == 'product':
+            categories[PRODUCT_CATEGORIES[value]] = CATEGORY_MIN_HITS
+    for category, count in categories.items():
+        if count >= CATEGORY_MIN_HITS:
+            found[('category', category)] = LABELS['category'][category]
+    if sum(1 for token in tokens if token in MARKET_WORDS) >= MARKET_MIN_HITS:
+        found[('category', 'market_analysis')] = LABELS['category']['market_analysis']
+
+    doc_type = _doc_type(title, content[:500])
+    found[('doc_type', doc_type)] = LABELS['doc_type'][doc_type]
+    return found
+
+
+def store_entities(connection, articles):
+    """Replace the facets of ``articles``, given as ``(id, title, content)``."""
+    write_entities(connection, [(article_id, extract(title, content)) for article_id, title, content in articles])
+
+
+def write_entities(connection, extracted):
+    """Replace facets with ``(id, extract(title, content))`` computed elsewhere."""
+    if not extracted:
+        return
+
+    entities = Entity.__table__
+    wanted = {}
+    for _, found in extracted:
+        wanted.update(found)
+    ids = {}
+    values = list({value for _, value in wanted})
+    for start in range(0, len(values), 500):
+        rows = connection.execute(
+            entities.select().with_only_columns(entities.c.id, entities.c.kind, entities.c.value)
+            .where(entities.c.value.in_(values[start:start + 500])))
+        ids.update({(row.kind, row.value): row.id for row in rows})
+    missing = [key for key in wanted if key not in ids]
+    if missing:
+        connection.execute(entities.insert(), [{'kind': kind, 'value': value, 'label': wanted[(kind, value)]}
+                                               for kind, value in missing])
+        rows = connection.execute(
+            entities.select().with_only_columns(entities.c.id, entities.c.kind, entities.c.value)
+            .where(entities.c.value.in_([value for _, value in missing])))
+        ids.update({(row.kind, row.value): row.id for row in rows})
+
+    links = ArticleEntity.__table__
+    connection.execute(links.delete().where(links.c.article_id.in_([aid for aid, _ in extracted])))
+    rows = [{'article_id': article_id, 'entity_id': ids[key]}
+            for article_id, found in extracted for key in found]
+    if rows:
+        connection.execute(links.insert(), rows)
@@ -0,0 +1,163 @@
+"""Serving the original CMN issue PDFs to subscribers.
+
+Files never pass through Python memory whole:
+
+* with ``ISSUE_ACCEL_REDIRECT`` set, nginx sends the file from an
+  ``internal`` location (``sendfile``, Range and caching included)::
+
+      location /protected-issues/ {
+          internal;
+          alias /srv/cirec/issues/;    # ISSUE_ACCEL_ROOT
+      }
+
+* with Flask's ``USE_X_SENDFILE``, Apache or lighttpd do the same from
+  an ``X-Sendfile`` header;
+* otherwise the file is streamed in blocks by ``send_file``, which
+  answers ``Range`` requests with 206 and hands whole files to the WSGI
+  server's ``wsgi.file_wrapper`` (gunicorn uses ``sendfile(2)``).
+
+Single pages for the in-browser previewer are cut from the issue once
+and kept in a rendition cache on disk, keyed by the issue's hash.
+"""
+import logging
+import os
+import tempfile
+from datetime import timezone
+
+from flask import abort, current_app, send_file
+
+from app.extensions import db
+from app.models.article import SourceFile
+from app.services.content import page_cache
+
+logger = logging.getLogger(__name__)
+
+PDF_MIMETYPE = 'application/pdf'
+
+
+def get_issue(issue_id):
+    """The ingested issue ``issue_id`` if its file is on disk, or 404.
+
+    Issues are addressed by id: two uploads may share a filename.
+    """
+    issue = db.session.get(SourceFile, issue_id)
+    if issue is None or not issue.file_path or not os.path.isfile(issue.file_path):
+        abort(404)
+    return issue
+
+
+def issue_for_article(article):
+    """The issue ``article`` was extracted from, found by its stored path."""
+    if not article.file_path:
+        return None
+    return SourceFile.query.filter_by(file_path=article.file_path).first()
+
+
+def issue_etag(issue, page=None):
+    # The content hash is a strong validator for the original and its pages
+    return issue.sha256[:32] if page is None else '%s-p%d' % (issue.sha256[:32], page)
+
+
+def _last_modified(issue):
+    return issue.ingested_at.replace(tzinfo=timezone.utc) if issue.ingested_at else None
+
+
+def _accel_path(path):
+    """The internal nginx URI for ``path``, if it lies under ``ISSUE_ACCEL_ROOT``."""
+    config = current_app.config
+    prefix, root = config.get('ISSUE_ACCEL_REDIRECT'), config.get('ISSUE_ACCEL_ROOT')
+    if not prefix or not root:
+        return None
+    root = os.path.abspath(root)
+    path = os.path.abspath(path)
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return prefix.rstrip('/') + '/' + os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def _private(response):
+    # Subscribers' copies only; never stored by shared caches
+    response.cache_control.no_cache = None
+    response.cache_control.public = None
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config.get('ISSUE_CACHE_SECONDS', 3600)
+    return response
+
+
+def unchanged(etag, last_modified=None):
+    """A 304 if the client's copy is current, else None."""
+    if not page_cache.revalidating():
+        return None
+    response = page_cache.not_modified(etag, last_modified, private=True)
+    return _private(response) if response is not None else None
+
+
+def send_pdf(path, etag, last_modified=None, download_name=None, as_attachment=False):
+    """Respond with the PDF at ``path``, honouring conditional and Range requests."""
+    response = unchanged(etag, last_modified)
+    if response is not None:
+        return response
+
+    accel = _accel_path(path)
+    if accel is not None:
+        response = current_app.response_class(mimetype=PDF_MIMETYPE)
+        response.headers['X-Accel-Redirect'] = accel
+        if download_name:
+            disposition = 'attachment' if as_attachment else 'inline'
+            response.headers.set('Content-Disposition', disposition, filename=download_name)
+    else:
+        response = send_file(os.path.abspath(path), mimetype=PDF_MIMETYPE, as_attachment=as_attachment,
+                             download_name=download_name, conditional=True, etag=etag,
+                             last_modified=last_modified)
+    response.set_etag(etag)
+    # Tell viewers they may fetch the file piecewise
+    response.accept_ranges = 'bytes'
+    return _private(response)
+
+
+def send_issue(issue, as_attachment=True):
+    return send_pdf(issue.file_path, issue_etag(issue), _last_modified(issue),
+                    download_name=issue.filename, as_attachment=as_attachment)
+
+
+def page_path(issue, page):
+    root = current_app.config.get('ISSUE_PAGE_CACHE_DIR', 'instance/issue_pages')
+    return os.path.join(root, issue.sha256[:2], issue.sha256, '%d.pdf' % page)
+
+
+def render_page(issue, page):
+    """Path of a one-page PDF of ``page`` (1-based), cut on first request."""
+    path = page_path(issue, page)
+    if os.path.exists(path):
+        return path
+    from PyPDF2 import PdfReader, PdfWriter
+
+    reader = PdfReader(issue.file_path)
+    if not 1 <= page <= len(reader.pages):
+        abort(404)
+    writer = PdfWriter()
+    writer.add_page(reader.pages[page - 1])
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write aside and rename, so a concurrent reader never sees half a file
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            writer.write(fh)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    logger.debug('Rendered page %d of %s', page, issue.filename)
+    return path
+
+
+def send_page(issue, page):
+    if issue.page_count and not 1 <= page <= issue.page_count:
+        abort(404)
+    etag = issue_etag(issue, page)
+    response = unchanged(etag, _last_modified(issue))
+    if response is not None:
+        return response
+    name = '%s-p%d.pdf' % (os.path.splitext(issue.filename)[0], page)
+    return send_pdf(render_page(issue, page), etag, _last_modified(issue), download_name=name)
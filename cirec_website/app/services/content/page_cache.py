@@ -0,0 +1,271 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+from functools import wraps
+
+from flask import current_app, has_app_context, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+
+from app.services.search import indexing_service
+from app.utils.helpers import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Generation of the published archive as a whole: home page, listings
+SITE = 'articles'
+
+
+class MemoryPageStore:
+    """Per-process store; the default, and the stand-in for Redis in tests.
+
+    Every store holds ``(body, content_type)`` pages and fragment HTML
+    strings. ``generations`` returns None when the store cannot be
+    reached; callers then render without the cache.
+    """
+
+    def __init__(self, maxsize=1024):
+        self._pages = LRUCache(maxsize=maxsize)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._pages.get(key)
+
+    def set(self, key, value, ttl):
+        self._pages.set(key, value, ttl=ttl)
+
+    def generations(self, names):
+        with self._lock:
+            return [self._generations.get(name, 0) for name in names]
+
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+
+def dumps(value):
+    """JSON for a stored page or fragment; bodies are base64 encoded."""
+    if isinstance(value, tuple):
+        body, content_type = value
+        return json.dumps({'body': base64.b64encode(body).decode('ascii'), 'content_type': content_type})
+    return json.dumps({'html': value})
+
+
+def loads(data):
+    value = json.loads(data)
+    if 'html' in value:
+        return value['html']
+    return base64.b64decode(value['body']), value['content_type']
+
+
+class RedisPageStore:
+    """Pages and generations shared by every worker.
+
+    Generations are Redis counters, so a publish in one worker (or in a
+    background task) moves every worker on to fresh keys; the superseded
+    entries are left to expire. Entries are JSON, never unpickled. While
+    Redis is unreachable every lookup is a miss and pages render afresh.
+    """
+
+    prefix = 'cirec:page:'
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self._errors = redis.exceptions.RedisError
+
+    def get(self, key):
+        try:
+            data = self.redis.get(self.prefix + key)
+        except self._errors as exc:
+            logger.warning('Page cache unavailable: %s', exc)
+            return None
+        return loads(data) if data is not None else None
+
+    def set(self, key, value, ttl):
+        try:
+            self.redis.set(self.prefix + key, dumps(value), ex=ttl or None)
+        except self._errors as exc:
+            logger.warning('Page cache unavailable: %s', exc)
+
+    def generations(self, names):
+        try:
+            values = self.redis.mget([self.prefix + 'gen:' + name for name in names])
+        except self._errors as exc:
+            logger.warning('Page cache unavailable: %s', exc)
+            return None
+        return [int(value or 0) for value in values]
+
+    def bump(self, names):
+        try:
+            pipe = self.redis.pipeline()
+            for name in names:
+                pipe.incr(self.prefix + 'gen:' + name)
+            pipe.execute()
+        except self._errors as exc:
+            # Other workers keep their entries until PAGE_CACHE_TTL
+            logger.warning('Page cache generations not bumped for %s: %s', names, exc)
+
+
+class NullPageStore:
+    """Caches nothing; every request renders."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def generations(self, names):
+        return [0] * len(names)
+
+    def bump(self, names):
+        pass
+
+
+def create_store(config):
+    backend = config.get('PAGE_CACHE_BACKEND', 'memory')
+    if backend == 'redis':
+        return RedisPageStore(config['PAGE_CACHE_REDIS_URL'])
+    if backend == 'null':
+        return NullPageStore()
+    return MemoryPageStore(config.get('PAGE_CACHE_SIZE', 1024))
+
+
+def get_store():
+    return current_app.extensions['page_cache']
+
+
+def article_generation(article_id):
+    return 'article:%d' % article_id
+
+
+@indexing_service.on_articles_changed
+def bump_generations(article_ids):
+    """Publishing or editing articles retires their pages and the site pages."""
+    if not has_app_context() or 'page_cache' not in current_app.extensions:
+        return
+    get_store().bump([SITE] + [article_generation(i) for i in sorted(article_ids)])
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:24]
+
+
+def not_modified(etag, last_modified=None, private=False):
+    """A 304 for the client's copy if it is still current, else None.
+
+    ``private`` must match the full response's, so a 304 never marks a
+    subscriber's page as storable by shared caches.
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    response = current_app.response_class(status=304)
+    return set_validators(response, etag, last_modified, private=private)
+
+
+def set_validators(response, etag, last_modified=None, private=False):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Always revalidate: the ETag makes that a cheap 304
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
+
+
+def revalidating():
+    """Whether a 304 may stand in for this response: no flash is pending."""
+    return request.method in ('GET', 'HEAD') and '_flashes' not in session
+
+
+def _cacheable_request():
+    # Pages carry the signed-in user's navigation, so only anonymous
+    # visitors share a page
+    return revalidating() and not current_user.is_authenticated
+
+
+def cached_page(article_arg=None):
+    """Cache a view's rendered response for anonymous visitors.
+
+    The key carries the site generation, or the article's generation
+    when ``article_arg`` names the view argument holding its id, so a
+    publish or edit only retires the pages that show that content.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not _cacheable_request():
+                return f(*args, **kwargs)
+            store = get_store()
+            if article_arg is not None:
+                names = [article_generation(kwargs[article_arg])]
+            else:
+                names = [SITE]
+            generations = store.generations(names)
+            if generations is None:
+                return f(*args, **kwargs)
+            key = '%s:%s:%s' % (request.endpoint, request.full_path,
+                                '.'.join(str(gen) for gen in generations))
+            etag = make_etag(key)
+
+            cached = store.get(key)
+            if cached is None:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.headers.get('Set-Cookie') or response.is_streamed:
+                    return response
+                cached = (response.get_data(), response.headers.get('Content-Type'))
+                store.set(key, cached, current_app.config.get('PAGE_CACHE_TTL', 300))
+                state = 'MISS'
+            else:
+                state = 'HIT'
+            response = not_modified(etag)
+            if response is None:
+                body, content_type = cached
+                response = current_app.response_class(body, content_type=content_type)
+                set_validators(response, etag)
+            # Signed-in visitors get their own page from the same URL
+            response.vary.add('Cookie')
+            response.headers['X-Cache'] = state
+            return response
+        return decorated_function
+    return decorator
+
+
+def cached_fragment(name, article_id, *variant, caller=None):
+    """Jinja ``{% call cached_fragment(...) %}`` block for one article.
+
+    The block is keyed by the article's generation and ``variant``, which
+    must name everything else it renders from (query, viewer's access).
+    """
+    store = get_store()
+    generations = store.generations([article_generation(article_id)])
+    if generations is None:
+        return Markup(str(caller()))
+    generation, = generations
+    key = 'fragment:%s:%d:%d:%s' % (name, article_id, generation, make_etag(variant))
+    html = store.get(key)
+    if html is None:
+        html = str(caller())
+        store.set(key, html, current_app.config.get('PAGE_CACHE_TTL', 300))
+    return Markup(html)
+
+
+def user_variant():
+    """What a page's navigation shows of the signed-in user, for ETags."""
+    if not current_user.is_authenticated:
+        return ('anonymous',)
+    return (current_user.id, current_user.first_name, current_user.is_admin, current_user.subscription_status)
+
+
+def init_app(app):
+    app.extensions['page_cache'] = create_store(app.config)
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
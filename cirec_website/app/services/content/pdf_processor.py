@@ -0,0 +1,418 @@
+import logging
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+
+from sqlalchemy import bindparam
+
+from app.extensions import db
+from app.models.article import Article, ArticleTermOffset, SourceFile
+from app.models.search_index import ArticleEntity, ArticlePassage
+from app.services.content.article_service import derived_fields, store_passages, store_term_offsets
+from app.services.content.entity_extractor import store_entities
+from app.services.search import indexing_service
+from app.services.tasks.task_queue import task
+from app.utils.file_handlers import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Running header printed at the top of every page after the cover
+RUNNING_HEADER_RE = re.compile(r'^(CIREC Monthly News, Issue no|Chemical Industry Trends in)', re.I)
+ISSUE_RE = re.compile(r'Issue\s+No:?\s*(\d+),?\s+(\d{1,2}\s+\w+\s+\d{4})', re.I)
+CONTENTS_RE = re.compile(r'^(?P<title>.+?)\s*(?:\.\s*){4,}\s*(?P<page>\d+)\s*$')
+
+MAX_TITLE_LENGTH = 200
+MIN_ARTICLE_LENGTH = 200
+
+
+def heading_key(line):
+    """Normalise a heading so PDF spacing artifacts still match."""
+    return re.sub(r'[^0-9a-z]', '', line.lower())
+
+
+def clean_title(title):
+    title = re.sub(r'\s+', ' ', title).strip()
+    title = re.sub(r'\s+-(?=\w)', '-', title)
+    return title[:MAX_TITLE_LENGTH]
+
+
+def is_section(title):
+    letters = [c for c in title if c.isalpha()]
+    return bool(letters) and sum(c.isupper() for c in letters) / len(letters) > 0.8
+
+
+def page_lines(text, strip_header=True):
+    lines = [re.sub(r'\s+', ' ', line).strip() for line in (text or '').splitlines()]
+    lines = [line for line in lines if line]
+    if strip_header:
+        lines = [line for line in lines[:3] if not RUNNING_HEADER_RE.match(line)] + lines[3:]
+    return lines
+
+
+def extract_pages(path, start, stop):
+    """Cleaned lines of pages ``start..stop-1``; runs in pool workers."""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    return [(number, page_lines(reader.pages[number].extract_text()))
+            for number in range(start, stop)]
+
+
+def read_issue(path):
+    """Page count, issue metadata and table of contents of one PDF.
+
+    CMN issues end with a contents listing (``Title ...... page``) and open
+    with a cover page, so only the first and last pages are read here.
+    """
+    # Imported here so web workers that never ingest do not load PyPDF2
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+    info = {'page_count': page_count, 'issue_number': None, 'issue_date': None,
+            'contents': [], 'first_page': 1 if page_count > 1 else 0, 'last_page': page_count}
+
+    match = ISSUE_RE.search(reader.pages[0].extract_text() or '')
+    if match:
+        info['issue_number'] = int(match.group(1))
+        try:
+            info['issue_date'] = datetime.strptime(match.group(2), '%d %B %Y').date()
+        except ValueError:
+            pass
+
+    contents = []
+    for number in range(page_count - 1, 0, -1):
+        entries = []
+        for line in page_lines(reader.pages[number].extract_text()):
+            entry = CONTENTS_RE.match(line)
+            if entry:
+                entries.append((clean_title(entry.group('title')), int(entry.group('page'))))
+        if not entries:
+            break
+        contents[:0] = entries
+        info['last_page'] = number
+    info['contents'] = contents
+    return info
+
+
+def looks_like_heading(line, previous):
+    words = line.split()
+    if not 2 <= len(words) <= 10 or len(line) > 80:
+        return False
+    if not (line[0].isupper() or line[0].isdigit()) or line[-1] in '.,;:':
+        return False
+    if previous and previous[-1] not in '.!?':
+        return False
+    if words[-1].lower() in ('the', 'a', 'an', 'of', 'and', 'to', 'in', 'for', 'at', 'by', 'with'):
+        return False
+    capitalised = sum(1 for w in words if w[0].isupper() or w[0].isdigit())
+    return capitalised / len(words) >= 0.4
+
+
+def split_articles(pages, contents=()):
+    """Group a stream of ``(page_number, lines)`` into articles.
+
+    Headings come from the issue's contents listing when it has one and
+    from a layout heuristic otherwise. Yields dicts with ``title``,
+    ``section``, ``content`` and ``pages``.
+    """
+    headings = {}
+    sections = set()
+    for title, _page in contents:
+        if is_section(title):
+            sections.add(heading_key(title))
+        else:
+            headings.setdefault(heading_key(title), title)
+
+    current = None
+    section = None
+    previous = None
+    for number, lines in pages:
+        for line in lines:
+            key = heading_key(line)
+            if contents:
+                starts_section = key in sections
+                starts_article = key in headings
+            else:
+                starts_section = is_section(line) and len(line.split()) <= 8
+                starts_article = not starts_section and looks_like_heading(line, previous)
+
+            if starts_section:
+                section = clean_title(line)
+                previous = None
+            elif starts_article:
+                # Fragments too short to stand alone stay with the previous article
+                if current is not None and current['size'] >= MIN_ARTICLE_LENGTH:
+                    yield _finish(current)
+                    current = None
+                if current is None:
+                    current = {'title': headings.get(key) or clean_title(line), 'section': section,
+                               'lines': [], 'size': 0, 'pages': [number + 1]}
+                previous = None
+            elif current is not None:
+                current['lines'].append(line)
+                current['size'] += len(line)
+                if current['pages'][-1] != number + 1:
+                    current['pages'].append(number + 1)
+                previous = line
+            else:
+                previous = line
+    if current is not None and current['lines']:
+        yield _finish(current)
+
+
+def _finish(article):
+    return {
+        'title': article['title'],
+        'section': article['section'],
+        'content': '\n'.join(article['lines']),
+        'pages': article['pages'],
+    }
+
+
+def _ordered_map(executor, fn, tasks, window):
+    """Yield ``(task, fn(*task))`` in order with at most ``window`` in flight."""
+    pending = deque()
+    tasks = iter(tasks)
+    for task in tasks:
+        pending.append((task, executor.submit(fn, *task)))
+        if len(pending) >= window:
+            break
+    while pending:
+        task, future = pending.popleft()
+        yield task, future.result()
+        for task in tasks:
+            pending.append((task, executor.submit(fn, *task)))
+            break
+
+
+class IngestStats:
+    """Counters and per-stage wall time for one ingestion run."""
+
+    def __init__(self):
+        self.counts = {'files': 0, 'skipped': 0, 'pages': 0, 'articles': 0, 'bytes': 0}
+        self.timings = {'hash': 0.0, 'extract': 0.0, 'split': 0.0, 'insert': 0.0}
+        self.started = time.perf_counter()
+        self._nested = []
+
+    def timed(self, stage, iterable):
+        """Charge the time spent producing each item to ``stage``.
+
+        Stages are chained generators, so time spent inside an upstream
+        stage is subtracted rather than counted twice.
+        """
+        iterator = iter(iterable)
+        while True:
+            self._nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+                done = False
+            except StopIteration:
+                done = True
+            elapsed = time.perf_counter() - start
+            self.timings[stage] += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            if done:
+                return
+            yield item
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+
+        def rate(count, seconds):
+            return round(count / seconds, 1) if seconds else None
+
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'counts': dict(self.counts),
+            'stage_seconds': {k: round(v, 3) for k, v in self.timings.items()},
+            'throughput': {
+                'hash_mb_per_second': rate(self.counts['bytes'] / 1e6, self.timings['hash']),
+                'extract_pages_per_second': rate(self.counts['pages'], self.timings['extract']),
+                'split_articles_per_second': rate(self.counts['articles'], self.timings['split']),
+                'insert_rows_per_second': rate(self.counts['articles'], self.timings['insert']),
+            },
+        }
+
+
+class PDFProcessor:
+    def __init__(self, workers=None, pages_per_task=4, batch_size=500):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.pages_per_task = pages_per_task
+        self.batch_size = batch_size
+
+    def _plan(self, paths, force, stats):
+        """Hash every file and read its contents pages, skipping known files."""
+        for path in paths:
+            path = os.path.abspath(path)
+            start = time.perf_counter()
+            digest = file_sha256(path)
+            stats.timings['hash'] += time.perf_counter() - start
+            stats.counts['bytes'] += os.path.getsize(path)
+
+            if not force and SourceFile.query.filter_by(sha256=digest).first() is not None:
+                stats.counts['skipped'] += 1
+                logger.info('Skipping unchanged %s', path)
+                continue
+            start = time.perf_counter()
+            info = read_issue(path)
+            stats.timings['extract'] += time.perf_counter() - start
+            info.update(path=path, sha256=digest)
+            yield info
+
+    def _tasks(self, plans):
+        for plan in plans:
+            for start in range(plan['first_page'], plan['last_page'], self.pages_per_task):
+                yield plan['path'], start, min(start + self.pages_per_task, plan['last_page'])
+
+    def _pages(self, plans):
+        tasks = self._tasks(plans)
+        if self.workers <= 1:
+            for task in tasks:
+                yield task[0], extract_pages(*task)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for task, result in _ordered_map(executor, extract_pages, tasks, self.workers * 2):
+                yield task[0], result
+
+    def ingest(self, paths, force=False):
+        """Extract ``paths`` into articles; returns an ``IngestStats`` report."""
+        stats = IngestStats()
+        plans = list(self._plan(paths, force, stats))
+        by_path = {plan['path']: plan for plan in plans}
+
+        pages = stats.timed('extract', self._pages(plans))
+        for path, chunks in groupby(pages, key=lambda item: item[0]):
+            plan = by_path[path]
+            page_stream = (page for _, chunk in chunks for page in chunk)
+            articles = stats.timed('split', split_articles(
+                self._count_pages(page_stream, stats), plan['contents']))
+            self._store(plan, articles, stats)
+            stats.counts['files'] += 1
+        return stats.report()
+
+    def _count_pages(self, pages, stats):
+        for page in pages:
+            stats.counts['pages'] += 1
+            yield page
+
+    def _store(self, plan, articles, stats):
+        """Write one file's articles.
+
+        Articles belong to the stored file's full path: two uploads that
+        share a name are different files. On a re-ingest, articles are
+        matched to the earlier ones by heading and updated in place, so
+        they keep their ids, view history and publication flag.
+        """
+        path = plan['path']
+        filename = os.path.basename(path)
+        issue_date = plan['issue_date']
+        created_at = datetime.combine(issue_date, datetime.min.time()) if issue_date else datetime.utcnow()
+
+        existing = {}
+        for row in db.session.query(Article.id, Article.title).filter_by(file_path=path).order_by(Article.id):
+            existing.setdefault(heading_key(row.title), deque()).append(row.id)
+        previous = [article_id for ids in existing.values() for article_id in ids]
+        inserted = []
+        try:
+            SourceFile.query.filter(
+                (SourceFile.file_path == path) | (SourceFile.sha256 == plan['sha256'])
+            ).delete(synchronize_session=False)
+
+            count = 0
+            last_id = max(previous, default=0)
+            inserts, updates = [], []
+            for article in articles:
+                row = {
+                    'title': article['title'],
+                    'content': article['content'],
+                    'source_file': filename,
+                    'updated_at': datetime.utcnow(),
+                    **derived_fields(article['content']),
+                }
+                ids = existing.get(heading_key(article['title']))
+                if ids:
+                    updates.append(dict(row, article_id=ids.popleft()))
+                else:
+                    inserts.append(dict(row, file_path=path, created_at=created_at, is_published=True,
+                                        view_count=0))
+                if len(inserts) >= self.batch_size:
+                    inserted += self._insert(path, inserts, stats, inserted[-1] if inserted else last_id)
+                    inserts = []
+                if len(updates) >= self.batch_size:
+                    self._update(updates, stats)
+                    updates = []
+                count += 1
+            if inserts:
+                inserted += self._insert(path, inserts, stats, inserted[-1] if inserted else last_id)
+            if updates:
+                self._update(updates, stats)
+
+            # Earlier articles the new extraction no longer has
+            removed = [article_id for ids in existing.values() for article_id in ids]
+            if removed:
+                ArticleTermOffset.query.filter(ArticleTermOffset.article_id.in_(removed)).delete(
+                    synchronize_session=False)
+                ArticlePassage.query.filter(ArticlePassage.article_id.in_(removed)).delete(
+                    synchronize_session=False)
+                ArticleEntity.query.filter(ArticleEntity.article_id.in_(removed)).delete(
+                    synchronize_session=False)
+                Article.query.filter(Article.id.in_(removed)).delete(synchronize_session=False)
+
+            db.session.add(SourceFile(
+                filename=filename, file_path=path, sha256=plan['sha256'],
+                size=os.path.getsize(path), page_count=plan['page_count'],
+                article_count=count, issue_number=plan['issue_number'], issue_date=issue_date,
+            ))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        stats.counts['articles'] += count
+        indexing_service.notify(previous + inserted)
+        logger.info('Ingested %s: %d articles', path, count)
+
+    def _derived(self, ids, batch):
+        """Replace the term offsets, passages and facets of ``batch``."""
+        contents = list(zip(ids, (row['content'] for row in batch)))
+        store_term_offsets(db.session.connection(), contents)
+        store_passages(db.session.connection(), contents)
+        store_entities(db.session.connection(),
+                       ((article_id, row['title'], row['content']) for article_id, row in zip(ids, batch)))
+
+    def _insert(self, path, batch, stats, after_id):
+        """Insert ``batch`` with its derived rows; returns the new ids."""
+        start = time.perf_counter()
+        db.session.execute(Article.__table__.insert(), batch)
+        # This file's rows past ``after_id`` are exactly this batch, in order
+        ids = [row.id for row in db.session.query(Article.id)
+               .filter(Article.file_path == path, Article.id > after_id)
+               .order_by(Article.id)]
+        self._derived(ids, batch)
+        stats.timings['insert'] += time.perf_counter() - start
+        return ids
+
+    def _update(self, batch, stats):
+        """Rewrite re-extracted articles in place, keyed by ``article_id``."""
+        start = time.perf_counter()
+        table = Article.__table__
+        db.session.execute(table.update().where(table.c.id == bindparam('article_id')), batch)
+        self._derived([row['article_id'] for row in batch], batch)
+        stats.timings['insert'] += time.perf_counter() - start
+
+
+def ingest_files(paths, workers=None, force=False, batch_size=500):
+    return PDFProcessor(workers=workers, batch_size=batch_size).ingest(paths, force=force)
+
+
+@task('content.ingest_pdfs', max_retries=2, retry_delay=60)
+def ingest_pdfs(paths, force=False):
+    """Background ingestion of uploaded issues."""
+    report = ingest_files(paths, workers=1, force=force)
+    logger.info('Ingestion finished: %s', report['counts'])
+    return report
@@ -0,0 +1,301 @@
+"""Resumable, chunked uploads of issue PDFs into a content-addressed store.
+
+An upload is opened with the file's name and size (and, ideally, its
+SHA-256), then sent as fixed-size parts in any order, each checked
+against the hash the client sends with it. Parts land in
+``UPLOAD_FOLDER/partial/<upload id>/`` as ``<index>-<sha256>.part``, so
+the parts received so far are simply the directory listing: any worker
+can take the next part, and a client that lost its connection asks which
+parts are missing and sends only those.
+
+Completed files are stored as ``UPLOAD_FOLDER/pdfs/<sha[:2]>/<sha>/<name>``.
+The directory is the content address; the original file name is kept
+because ingestion derives the issue from it. A file whose hash is
+already stored or ingested is a duplicate: it is not stored or ingested
+again, and when the hash is declared up front no bytes are sent at all.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import time
+
+from flask import abort, current_app
+from werkzeug.utils import secure_filename
+
+from app.models.article import SourceFile
+from app.utils.file_handlers import allowed_file
+
+logger = logging.getLogger(__name__)
+
+STREAM_BLOCK_SIZE = 64 * 1024
+MANIFEST = 'upload.json'
+PART_RE = re.compile(r'^(\d+)-([0-9a-f]{64})\.part$')
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _root():
+    return current_app.config['UPLOAD_FOLDER']
+
+
+def _partial_dir(upload_id=None):
+    path = os.path.join(_root(), 'partial')
+    return os.path.join(path, upload_id) if upload_id else path
+
+
+def stored_path(sha256):
+    """Directory holding the stored file with this content hash."""
+    return os.path.join(_root(), 'pdfs', sha256[:2], sha256)
+
+
+def find_stored(sha256):
+    """Path of the stored file with this hash, or None."""
+    directory = stored_path(sha256)
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if not name.endswith('.tmp'):
+                return os.path.join(directory, name)
+    return None
+
+
+def find_duplicate(sha256):
+    """The stored path or ingested issue of an upload with this hash, if any."""
+    issue = SourceFile.query.filter_by(sha256=sha256).first()
+    if issue is not None:
+        return {'filename': issue.filename, 'path': issue.file_path, 'ingested': True}
+    path = find_stored(sha256)
+    if path is not None:
+        return {'filename': os.path.basename(path), 'path': path, 'ingested': False}
+    return None
+
+
+def _copy(source, target, limit=None):
+    """Copy a stream into an open file in blocks; returns (bytes, sha256)."""
+    digest = hashlib.sha256()
+    size = 0
+    for block in iter(lambda: source.read(STREAM_BLOCK_SIZE), b''):
+        size += len(block)
+        if limit is not None and size > limit:
+            abort(400, 'Part is larger than expected')
+        digest.update(block)
+        target.write(block)
+    return size, digest.hexdigest()
+
+
+def _store(tmp, sha256, filename):
+    """Move a complete file at ``tmp`` into the store.
+
+    Returns ``(path, duplicate)``; a duplicate's bytes are discarded.
+    """
+    duplicate = find_duplicate(sha256)
+    if duplicate is not None:
+        os.unlink(tmp)
+        return duplicate['path'], duplicate
+    directory = stored_path(sha256)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    os.replace(tmp, path)
+    return path, None
+
+
+def _queue_ingestion(path):
+    from app.services.content.pdf_processor import ingest_pdfs
+    ingest_pdfs.delay([path])
+
+
+def _result(filename, sha256, path, duplicate):
+    if duplicate is None:
+        _queue_ingestion(path)
+        logger.info('Stored upload %s (%s); ingestion queued', filename, sha256[:12])
+    else:
+        logger.info('Upload %s duplicates %s', filename, duplicate['filename'])
+    return {'status': 'duplicate' if duplicate else 'queued', 'sha256': sha256,
+            'filename': filename, 'duplicate_of': duplicate['filename'] if duplicate else None}
+
+
+def _clean_filename(filename):
+    filename = secure_filename(filename or '')
+    if not filename or not allowed_file(filename):
+        abort(400, 'Please choose a PDF file to upload')
+    return filename
+
+
+def save_file(file_storage):
+    """Store a file posted in one request (a form upload) and queue it."""
+    filename = _clean_filename(file_storage.filename)
+    directory = os.path.join(_root(), 'pdfs')
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            _, sha256 = _copy(file_storage.stream, fh)
+        path, duplicate = _store(tmp, sha256, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return _result(filename, sha256, path, duplicate)
+
+
+# Chunked uploads
+
+def create_upload(filename, size, sha256=None):
+    """Open an upload; returns its state, or a duplicate result when
+    ``sha256`` names a file that is already stored."""
+    config = current_app.config
+    filename = _clean_filename(filename)
+    if not isinstance(size, int) or size <= 0:
+        abort(400, 'The file size is required')
+    if size > config.get('UPLOAD_MAX_SIZE', 2 * 1024 ** 3):
+        abort(413)
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        if not SHA256_RE.match(sha256):
+            abort(400, 'sha256 must be a hex SHA-256 digest')
+        duplicate = find_duplicate(sha256)
+        if duplicate is not None:
+            return _result(filename, sha256, duplicate['path'], duplicate)
+
+    purge_stale()
+    upload_id = secrets.token_hex(16)
+    directory = _partial_dir(upload_id)
+    os.makedirs(directory)
+    manifest = {
+        'id': upload_id, 'filename': filename, 'size': size, 'sha256': sha256,
+        'part_size': config.get('UPLOAD_PART_SIZE', 8 * 1024 * 1024), 'created': time.time(),
+    }
+    with open(os.path.join(directory, MANIFEST), 'w') as fh:
+        json.dump(manifest, fh)
+    return upload_state(upload_id)
+
+
+def _manifest(upload_id):
+    if not re.match(r'^[0-9a-f]{32}$', upload_id):
+        abort(404)
+    try:
+        with open(os.path.join(_partial_dir(upload_id), MANIFEST)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        abort(404)
+
+
+def _part_count(manifest):
+    return -(-manifest['size'] // manifest['part_size'])
+
+
+def _part_length(manifest, index):
+    return min(manifest['part_size'], manifest['size'] - index * manifest['part_size'])
+
+
+def _received(upload_id):
+    """``{index: (file name, sha256)}`` of the parts on disk."""
+    parts = {}
+    for name in os.listdir(_partial_dir(upload_id)):
+        match = PART_RE.match(name)
+        if match:
+            parts[int(match.group(1))] = (name, match.group(2))
+    return parts
+
+
+def upload_state(upload_id, manifest=None):
+    manifest = manifest or _manifest(upload_id)
+    received = _received(upload_id)
+    return {
+        'status': 'open', 'id': upload_id, 'filename': manifest['filename'],
+        'size': manifest['size'], 'part_size': manifest['part_size'], 'parts': _part_count(manifest),
+        'received': {index: received[index][1] for index in sorted(received)},
+        'missing': [index for index in range(_part_count(manifest)) if index not in received],
+    }
+
+
+def write_part(upload_id, index, stream, sha256):
+    """Write part ``index`` from ``stream``, keeping it only if its hash is ``sha256``."""
+    manifest = _manifest(upload_id)
+    if not 0 <= index < _part_count(manifest):
+        abort(404)
+    sha256 = (sha256 or '').lower()
+    if not SHA256_RE.match(sha256):
+        abort(400, 'Each part needs its SHA-256 in the X-Part-SHA256 header')
+    received = _received(upload_id)
+    if index in received and received[index][1] == sha256:
+        return upload_state(upload_id, manifest)  # a retry of a part that did arrive
+
+    directory = _partial_dir(upload_id)
+    expected = _part_length(manifest, index)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            size, digest = _copy(stream, fh, limit=expected)
+        if size != expected:
+            abort(400, 'Part %d should be %d bytes, got %d' % (index, expected, size))
+        if digest != sha256:
+            abort(400, 'Part %d does not match its SHA-256' % index)
+        os.replace(tmp, os.path.join(directory, '%05d-%s.part' % (index, digest)))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    if index in received:
+        os.unlink(os.path.join(directory, received[index][0]))
+    return upload_state(upload_id, manifest)
+
+
+def complete_upload(upload_id):
+    """Join the parts, check the whole file's hash, store it and queue ingestion."""
+    manifest = _manifest(upload_id)
+    received = _received(upload_id)
+    missing = [index for index in range(_part_count(manifest)) if index not in received]
+    if missing:
+        abort(409, 'Parts still missing: %s' % ', '.join(map(str, missing[:20])))
+
+    directory = _partial_dir(upload_id)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            digest = hashlib.sha256()
+            for index in range(_part_count(manifest)):
+                with open(os.path.join(directory, received[index][0]), 'rb') as part:
+                    for block in iter(lambda: part.read(STREAM_BLOCK_SIZE), b''):
+                        digest.update(block)
+                        fh.write(block)
+        sha256 = digest.hexdigest()
+        if manifest['sha256'] and sha256 != manifest['sha256']:
+            abort(400, 'The assembled file does not match its SHA-256')
+        path, duplicate = _store(tmp, sha256, manifest['filename'])
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    shutil.rmtree(directory, ignore_errors=True)
+    return _result(manifest['filename'], sha256, path, duplicate)
+
+
+def abort_upload(upload_id):
+    _manifest(upload_id)
+    shutil.rmtree(_partial_dir(upload_id), ignore_errors=True)
+
+
+def purge_stale(max_age=None):
+    """Remove uploads left unfinished for longer than ``UPLOAD_EXPIRE_HOURS``."""
+    if max_age is None:
+        max_age = current_app.config.get('UPLOAD_EXPIRE_HOURS', 24) * 3600
+    root = _partial_dir()
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for upload_id in os.listdir(root):
+        directory = os.path.join(root, upload_id)
+        # Activity is the newest part, or the manifest for an upload with none
+        try:
+            newest = max(os.path.getmtime(os.path.join(directory, name)) for name in os.listdir(directory))
+        except (OSError, ValueError):
+            newest = 0
+        if newest < cutoff:
+            shutil.rmtree(directory, ignore_errors=True)
+            removed += 1
+    return removed
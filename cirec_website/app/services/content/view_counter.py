@@ -0,0 +1,249 @@
+import atexit
+import logging
+import threading
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.exc import DBAPIError, OperationalError, TimeoutError as PoolTimeoutError
+
+from app.extensions import db
+from app.models.article import Article, ArticleViewDaily
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryViewBuffer:
+    """Per-process buffer of ``(article_id, day) -> views``."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, article_id, day, n=1):
+        with self._lock:
+            self._counts[(article_id, day)] += n
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        return counts
+
+    def pending(self, article_id):
+        with self._lock:
+            return sum(n for (aid, _), n in self._counts.items() if aid == article_id)
+
+
+class RedisViewBuffer:
+    """Buffer shared by all workers in a Redis hash.
+
+    ``drain`` renames the hash before reading it, so increments that
+    arrive during a flush land in a fresh hash and are never lost.
+    """
+
+    key = 'cirec:views:pending'
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+
+    def add(self, article_id, day, n=1):
+        self.redis.hincrby(self.key, '%d:%s' % (article_id, day.isoformat()), n)
+
+    def drain(self):
+        from redis.exceptions import ResponseError
+
+        flushing = '%s:flushing:%s' % (self.key, uuid.uuid4().hex)
+        try:
+            self.redis.rename(self.key, flushing)
+        except ResponseError:
+            # Nothing buffered, or another worker drained it first
+            return Counter()
+        pipe = self.redis.pipeline()
+        pipe.hgetall(flushing)
+        pipe.delete(flushing)
+        raw, _ = pipe.execute()
+        counts = Counter()
+        for field, n in raw.items():
+            article_id, day = field.decode().split(':')
+            counts[(int(article_id), date.fromisoformat(day))] += int(n)
+        return counts
+
+    def pending(self, article_id):
+        prefix = '%d:' % article_id
+        return sum(int(n) for field, n in self.redis.hgetall(self.key).items()
+                   if field.decode().startswith(prefix))
+
+
+def _upsert_daily(rows):
+    table = ArticleViewDaily.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.article_id, table.c.day],
+            set_={'views': table.c.views + stmt.excluded.views},
+        )
+        db.session.execute(stmt, rows)
+        return
+    for row in rows:
+        updated = db.session.execute(
+            table.update()
+            .where(table.c.article_id == row['article_id'], table.c.day == row['day'])
+            .values(views=table.c.views + row['views'])
+        ).rowcount
+        if not updated:
+            db.session.execute(table.insert(), [row])
+
+
+def _transient(exc):
+    """Whether a failed flush is worth retrying with the same views."""
+    if isinstance(exc, DBAPIError) and exc.connection_invalidated:
+        return True
+    return isinstance(exc, (OperationalError, PoolTimeoutError))
+
+
+class ViewCounter:
+    """Write-behind article view counting.
+
+    Views are buffered and flushed every ``interval`` seconds as one
+    batched ``view_count = view_count + n`` update plus an upsert into
+    the per-day aggregates, instead of a row update and commit per view.
+    """
+
+    def __init__(self, app, buffer, interval=10):
+        self.app = app
+        self.buffer = buffer
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def record(self, article_id, n=1):
+        self.buffer.add(article_id, datetime.utcnow().date(), n)
+        self._ensure_thread()
+
+    def pending(self, article_id):
+        return self.buffer.pending(article_id)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing article views failed')
+
+    def flush(self):
+        """Write buffered views; returns the number of views written.
+
+        Views of articles deleted since they were buffered are dropped.
+        When the write fails, the views are put back for the next flush
+        only if the error is transient (a lost connection, a timeout);
+        anything else would fail again on every flush.
+        """
+        counts = self.buffer.drain()
+        if not counts:
+            return 0
+
+        table = Article.__table__
+        with self.app.app_context():
+            try:
+                ids = sorted({article_id for article_id, _ in counts})
+                live = set()
+                for start in range(0, len(ids), 1000):
+                    chunk = ids[start:start + 1000]
+                    live.update(db.session.scalars(select(table.c.id).where(table.c.id.in_(chunk))))
+                if len(live) < len(ids):
+                    logger.info('Dropping views of %d deleted articles', len(ids) - len(live))
+                counts = Counter({key: n for key, n in counts.items() if key[0] in live})
+                totals = Counter()
+                for (article_id, _), n in counts.items():
+                    totals[article_id] += n
+                if totals:
+                    db.session.execute(
+                        table.update()
+                        .where(table.c.id == bindparam('article_id'))
+                        # Keep updated_at: a view is not an edit of the article
+                        .values(view_count=func.coalesce(table.c.view_count, 0) + bindparam('n'),
+                                updated_at=table.c.updated_at),
+                        [{'article_id': aid, 'n': n} for aid, n in sorted(totals.items())],
+                    )
+                    _upsert_daily([{'article_id': aid, 'day': day, 'views': n}
+                                   for (aid, day), n in sorted(counts.items())])
+                db.session.commit()
+            except Exception as exc:
+                db.session.rollback()
+                if _transient(exc):
+                    # Put the views back so the next flush retries them
+                    for (article_id, day), n in counts.items():
+                        self.buffer.add(article_id, day, n)
+                raise
+        return sum(totals.values())
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Final flush of article views failed')
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_counter():
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                app = current_app._get_current_object()
+                url = app.config.get('VIEW_COUNTER_REDIS_URL')
+                buffer = RedisViewBuffer(url) if url else MemoryViewBuffer()
+                _counter = ViewCounter(app, buffer, app.config.get('VIEW_COUNT_FLUSH_SECONDS', 10))
+                atexit.register(_counter.stop)
+    return _counter
+
+
+def record_view(article_id):
+    get_counter().record(article_id)
+
+
+def flush():
+    return get_counter().flush()
+
+
+def daily_views(days=30):
+    """Total views per day for the last ``days`` days, oldest first."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = (db.session.query(ArticleViewDaily.day, func.sum(ArticleViewDaily.views))
+            .filter(ArticleViewDaily.day >= since)
+            .group_by(ArticleViewDaily.day)
+            .order_by(ArticleViewDaily.day))
+    return [(day, int(views)) for day, views in rows]
+
+
+def top_articles(days=7, limit=10):
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    total = func.sum(ArticleViewDaily.views).label('views')
+    return (db.session.query(Article.id, Article.title, total)
+            .join(ArticleViewDaily, ArticleViewDaily.article_id == Article.id)
+            .filter(ArticleViewDaily.day >= since)
+            .group_by(Article.id, Article.title)
+            .order_by(total.desc())
+            .limit(limit)
+            .all())
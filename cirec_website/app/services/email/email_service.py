@@ -0,0 +1,142 @@
+import atexit
+import logging
+import re
+import smtplib
+import threading
+
+from flask import current_app, render_template
+from flask_mail import Message
+
+from app.extensions import mail
+from app.services.tasks.task_queue import Retry, task
+
+logger = logging.getLogger(__name__)
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def is_permanent(exc):
+    """Whether the server rejected a message for good (a 5xx reply)."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+@task('email.deliver_batch', max_retries=5, retry_delay=30)
+def deliver_batch(messages):
+    """Send ``messages`` (Message keyword dicts) over one SMTP connection.
+
+    Messages the server rejects with a 5xx reply are logged and dropped;
+    they would fail the same way on every retry. On any other error only
+    the message that failed and those after it are retried. Returns the
+    number of messages sent.
+    """
+    done = sent = 0
+    try:
+        with mail.connect() as connection:
+            for message in messages:
+                try:
+                    connection.send(Message(**message))
+                    sent += 1
+                except smtplib.SMTPException as exc:
+                    if not is_permanent(exc):
+                        raise
+                    logger.warning('Mail to %r rejected, dropping it: %s', message['recipients'], exc)
+                done += 1
+    except Exception as exc:
+        logger.warning('Mail delivery stopped after %d of %d messages: %s', done, len(messages), exc)
+        raise Retry(messages[done:]) from exc
+    return sent
+
+
+class Outbox:
+    """Collects outgoing mail and queues it in batches.
+
+    Messages are queued as one ``deliver_batch`` job when ``batch_size``
+    have been collected or ``interval`` seconds have passed, so a burst
+    of mail shares one SMTP connection and requests never wait on SMTP.
+    """
+
+    def __init__(self, batch_size=50, interval=2):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._messages = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def add(self, message):
+        with self._lock:
+            self._messages.append(message)
+            full = len(self._messages) >= self.batch_size
+        if full:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='mail-outbox', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Queueing outgoing mail failed')
+
+    def flush(self):
+        """Queue everything collected so far; returns the number of messages."""
+        with self._lock:
+            messages, self._messages = self._messages, []
+        for start in range(0, len(messages), self.batch_size):
+            deliver_batch.delay(messages[start:start + self.batch_size])
+        return len(messages)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                config = current_app.config
+                _outbox = Outbox(config.get('MAIL_BATCH_SIZE', 50), config.get('MAIL_BATCH_SECONDS', 2))
+                atexit.register(_outbox.stop)
+    return _outbox
+
+
+def send_email(subject, recipients, template, **context):
+    """Render ``template`` now and deliver it in the background."""
+    html = render_template(template, **context)
+    get_outbox().add({
+        'subject': subject,
+        'recipients': list(recipients),
+        'html': html,
+        'body': ' '.join(TAG_RE.sub(' ', html).split()),
+        'sender': current_app.config.get('MAIL_DEFAULT_SENDER'),
+    })
+
+
+def flush():
+    return get_outbox().flush()
+
+
+def send_welcome_email(user):
+    send_email('Welcome to CIREC', [user.email], 'email/welcome.html', user=user)
+
+
+def send_password_reset_email(user, token):
+    send_email('Reset your CIREC password', [user.email], 'email/password_reset.html',
+               user=user, token=token)
@@ -0,0 +1,247 @@
+import logging
+import queue
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from flask import current_app
+from sqlalchemy import bindparam, select
+
+from app.extensions import db
+from app.models.newsletter import Campaign, CampaignRecipient
+from app.models.user import User
+from app.services.email.templates import render_variant
+from app.services.tasks.task_queue import task
+from app.utils.helpers import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Who receives each kind of campaign
+AUDIENCES = {
+    'active_subscribers': lambda: [User.is_active.is_(True), User.subscription_status == 'active'],
+    'newsletter': lambda: [User.is_active.is_(True), User.newsletter.is_(True)],
+}
+
+# Recipient columns; account_type selects the rendered variant
+RECIPIENT_COLUMNS = (User.id, User.email, User.first_name, User.last_name, User.account_type)
+
+# A campaign whose runner has not reported for this long may be taken over
+STALE_AFTER = timedelta(minutes=5)
+
+
+def smtp_connection(config):
+    """Open an SMTP connection from the ``MAIL_*`` settings."""
+    host, port = config['MAIL_SERVER'], config['MAIL_PORT']
+    if config.get('MAIL_USE_SSL'):
+        connection = smtplib.SMTP_SSL(host, port, timeout=30)
+    else:
+        connection = smtplib.SMTP(host, port, timeout=30)
+        if config.get('MAIL_USE_TLS'):
+            connection.starttls()
+    # Local debugging servers do not offer AUTH
+    if config.get('MAIL_USERNAME') and connection.has_extn('auth'):
+        connection.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+    return connection
+
+
+class SMTPPool:
+    """``size`` threads, each sending over its own persistent SMTP connection.
+
+    A shared token bucket keeps the combined rate at ``rate`` messages
+    per second. A dropped connection is reopened and the message tried
+    once more; results come back from ``result()`` as
+    ``(key, error_or_None)``, one for every submitted message.
+    """
+
+    def __init__(self, connect, size=4, rate=None):
+        self.connect = connect
+        self.size = size
+        self.bucket = TokenBucket(rate, capacity=size) if rate else None
+        self._jobs = queue.Queue(maxsize=size * 4)
+        self._results = queue.Queue()
+        self._threads = []
+
+    def __enter__(self):
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, name='smtp-%d' % i, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def __exit__(self, *exc):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, key, message):
+        self._jobs.put((key, message))
+
+    def result(self):
+        return self._results.get()
+
+    def _work(self):
+        connection = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            key, message = job
+            error = None
+            try:
+                if self.bucket is not None:
+                    self.bucket.wait()
+                for attempt in range(2):
+                    try:
+                        if connection is None:
+                            connection = self.connect()
+                        connection.send_message(message)
+                        error = None
+                        break
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                            smtplib.SMTPDataError) as exc:
+                        error = exc
+                        break
+                    except (smtplib.SMTPException, OSError) as exc:
+                        error = exc
+                        self._close(connection)
+                        connection = None
+            except Exception as exc:
+                # The sender waits for a result per message, so no job may
+                # end without one, and the worker must live on for the next
+                logger.exception('Sending %s failed', key)
+                error = exc
+                self._close(connection)
+                connection = None
+            self._results.put((key, (str(error) or type(error).__name__)[:255] if error else None))
+        self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        if connection is None:
+            return
+        try:
+            connection.quit()
+        except Exception:
+            connection.close()
+
+
+def _claim(campaign_id):
+    """Mark the campaign as being sent by this runner; False if another runner has it."""
+    now = datetime.utcnow()
+    table = Campaign.__table__
+    claimed = db.session.execute(
+        table.update()
+        .where(table.c.id == campaign_id, table.c.status != 'done')
+        .where((table.c.status != 'sending') | table.c.heartbeat_at.is_(None)
+               | (table.c.heartbeat_at < now - STALE_AFTER))
+        .values(status='sending', heartbeat_at=now,
+                started_at=db.func.coalesce(table.c.started_at, now))
+    ).rowcount
+    db.session.commit()
+    return bool(claimed)
+
+
+def _build(sender, recipient, variant):
+    subject, html_body, text_body = variant.personalise(recipient)
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient.email
+    message['Subject'] = subject
+    message.set_content(text_body)
+    message.add_alternative(html_body, subtype='html')
+    return message
+
+
+def run_campaign(campaign_id, chunk_size=None, pool_size=None, rate=None):
+    """Send a campaign, resuming where an earlier run stopped.
+
+    Recipients are streamed in id order through a server-side cursor and
+    handled ``chunk_size`` at a time: each chunk is claimed and committed
+    before any of it is sent, then marked sent or failed. Anyone claimed
+    by a run that crashed mid-chunk stays ``claimed`` and is not mailed
+    again. Returns the campaign's counts.
+    """
+    config = current_app.config
+    chunk_size = chunk_size or config.get('NEWSLETTER_CHUNK_SIZE', 500)
+    pool_size = pool_size or config.get('MAIL_POOL_SIZE', 4)
+    rate = rate if rate is not None else config.get('MAIL_RATE_LIMIT', 10)
+    sender = config.get('MAIL_DEFAULT_SENDER')
+
+    if not _claim(campaign_id):
+        logger.info('Campaign %s is finished or being sent elsewhere', campaign_id)
+        return None
+    campaign = db.session.get(Campaign, campaign_id)
+    context = dict(campaign.context or {})
+    recipients = (select(*RECIPIENT_COLUMNS)
+                  .where(*AUDIENCES[campaign.audience](), User.id > campaign.last_user_id)
+                  .order_by(User.id))
+    variants = {}
+    table = CampaignRecipient.__table__
+
+    # Stream on a connection of its own so commits of progress leave the cursor open
+    with db.engine.connect() as stream, \
+            SMTPPool(lambda: smtp_connection(config), size=pool_size, rate=rate) as pool:
+        result = stream.execution_options(stream_results=True, yield_per=chunk_size).execute(recipients)
+        for chunk in result.partitions():
+            ids = [row.id for row in chunk]
+            done = {user_id for (user_id,) in db.session.execute(
+                select(table.c.user_id).where(table.c.campaign_id == campaign_id, table.c.user_id.in_(ids)))}
+            todo = [row for row in chunk if row.id not in done]
+            if todo:
+                db.session.execute(table.insert(), [
+                    {'campaign_id': campaign_id, 'user_id': row.id, 'status': 'claimed'} for row in todo])
+            campaign.last_user_id = ids[-1]
+            campaign.heartbeat_at = datetime.utcnow()
+            db.session.commit()
+
+            for row in todo:
+                variant = variants.get(row.account_type)
+                if variant is None:
+                    variant = variants[row.account_type] = render_variant(
+                        campaign.template, account_type=row.account_type, **context)
+                pool.submit(row.id, _build(sender, row, variant))
+            outcomes = [pool.result() for _ in todo]
+
+            now = datetime.utcnow()
+            if outcomes:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.campaign_id == campaign_id, table.c.user_id == bindparam('recipient'))
+                    .values(status=bindparam('outcome'), error=bindparam('message'), sent_at=bindparam('at')),
+                    [{'recipient': user_id, 'outcome': 'failed' if error else 'sent', 'message': error,
+                      'at': None if error else now} for user_id, error in outcomes])
+            failed = sum(1 for _, error in outcomes if error)
+            campaign.sent_count += len(outcomes) - failed
+            campaign.failed_count += failed
+            campaign.heartbeat_at = now
+            db.session.commit()
+            logger.info('Campaign %s: %d sent, %d failed so far', campaign_id,
+                        campaign.sent_count, campaign.failed_count)
+
+    campaign.status = 'done'
+    campaign.finished_at = datetime.utcnow()
+    db.session.commit()
+    return {'sent': campaign.sent_count, 'failed': campaign.failed_count,
+            'variants': len(variants)}
+
+
+def create_campaign(template, audience='active_subscribers', **context):
+    campaign = Campaign(template=template, audience=audience, context=context)
+    db.session.add(campaign)
+    db.session.commit()
+    return campaign
+
+
+@task('email.send_campaign', max_retries=3, retry_delay=60)
+def send_campaign(campaign_id):
+    """Background run of ``run_campaign``; retries resume the campaign."""
+    try:
+        return run_campaign(campaign_id)
+    except Exception:
+        # Let the retry take the campaign over without waiting for it to go stale
+        db.session.rollback()
+        Campaign.query.filter_by(id=campaign_id, status='sending').update({'heartbeat_at': None})
+        db.session.commit()
+        raise
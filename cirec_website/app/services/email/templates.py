@@ -0,0 +1,48 @@
+import html
+import re
+from string import Template
+
+from flask import render_template
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+# Bulk mailings. Subjects may use the campaign context ($issue_number);
+# the body template is rendered by Jinja once per variant.
+CAMPAIGN_TEMPLATES = {
+    'issue_notice': {
+        'subject': 'CIREC Monthly News: Issue $issue_number is out',
+        'template': 'email/issue_notice.html',
+    },
+}
+
+# Per-recipient fields, filled in after rendering
+PERSONAL_FIELDS = ('first_name', 'last_name', 'email')
+
+
+class RenderedVariant:
+    """A campaign email rendered once, with ``$field`` slots for each recipient."""
+
+    def __init__(self, subject, html_body):
+        self.subject = Template(subject)
+        self.html = Template(html_body)
+        self.text = Template(' '.join(TAG_RE.sub(' ', html_body).split()))
+
+    def personalise(self, recipient):
+        values = {name: getattr(recipient, name) or '' for name in PERSONAL_FIELDS}
+        escaped = {name: html.escape(value) for name, value in values.items()}
+        return (self.subject.safe_substitute(values),
+                self.html.safe_substitute(escaped),
+                self.text.safe_substitute(values))
+
+
+def render_variant(name, **context):
+    """Render campaign template ``name`` for one variant of its audience.
+
+    Personal fields are passed to Jinja as ``${field}`` placeholders and
+    substituted per recipient, so Jinja runs once per variant instead of
+    once per recipient.
+    """
+    spec = CAMPAIGN_TEMPLATES[name]
+    placeholders = {field: '${%s}' % field for field in PERSONAL_FIELDS}
+    subject = Template(spec['subject']).safe_substitute({k: str(v) for k, v in context.items()})
+    return RenderedVariant(subject, render_template(spec['template'], **context, **placeholders))
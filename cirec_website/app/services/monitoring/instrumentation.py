@@ -0,0 +1,208 @@
+import atexit
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.services.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+_installed = False
+_local = threading.local()
+# cProfile can only run one profiler at a time on Python 3.12+
+_profile_lock = threading.Lock()
+_profiles = deque(maxlen=20)
+# Set when METRICS_DIR is configured; see metrics.SharedDirectory
+_shared = None
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _request_state():
+    if has_request_context():
+        return g.get('instrumentation')
+    return None
+
+
+# --- SQL --------------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    state = _request_state()
+    if state is None:
+        # Background tasks and search worker threads
+        metrics.sql_duration.observe(elapsed, '-')
+        return
+    state['sql_count'] += 1
+    state['sql_time'] += elapsed
+    state['statements'][statement] += 1
+    metrics.sql_duration.observe(elapsed, _endpoint())
+
+
+def _handle_error(context):
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+# --- Templates ----------------------------------------------------------------
+
+def _before_render(sender, template, context, **extra):
+    _local.__dict__.setdefault('templates', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    starts = getattr(_local, 'templates', None)
+    if starts:
+        metrics.template_render.observe(time.perf_counter() - starts.pop(), template.name or '-')
+
+
+# --- Profiling ------------------------------------------------------------------
+
+def _wants_profile(config):
+    token = config.get('PROFILE_TOKEN')
+    header = request.headers.get(config.get('PROFILE_HEADER', 'X-Profile'))
+    if token and header and hmac.compare_digest(header, token):
+        return True
+    rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def _start_profile():
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiler is active (e.g. a debugger)
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def _finish_profile(profiler, endpoint, elapsed):
+    profiler.disable()
+    _profile_lock.release()
+    profile_id = uuid.uuid4().hex[:12]
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(current_app.config.get('PROFILE_TOP_FUNCTIONS', 40))
+    _profiles.append({
+        'id': profile_id, 'endpoint': endpoint, 'path': request.full_path,
+        'at': datetime.utcnow(), 'seconds': elapsed, 'report': out.getvalue(),
+    })
+    directory = current_app.config.get('PROFILE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        stats.dump_stats(os.path.join(directory, '%s-%s.prof' % (endpoint, profile_id)))
+    metrics.profiled_requests.inc(endpoint)
+    return profile_id
+
+
+def recent_profiles():
+    return list(reversed(_profiles))
+
+
+def get_profile(profile_id):
+    for profile in _profiles:
+        if profile['id'] == profile_id:
+            return profile
+    return None
+
+
+# --- Requests ----------------------------------------------------------------------
+
+def _before_request():
+    config = current_app.config
+    g.instrumentation = state = {
+        'start': time.perf_counter(), 'sql_count': 0, 'sql_time': 0.0, 'statements': Counter(),
+    }
+    if _wants_profile(config):
+        state['profiler'] = _start_profile()
+
+
+def _after_request(response):
+    state = g.pop('instrumentation', None)
+    if state is None:
+        return response
+    config = current_app.config
+    endpoint = _endpoint()
+    profiler = state.get('profiler')
+    elapsed = time.perf_counter() - state['start']
+    if profiler is not None:
+        response.headers['X-Profile-Id'] = _finish_profile(profiler, endpoint, elapsed)
+
+    metrics.request_latency.observe(elapsed, endpoint, request.method, str(response.status_code))
+    metrics.sql_statements.observe(state['sql_count'], endpoint)
+
+    threshold = config.get('N_PLUS_ONE_THRESHOLD', 10)
+    if threshold and state['statements']:
+        statement, count = state['statements'].most_common(1)[0]
+        if count >= threshold:
+            metrics.n_plus_one.inc(endpoint)
+            logger.warning('Possible N+1 in %s: %d runs of %s', endpoint, count, ' '.join(statement.split())[:300])
+
+    slow = config.get('SLOW_REQUEST_SECONDS', 1.0)
+    if slow and elapsed >= slow:
+        logger.warning('Slow request %s %s: %.3fs, %d queries in %.3fs', request.method, request.full_path,
+                       elapsed, state['sql_count'], state['sql_time'])
+    if _shared is not None:
+        _shared.dump()
+    return response
+
+
+def _teardown_request(exc):
+    # after_request did not run (an error before the view); free the profiler
+    state = g.pop('instrumentation', None)
+    if state is not None and state.get('profiler') is not None:
+        state['profiler'].disable()
+        _profile_lock.release()
+
+
+def init_app(app):
+    """Time requests, SQL and templates, and profile requests on demand."""
+    global _installed, _shared
+    if not app.config.get('INSTRUMENTATION_ENABLED', True):
+        return
+    if app.config.get('METRICS_DIR'):
+        _shared = metrics.SharedDirectory(app.config['METRICS_DIR'], metrics.registry,
+                                          app.config.get('METRICS_EXPORT_SECONDS', 5))
+        atexit.register(_shared.dump, True)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    if _installed:
+        return
+    # Engine class events cover the primary and replica engines alike
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+    before_render_template.connect(_before_render)
+    template_rendered.connect(_rendered)
+    _installed = True
+
+
+def render_metrics():
+    """Metrics of this process, or of every worker with METRICS_DIR set."""
+    if _shared is not None:
+        return _shared.render()
+    return metrics.registry.render()
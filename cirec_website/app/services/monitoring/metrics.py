@@ -0,0 +1,231 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def empty(self):
+        return Counter(self.name, self.help, self.labels)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def state(self):
+        with self._lock:
+            return [[list(values), total] for values, total in self._values.items()]
+
+    def merge(self, state):
+        for values, total in state:
+            self.inc(*values, amount=total)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, total in items:
+            yield self.name + _labels(self.labels, values), total
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *values):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, *values):
+        """``(count, sum)`` for one label set."""
+        with self._lock:
+            series = self._series.get(values)
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def empty(self):
+        return Histogram(self.name, self.help, self.labels, self.buckets)
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def state(self):
+        with self._lock:
+            return [[list(values), list(s[0]), s[1], s[2]] for values, s in self._series.items()]
+
+    def merge(self, state):
+        with self._lock:
+            for values, counts, total, count in state:
+                series = self._series.get(tuple(values))
+                if series is None:
+                    series = self._series[tuple(values)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                if len(counts) != len(series[0]):
+                    continue  # written with other buckets, by an older release
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+    def samples(self):
+        with self._lock:
+            items = sorted((values, (list(s[0]), s[1], s[2])) for values, s in self._series.items())
+        for values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield (self.name + '_bucket' + _labels(self.labels, values, [('le', _number(bound))]),
+                       cumulative)
+            yield self.name + '_sum' + _labels(self.labels, values), total
+            yield self.name + '_count' + _labels(self.labels, values), count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def state(self):
+        return {name: metric.state() for name, metric in self.metrics.items()}
+
+    def merged(self, states):
+        """A new registry with the same metrics, holding the sum of ``states``."""
+        merged = Registry()
+        for metric in self.metrics.values():
+            total = merged.register(metric.empty())
+            for state in states:
+                total.merge(state.get(metric.name, ()))
+        return merged
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            lines.extend('%s %s' % (sample, _number(value)) for sample, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class SharedDirectory:
+    """Metrics of every process that shares ``path``, e.g. gunicorn workers.
+
+    Each process writes its registry to ``metrics-<pid>.json`` at most
+    every ``interval`` seconds, and ``render`` sums all the files, so a
+    scrape answered by any one worker covers the whole pool. Files of
+    workers that have exited are kept, so counters never go backwards;
+    the directory is emptied when the server starts (gunicorn.conf.py).
+    """
+
+    def __init__(self, path, registry, interval=5):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self._written = 0.0
+        self._lock = threading.Lock()
+
+    def dump(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._written < self.interval:
+            return
+        with self._lock:
+            self._written = now
+            os.makedirs(self.path, exist_ok=True)
+            target = os.path.join(self.path, 'metrics-%d.json' % os.getpid())
+            tmp = target + '.tmp'
+            with open(tmp, 'w') as fh:
+                json.dump(self.registry.state(), fh)
+            os.replace(tmp, target)
+
+    def render(self):
+        self.dump(force=True)
+        states = []
+        for name in sorted(glob.glob(os.path.join(self.path, 'metrics-*.json'))):
+            try:
+                with open(name) as fh:
+                    states.append(json.load(fh))
+            except (OSError, ValueError):
+                continue  # removed or being replaced; its figures return next scrape
+        return self.registry.merged(states).render()
+
+
+registry = Registry()
+
+request_latency = registry.histogram(
+    'cirec_http_request_duration_seconds', 'Request latency by endpoint.',
+    ('endpoint', 'method', 'status'))
+sql_statements = registry.histogram(
+    'cirec_sql_statements_per_request', 'SQL statements executed per request.',
+    ('endpoint',), COUNT_BUCKETS)
+sql_duration = registry.histogram(
+    'cirec_sql_statement_duration_seconds', 'SQL statement execution time.',
+    ('endpoint',), SQL_BUCKETS)
+n_plus_one = registry.counter(
+    'cirec_sql_n_plus_one_total', 'Requests that repeated one statement past the N+1 threshold.',
+    ('endpoint',))
+template_render = registry.histogram(
+    'cirec_template_render_seconds', 'Template render time.', ('template',))
+profiled_requests = registry.counter(
+    'cirec_profiled_requests_total', 'Requests run under the profiler.', ('endpoint',))
@@ -0,0 +1,138 @@
+import calendar
+import logging
+from datetime import datetime
+
+from flask_login import current_user
+from sqlalchemy import bindparam
+
+from app.extensions import db
+from app.models.user import User
+from app.services.auth import session_cache
+from app.services.tasks.task_queue import task
+
+logger = logging.getLogger(__name__)
+
+# Plan name -> length in months
+PLANS = {'basic': 3, 'full': 12}
+DEFAULT_PLAN = 'full'
+
+BATCH_SIZE = 1000
+
+
+def add_months(when, months):
+    """``when`` plus ``months`` calendar months, clamped to the month's last day.
+
+    31 January + 1 month is 28 (or 29) February, and 30 November + 3
+    months is 28 February of the next year.
+    """
+    month_index = when.month - 1 + months
+    year = when.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(when.day, calendar.monthrange(year, month)[1])
+    return when.replace(year=year, month=month, day=day)
+
+
+def activate(user, plan=None, now=None, auto_renew=False):
+    """Start or extend ``user``'s subscription; the caller commits.
+
+    With ``auto_renew`` the subscription is extended by ``renew_due``
+    each time it reaches its end date, instead of expiring.
+    """
+    now = now or datetime.utcnow()
+    plan = plan if plan in PLANS else DEFAULT_PLAN
+    user.auto_renew = auto_renew
+    # Paying again before the end extends from the current end date
+    if user.subscription_status == 'active' and user.subscription_end and user.subscription_end > now:
+        start = user.subscription_end
+    else:
+        start = now
+        user.subscription_start = now
+    user.subscription_status = 'active'
+    user.subscription_plan = plan
+    user.subscription_end = add_months(start, PLANS[plan])
+    return user
+
+
+def has_access(user=None, now=None):
+    """Whether ``user`` (default: the logged-in user) may read full articles.
+
+    Reads only the subscription fields cached on the login principal, so
+    it costs no query. The end date is compared as well as the status in
+    case the expiry sweep has not run yet.
+    """
+    user = current_user if user is None else user
+    if not user or not user.is_authenticated:
+        return False
+    if user.is_admin:
+        return True
+    if user.subscription_status != 'active':
+        return False
+    return user.subscription_end is None or user.subscription_end > (now or datetime.utcnow())
+
+
+def _due(now, *criteria):
+    """Ids of active subscriptions ended by ``now``, via the (status, end) index."""
+    return [row.id for row in db.session.query(User.id).filter(
+        User.subscription_status == 'active', User.subscription_end <= now, *criteria)]
+
+
+def renew_due(now=None):
+    """Extend auto-renewing subscriptions that have reached their end date."""
+    now = now or datetime.utcnow()
+    table = User.__table__
+    renewed = 0
+    postgres = db.engine.dialect.name == 'postgresql'
+    for plan, months in PLANS.items():
+        criteria = (User.auto_renew.is_(True), User.subscription_plan == plan)
+        if postgres:
+            # Postgres month intervals already clamp to the end of the month
+            ids = [row[0] for row in db.session.execute(
+                table.update()
+                .where(table.c.subscription_status == 'active', table.c.subscription_end <= now,
+                       table.c.auto_renew.is_(True), table.c.subscription_plan == plan)
+                .values(subscription_end=table.c.subscription_end + db.func.make_interval(0, months))
+                .returning(table.c.id))]
+        else:
+            rows = (db.session.query(User.id, User.subscription_end)
+                    .filter(User.subscription_status == 'active', User.subscription_end <= now, *criteria)
+                    .all())
+            ids = [row.id for row in rows]
+            if rows:
+                db.session.execute(
+                    table.update().where(table.c.id == bindparam('user_id'))
+                    .values(subscription_end=bindparam('new_end')),
+                    [{'user_id': row.id, 'new_end': add_months(row.subscription_end, months)} for row in rows])
+        db.session.commit()
+        session_cache.invalidate(*ids)
+        renewed += len(ids)
+    return renewed
+
+
+def expire_due(now=None):
+    """Mark every active subscription past its end date as expired."""
+    now = now or datetime.utcnow()
+    table = User.__table__
+    ids = _due(now)
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        db.session.execute(
+            table.update()
+            .where(table.c.id.in_(batch), table.c.subscription_status == 'active',
+                   table.c.subscription_end <= now)
+            .values(subscription_status='expired'))
+        db.session.commit()
+        session_cache.invalidate(*batch)
+    return len(ids)
+
+
+def process_subscriptions(now=None):
+    """Renew, then expire, everything that is due; run this on a schedule."""
+    now = now or datetime.utcnow()
+    result = {'renewed': renew_due(now), 'expired': expire_due(now)}
+    logger.info('Subscriptions processed: %s', result)
+    return result
+
+
+@task('payment.process_subscriptions', max_retries=3, retry_delay=60)
+def process_subscriptions_task():
+    return process_subscriptions()
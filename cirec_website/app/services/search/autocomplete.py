@@ -0,0 +1,369 @@
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.search import indexing_service
+from app.utils.helpers import LRUCache
+from app.utils.text_processing import tokenize
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+SEED_SUGGESTIONS = [
+    'Russian petrochemical industry',
+    'Gazprom chemical production',
+    'Sibur polymer market',
+    'LUKOIL refinery capacity',
+    'Russian fertilizer exports',
+    'Chemical industry Moscow',
+    'Ethylene production Russia',
+    'Polymer market analysis',
+]
+
+TITLE_WEIGHT = 1.0
+ENTITY_WEIGHT = 0.5
+QUERY_WEIGHT = 2.0
+MIN_QUERY_COUNT = 3
+MIN_ENTITY_TITLES = 2
+SCAN_LIMIT = 256
+# Snapshot layout version; other versions are rebuilt
+SNAPSHOT_FORMAT = 1
+
+# Runs of capitalised words in titles, e.g. "Grupa Azoty", "SIBUR", "MOL"
+ENTITY_RE = re.compile(r"\b[A-Z][\w&'-]*(?:\s+[A-Z][\w&'-]*)*")
+NON_ENTITY = frozenset('jan feb mar apr may jun jul aug sep oct nov dec q1 q2 q3 q4 the'.split())
+
+
+def normalize(text):
+    return ' '.join(tokenize(text, keep_stopwords=True))
+
+
+def extract_entities(title):
+    names = set()
+    for match in ENTITY_RE.finditer(title or ''):
+        words = [w for w in match.group(0).split()
+                 if w.split('-')[0].lower() not in NON_ENTITY and not w[0].isdigit()]
+        if words:
+            names.add(' '.join(words))
+    return names
+
+
+class AutocompleteIndex:
+    """Weighted phrase completion over a sorted array of word-start keys.
+
+    Every phrase is indexed under each suffix that starts at a word, so
+    "pol" completes both "Polish methanol trade" and "Sibur polymer
+    market". A prefix maps to a contiguous slice of ``keys`` found with
+    bisect; wide slices (very short prefixes) are memoised.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.phrases = []
+        self.weights = []
+        self.phrase_ids = {}
+        self.titles = {}
+        self.entity_counts = Counter()
+        self.query_counts = Counter()
+        self.synced_at = None
+        self._bulk = False
+        self._memo = LRUCache(maxsize=4096)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return sum(1 for w in self.weights if w > 0)
+
+    def _suffixes(self, phrase):
+        tokens = normalize(phrase).split()
+        return [' '.join(tokens[i:]) for i in range(len(tokens))]
+
+    def adjust(self, phrase, delta):
+        with self._lock:
+            pid = self.phrase_ids.get(phrase)
+            if pid is None:
+                if delta <= 0:
+                    return
+                pid = len(self.phrases)
+                self.phrase_ids[phrase] = pid
+                self.phrases.append(phrase)
+                self.weights.append(0.0)
+            before = self.weights[pid]
+            after = max(before + delta, 0.0)
+            self.weights[pid] = after
+            if before <= 0 < after:
+                for key in self._suffixes(phrase):
+                    if self._bulk:
+                        self.keys.append((key, pid))
+                    else:
+                        insort(self.keys, (key, pid))
+            elif after <= 0 < before:
+                for key in self._suffixes(phrase):
+                    i = bisect_left(self.keys, (key, pid))
+                    if i < len(self.keys) and self.keys[i] == (key, pid):
+                        del self.keys[i]
+            self._memo.clear()
+
+    def _count(self, counter, phrase, delta, min_count, weight):
+        """Phrases enter the index once seen ``min_count`` times."""
+        before = counter[phrase]
+        after = before + delta
+        if after > 0:
+            counter[phrase] = after
+        else:
+            counter.pop(phrase, None)
+        weight_before = before * weight if before >= min_count else 0.0
+        weight_after = after * weight if after >= min_count else 0.0
+        if weight_after != weight_before:
+            self.adjust(phrase, weight_after - weight_before)
+
+    def add_title(self, article_id, title):
+        self.remove_title(article_id)
+        self.titles[article_id] = title
+        self.adjust(title, TITLE_WEIGHT)
+        for name in extract_entities(title):
+            self._count(self.entity_counts, name, 1, MIN_ENTITY_TITLES, ENTITY_WEIGHT)
+
+    def remove_title(self, article_id):
+        title = self.titles.pop(article_id, None)
+        if title is None:
+            return
+        self.adjust(title, -TITLE_WEIGHT)
+        for name in extract_entities(title):
+            self._count(self.entity_counts, name, -1, MIN_ENTITY_TITLES, ENTITY_WEIGHT)
+
+    def add_queries(self, counts):
+        for query, delta in counts.items():
+            self._count(self.query_counts, query, delta, MIN_QUERY_COUNT, QUERY_WEIGHT)
+
+    def complete(self, prefix, limit=8):
+        key = normalize(prefix)
+        if not key:
+            return []
+        if prefix[-1:].isspace():
+            key += ' '
+        cached = self._memo.get((key, limit))
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            lo = bisect_left(self.keys, (key,))
+            hi = bisect_left(self.keys, (key + '\uffff',))
+            pids = {pid for _, pid in self.keys[lo:hi]}
+            best = heapq.nsmallest(
+                limit, pids, key=lambda pid: (-self.weights[pid], len(self.phrases[pid]), self.phrases[pid]))
+            results = [self.phrases[pid] for pid in best]
+        if hi - lo > SCAN_LIMIT:
+            self._memo.set((key, limit), results)
+        return results
+
+    def to_bytes(self):
+        """The index as compact JSON; the sorted keys are rebuilt on load."""
+        with self._lock:
+            state = {
+                'format': SNAPSHOT_FORMAT, 'phrases': self.phrases, 'weights': self.weights,
+                'titles': sorted(self.titles.items()), 'entity_counts': dict(self.entity_counts),
+                'query_counts': dict(self.query_counts),
+                'synced_at': self.synced_at.isoformat() if self.synced_at else None,
+            }
+            return json.dumps(state, separators=(',', ':')).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, data):
+        state = json.loads(data)
+        if state.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError('Unsupported autocomplete snapshot format')
+        index = cls()
+        index.phrases = state['phrases']
+        index.weights = state['weights']
+        index.phrase_ids = {phrase: pid for pid, phrase in enumerate(index.phrases)}
+        index.keys = [(key, pid) for pid, phrase in enumerate(index.phrases) if index.weights[pid] > 0
+                      for key in index._suffixes(phrase)]
+        index.keys.sort()
+        index.titles = {article_id: title for article_id, title in state['titles']}
+        index.entity_counts = Counter(state['entity_counts'])
+        index.query_counts = Counter(state['query_counts'])
+        index.synced_at = datetime.fromisoformat(state['synced_at']) if state['synced_at'] else None
+        return index
+
+
+def build_index():
+    index = AutocompleteIndex()
+    # Append keys unsorted and sort once instead of inserting one by one
+    index._bulk = True
+    for phrase in SEED_SUGGESTIONS:
+        index.adjust(phrase, TITLE_WEIGHT)
+    index.synced_at = db.session.query(db.func.max(Article.updated_at)).scalar()
+    rows = db.session.query(Article.id, Article.title).filter(Article.is_published.is_(True))
+    for row in rows.yield_per(1000):
+        index.add_title(row.id, row.title)
+    index.keys.sort()
+    index._bulk = False
+    return index
+
+
+_pending = set()
+
+
+@indexing_service.on_articles_changed
+def mark_dirty(article_ids):
+    _pending.update(article_ids)
+
+
+class AutocompleteService:
+    """Keeps a per-worker index in step with a shared snapshot file.
+
+    The first worker to need the index builds it from the articles table
+    and writes the snapshot; others load that file and re-load it when
+    its mtime changes. Local article edits, articles written elsewhere
+    (found through ``updated_at``) and recorded queries are merged into
+    the snapshot under a file lock.
+    """
+
+    def __init__(self, path, flush_interval=60, sync_interval=30, sync_margin=300):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        # The snapshot keeps the newest updated_at merged; rows stamped
+        # before it may commit after it, so each sync re-reads this far back
+        self.sync_margin = timedelta(seconds=sync_margin)
+        self.index = None
+        self._mtime = None
+        self._checked = 0.0
+        self._synced = time.monotonic()
+        self._flushed = time.monotonic()
+        self._queries = Counter()
+        self._lock = threading.Lock()
+
+    def record_query(self, query):
+        query = ' '.join(query.split())
+        if 2 <= len(query) <= 100:
+            self._queries[query] += 1
+
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fh = open(self.path + '.lock', 'w')
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        return fh
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime != self._mtime:
+            try:
+                with open(self.path, 'rb') as fh:
+                    index = AutocompleteIndex.from_bytes(fh.read())
+            except (ValueError, KeyError, TypeError):
+                # Damaged or written by another layout: rebuild it
+                return False
+            self.index = index
+            self._mtime = mtime
+        return True
+
+    def _write(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(self.index.to_bytes())
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def rebuild(self):
+        lock = self._file_lock()
+        try:
+            queries = self.index.query_counts if self.index is not None else Counter()
+            _pending.clear()
+            self.index = build_index()
+            self.index.add_queries(queries)
+            self._write()
+        finally:
+            lock.close()
+        return self.index
+
+    def _merge(self, sync=False):
+        """Fold article edits and query counts into the snapshot."""
+        ids = set(_pending)
+        _pending.difference_update(ids)
+        queries, self._queries = self._queries, Counter()
+        columns = db.session.query(Article.id, Article.title, Article.is_published, Article.updated_at)
+        rows = columns.filter(Article.id.in_(ids)).all() if ids else []
+        if sync and self.index.synced_at is not None:
+            rows += columns.filter(Article.updated_at >= self.index.synced_at - self.sync_margin).all()
+        if not rows and not ids and not queries:
+            return
+
+        lock = self._file_lock()
+        try:
+            self._load()
+            existing = set(self.index.titles)
+            found = {row.id for row in rows}
+            for article_id in ids - found:
+                self.index.remove_title(article_id)
+            for row in rows:
+                if not row.is_published:
+                    self.index.remove_title(row.id)
+                elif row.id not in existing or self.index.titles[row.id] != row.title:
+                    self.index.add_title(row.id, row.title)
+                if row.updated_at and (self.index.synced_at is None or row.updated_at > self.index.synced_at):
+                    self.index.synced_at = row.updated_at
+            self.index.add_queries(queries)
+            self._write()
+        finally:
+            lock.close()
+
+    def ensure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.index is None:
+                if not self._load():
+                    self.rebuild()
+            elif now - self._checked >= 1.0:
+                self._load()
+            self._checked = now
+            sync = now - self._synced >= self.sync_interval
+            flush = self._queries and now - self._flushed >= self.flush_interval
+            if _pending or sync or flush:
+                self._merge(sync=sync)
+                self._synced = now if sync else self._synced
+                self._flushed = now if flush else self._flushed
+        return self.index
+
+    def complete(self, prefix, limit=8):
+        return self.ensure().complete(prefix, limit)
+
+
+_service = None
+
+
+def get_service():
+    global _service
+    if _service is None:
+        config = current_app.config
+        _service = AutocompleteService(
+            config.get('AUTOCOMPLETE_SNAPSHOT_PATH', 'instance/autocomplete.json'),
+            flush_interval=config.get('AUTOCOMPLETE_FLUSH_SECONDS', 60),
+            sync_interval=config.get('SEARCH_INDEX_REFRESH_SECONDS', 30),
+            sync_margin=config.get('SEARCH_INDEX_SYNC_MARGIN_SECONDS', 300),
+        )
+    return _service
+
+
+def complete(prefix, limit=8):
+    return get_service().complete(prefix, limit)
+
+
+def record_query(query):
+    get_service().record_query(query)
@@ -0,0 +1,346 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+
+from app.extensions import db
+from app.models.article import Article
+from app.models.search_index import ArticleEntity, Entity
+from app.services.content.entity_extractor import FACET_KINDS, LABELS, slugify
+from app.services.search import keyword_search
+from app.services.search.search_manager import DATE_RANGES
+
+# Kinds with a fixed vocabulary, shown as select options with every count
+FIXED_KINDS = ('category', 'region', 'doc_type')
+# Kinds typed as free text: a value matches by slug prefix or label
+TEXT_KINDS = ('company', 'product')
+# Articles rewritten since the last build before it is rebuilt
+OVERLAY_LIMIT = 5000
+
+
+class FacetColumn:
+    """Article ids of one facet kind, grouped by value code."""
+
+    def __init__(self, article_ids, codes, n_values):
+        order = np.lexsort((article_ids, codes))
+        self.article_ids = article_ids[order]
+        self.codes = codes[order]
+        self.offsets = np.searchsorted(self.codes, np.arange(n_values + 1))
+
+    def ids(self, code):
+        if code + 1 >= len(self.offsets):
+            return self.article_ids[:0]
+        return self.article_ids[self.offsets[code]:self.offsets[code + 1]]
+
+    def counts(self, mask, n_values):
+        return np.bincount(self.codes[mask[self.article_ids]], minlength=n_values)
+
+
+class FacetIndex:
+    """Boolean article bitmaps for the search filters and facet counts.
+
+    Every mask is a NumPy bool array indexed by article id, so combining
+    filters is a few vectorised ANDs and a facet count is one
+    ``bincount``. Articles written after the build are kept in a small
+    overlay (their base postings masked out by ``stale``) until the next
+    rebuild.
+    """
+
+    def __init__(self):
+        self.values = {kind: [] for kind in FACET_KINDS}
+        self.codes = {kind: {} for kind in FACET_KINDS}
+        self.entities = {}
+        self.columns = {}
+        self.published = np.zeros(0, dtype=bool)
+        self.created = np.zeros(0, dtype='datetime64[s]')
+        self.stale = np.zeros(0, dtype=bool)
+        self.overlay = {}
+        self._lock = threading.RLock()
+        # The fixed vocabularies keep their order, and show before any article has them
+        for kind in FIXED_KINDS:
+            for value, label in LABELS[kind].items():
+                self._code(kind, value, label)
+
+    @property
+    def size(self):
+        return len(self.published)
+
+    def _code(self, kind, value, label):
+        code = self.codes[kind].get(value)
+        if code is None:
+            code = self.codes[kind][value] = len(self.values[kind])
+            self.values[kind].append((value, label))
+        return code
+
+    def _grow(self, max_id):
+        if max_id < self.size:
+            return
+        size = max(max_id + 1, self.size * 2, 1024)
+        extra = size - self.size
+        self.published = np.concatenate([self.published, np.zeros(extra, dtype=bool)])
+        self.created = np.concatenate([self.created, np.full(extra, np.datetime64('NaT'), dtype='datetime64[s]')])
+        self.stale = np.concatenate([self.stale, np.zeros(extra, dtype=bool)])
+
+    def add_entities(self, rows):
+        """Register ``(id, kind, value, label)`` entity rows."""
+        with self._lock:
+            for entity_id, kind, value, label in rows:
+                if kind in self.codes:
+                    self.entities[entity_id] = (kind, self._code(kind, value, label))
+
+    def build(self, articles, links):
+        """Replace the index from ``(id, created_at, is_published)`` rows and
+        ``(article_id, entity_id)`` link arrays."""
+        articles = list(articles)
+        max_id = max((row[0] for row in articles), default=0)
+        published = np.zeros(max_id + 1, dtype=bool)
+        created = np.full(max_id + 1, np.datetime64('NaT'), dtype='datetime64[s]')
+        for article_id, created_at, is_published in articles:
+            published[article_id] = bool(is_published)
+            if created_at is not None:
+                created[article_id] = np.datetime64(created_at, 's')
+
+        article_ids, entity_ids = links
+        with self._lock:
+            # Entity id -> kind number and value code, as lookup arrays
+            top = max(self.entities, default=0)
+            kind_of = np.full(top + 1, -1, dtype=np.int16)
+            code_of = np.zeros(top + 1, dtype=np.int32)
+            for entity_id, (kind, code) in self.entities.items():
+                kind_of[entity_id] = FACET_KINDS.index(kind)
+                code_of[entity_id] = code
+            known = (entity_ids <= top) & (article_ids <= max_id)
+            article_ids, entity_ids = article_ids[known], entity_ids[known]
+            columns = {}
+            for number, kind in enumerate(FACET_KINDS):
+                selected = kind_of[entity_ids] == number
+                columns[kind] = FacetColumn(article_ids[selected].astype(np.int64),
+                                            code_of[entity_ids[selected]], len(self.values[kind]))
+            self.columns = columns
+            self.published = published
+            self.created = created
+            self.stale = np.zeros(max_id + 1, dtype=bool)
+            self.overlay = {}
+
+    def update(self, articles, links):
+        """Overlay rewritten articles: ``(id, created_at, is_published)`` rows
+        and ``{article_id: [entity_id, ...]}``."""
+        with self._lock:
+            for article_id, created_at, is_published in articles:
+                self._grow(article_id)
+                self.published[article_id] = bool(is_published)
+                self.created[article_id] = (np.datetime64(created_at, 's') if created_at is not None
+                                            else np.datetime64('NaT'))
+                self.stale[article_id] = True
+                kinds = {}
+                for entity_id in links.get(article_id, ()):
+                    if entity_id in self.entities:
+                        kind, code = self.entities[entity_id]
+                        kinds.setdefault(kind, set()).add(code)
+                self.overlay[article_id] = kinds
+
+    def remove(self, article_ids):
+        with self._lock:
+            for article_id in article_ids:
+                if article_id < self.size:
+                    self.published[article_id] = False
+
+    def resolve(self, kind, text):
+        """Value codes a filter's request value selects."""
+        value = slugify(text)
+        codes = self.codes.get(kind, {})
+        if value in codes:
+            return {codes[value]}
+        if kind not in TEXT_KINDS or not value:
+            return set()
+        needle = ' '.join(text.lower().split())
+        return {code for code, (candidate, label) in enumerate(self.values[kind])
+                if candidate.startswith(value) or needle in label.lower()}
+
+    def mask(self, kind, codes):
+        """Articles carrying any of ``codes`` of ``kind``."""
+        with self._lock:
+            mask = np.zeros(self.size, dtype=bool)
+            column = self.columns.get(kind)
+            if column is not None:
+                for code in codes:
+                    mask[column.ids(code)] = True
+            if self.overlay:
+                mask &= ~self.stale
+                for article_id, kinds in self.overlay.items():
+                    if kinds.get(kind, set()) & codes:
+                        mask[article_id] = True
+            return mask & self.published
+
+    def since(self, moment):
+        with self._lock:
+            return (self.created >= np.datetime64(moment, 's')) & self.published
+
+    def from_ids(self, article_ids):
+        mask = np.zeros(self.size, dtype=bool)
+        ids = np.fromiter(article_ids, dtype=np.int64)
+        mask[ids[ids < self.size]] = True
+        return mask
+
+    def counts(self, kind, mask):
+        """``{code: count}`` of ``kind`` among the articles in ``mask``."""
+        with self._lock:
+            n_values = len(self.values[kind])
+            column = self.columns.get(kind)
+            if column is None:
+                totals = np.zeros(n_values, dtype=np.int64)
+            else:
+                totals = column.counts(mask & ~self.stale if self.overlay else mask, n_values)
+            for article_id, kinds in self.overlay.items():
+                if mask[article_id]:
+                    for code in kinds.get(kind, ()):
+                        totals[code] += 1
+            return {code: int(count) for code, count in enumerate(totals) if count}
+
+
+facet_index = FacetIndex()
+
+_state = {'built': False, 'synced_at': None, 'checked': 0.0}
+_dirty = set()
+_sync_lock = threading.Lock()
+
+
+def _load_entities(entity_ids=None):
+    query = db.session.query(Entity.id, Entity.kind, Entity.value, Entity.label).order_by(Entity.id)
+    if entity_ids is not None:
+        query = query.filter(Entity.id.in_(list(entity_ids)))
+    facet_index.add_entities(query)
+
+
+def build_index():
+    """Rebuild the bitmaps from the article and entity tables."""
+    with _sync_lock:
+        _dirty.clear()
+        _load_entities()
+        articles = db.session.query(Article.id, Article.created_at, Article.is_published).yield_per(5000)
+        rows = [(row.id, row.created_at, row.is_published) for row in articles]
+        links = db.session.query(ArticleEntity.article_id, ArticleEntity.entity_id).yield_per(10000)
+        pairs = np.array([tuple(link) for link in links], dtype=np.int64).reshape(-1, 2)
+        facet_index.build(rows, (pairs[:, 0], pairs[:, 1]))
+        _state['synced_at'] = db.session.query(db.func.max(Article.updated_at)).scalar()
+        _state['built'] = True
+        _state['checked'] = time.monotonic()
+
+
+def _apply(article_ids=None, since=None):
+    query = db.session.query(Article.id, Article.created_at, Article.is_published, Article.updated_at)
+    if article_ids is not None:
+        query = query.filter(Article.id.in_(list(article_ids)))
+    else:
+        query = query.filter(Article.updated_at >= since)
+    rows = query.all()
+    if article_ids is not None:
+        facet_index.remove(set(article_ids) - {row.id for row in rows})
+    if not rows:
+        return
+    links = {}
+    for article_id, entity_id in (db.session.query(ArticleEntity.article_id, ArticleEntity.entity_id)
+                                  .filter(ArticleEntity.article_id.in_([row.id for row in rows]))):
+        links.setdefault(article_id, []).append(entity_id)
+    unknown = {entity_id for ids in links.values() for entity_id in ids} - set(facet_index.entities)
+    if unknown:
+        _load_entities(unknown)
+    facet_index.update([(row.id, row.created_at, row.is_published) for row in rows], links)
+    latest = max((row.updated_at for row in rows if row.updated_at), default=None)
+    if latest and (_state['synced_at'] is None or latest > _state['synced_at']):
+        _state['synced_at'] = latest
+
+
+def mark_dirty(article_ids):
+    # Registered by search_manager, which imports this module lazily
+    _dirty.update(article_ids)
+
+
+def ensure_index():
+    """Build on first use, then overlay local and other workers' edits."""
+    if not _state['built'] or len(facet_index.overlay) > OVERLAY_LIMIT:
+        build_index()
+        return
+
+    if _dirty:
+        with _sync_lock:
+            ids = set(_dirty)
+            _dirty.difference_update(ids)
+            _apply(article_ids=ids)
+
+    interval = current_app.config.get('SEARCH_INDEX_REFRESH_SECONDS', 30)
+    if time.monotonic() - _state['checked'] < interval:
+        return
+    with _sync_lock:
+        _state['checked'] = time.monotonic()
+        if _state['synced_at'] is not None:
+            # Overlap the last refresh: a row stamped before it may have
+            # committed after it
+            margin = timedelta(seconds=current_app.config.get('SEARCH_INDEX_SYNC_MARGIN_SECONDS', 300))
+            _apply(since=_state['synced_at'] - margin)
+
+
+def filter_masks(filters):
+    """``{name: mask}`` for each filter that restricts the results."""
+    ensure_index()
+    masks = {}
+    for name, value in filters.items():
+        if name == 'date_range':
+            if value in DATE_RANGES:
+                masks[name] = facet_index.since(datetime.utcnow() - DATE_RANGES[value])
+        elif name in FACET_KINDS:
+            codes = facet_index.resolve(name, value)
+            if codes:
+                masks[name] = facet_index.mask(name, codes)
+            elif name in TEXT_KINDS:
+                # A name the extractor does not know: match it as text
+                ids = keyword_search.match_all(value.replace('_', ' '))
+                if ids is not None:
+                    masks[name] = facet_index.from_ids(ids)
+            else:
+                masks[name] = np.zeros(facet_index.size, dtype=bool)
+    return masks
+
+
+def _combine(masks):
+    combined = None
+    for mask in masks:
+        combined = mask.copy() if combined is None else np.logical_and(combined, mask, out=combined)
+    return combined
+
+
+def candidates(filters):
+    """Ids of the articles passing every filter, or None if none applies."""
+    with facet_index._lock:
+        combined = _combine(filter_masks(filters).values())
+    if combined is None:
+        return None
+    return set(np.flatnonzero(combined).tolist())
+
+
+def counts(filters, base_ids=None, limit=10):
+    """Facet counts: ``{kind: [(value, label, count), ...]}``.
+
+    Each kind is counted with every other filter applied but not its
+    own, so a selected region still shows what the other regions hold.
+    ``base_ids`` restricts the counts to the articles a query matched.
+    """
+    results = {}
+    # Masks must agree in length: hold off concurrent growth
+    with facet_index._lock:
+        masks = filter_masks(filters)
+        base = facet_index.published if base_ids is None else facet_index.from_ids(base_ids)
+        if 'date_range' in masks:
+            base = base & masks['date_range']
+        for kind in FACET_KINDS:
+            mask = _combine([base] + [m for name, m in masks.items() if name not in (kind, 'date_range')])
+            found = facet_index.counts(kind, mask)
+            values = facet_index.values[kind]
+            if kind in FIXED_KINDS:
+                results[kind] = [(value, label, found.get(code, 0)) for code, (value, label) in enumerate(values)]
+            else:
+                top = sorted(found.items(), key=lambda item: -item[1])[:limit]
+                results[kind] = [(values[code][0], values[code][1], count) for code, count in top]
+    return results
@@ -0,0 +1,69 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+# Columns whose changes make an article stale in the search indexes
+INDEXED_FIELDS = ('title', 'summary', 'content', 'is_published', 'created_at')
+
+_listeners = []
+_installed = False
+
+
+def on_articles_changed(fn):
+    """Register ``fn(article_ids)`` to run after a commit touches articles."""
+    if fn not in _listeners:
+        _listeners.append(fn)
+    return fn
+
+
+def notify(article_ids):
+    article_ids = set(article_ids)
+    if not article_ids:
+        return
+    for listener in list(_listeners):
+        listener(article_ids)
+
+
+def _pending(session):
+    return session.info.setdefault('changed_articles', set())
+
+
+def _track(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        _pending(session).add(target.id)
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in INDEXED_FIELDS):
+        return
+    session = Session.object_session(target)
+    if session is not None:
+        _pending(session).add(target.id)
+
+
+def _after_commit(session):
+    changed = session.info.pop('changed_articles', None)
+    if changed:
+        notify(changed)
+
+
+def _after_rollback(session, previous_transaction):
+    # A savepoint rollback leaves the outer transaction's changes pending
+    if not previous_transaction.nested:
+        session.info.pop('changed_articles', None)
+
+
+def init_app(app):
+    """Hook article writes so in-memory indexes update incrementally."""
+    global _installed
+    if _installed:
+        return
+    from app.models.article import Article
+
+    event.listen(Article, 'after_insert', _track)
+    event.listen(Article, 'after_update', _after_update)
+    event.listen(Article, 'after_delete', _track)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_soft_rollback', _after_rollback)
+    _installed = True
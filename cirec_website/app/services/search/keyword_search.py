@@ -0,0 +1,254 @@
+import heapq
+import math
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.content.article_service import with_passages
+from app.services.search import indexing_service
+from app.utils.text_processing import tokenize
+
+
+# Weights of an article's best, second and third passage scores
+PASSAGE_WEIGHTS = (1.0, 0.5, 0.25)
+
+
+class KeywordSearch:
+    """In-memory inverted index of article passages with BM25 ranking.
+
+    Postings map each term to ``{passage_key: term_frequency}``, so a
+    query only scores the passages that contain one of its terms, however
+    long the issue around them. Passage scores are then aggregated per
+    article.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, title_boost=2):
+        self.k1 = k1
+        self.b = b
+        self.title_boost = title_boost
+        self.postings = {}
+        self.doc_lengths = {}
+        self.doc_terms = {}
+        self.passages = {}
+        self.articles = {}
+        self.total_length = 0
+        self._next_key = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.articles)
+
+    def __contains__(self, article_id):
+        return article_id in self.articles
+
+    def clear(self):
+        with self._lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self.doc_terms = {}
+            self.passages = {}
+            self.articles = {}
+            self.total_length = 0
+
+    def add_article(self, article_id, title, passages, summary=None):
+        """Index ``passages``, given as ``[(position, text), ...]``.
+
+        The title counts towards every passage, the summary towards the
+        first; an article without passages is indexed as one passage.
+        """
+        head = tokenize(title) * self.title_boost
+        passages = list(passages) or [(0, '')]
+        counted = []
+        for i, (position, text) in enumerate(passages):
+            tokens = head + tokenize(text)
+            if i == 0 and summary:
+                tokens.extend(tokenize(summary))
+            counted.append((position, Counter(tokens), len(tokens)))
+
+        with self._lock:
+            self._remove(article_id)
+            keys = []
+            for position, counts, length in counted:
+                key = self._next_key
+                self._next_key += 1
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[key] = tf
+                self.doc_terms[key] = tuple(counts)
+                self.doc_lengths[key] = length
+                self.passages[key] = (article_id, position)
+                self.total_length += length
+                keys.append(key)
+            self.articles[article_id] = keys
+
+    def remove_article(self, article_id):
+        with self._lock:
+            self._remove(article_id)
+
+    def _remove(self, article_id):
+        for key in self.articles.pop(article_id, ()):
+            for term in self.doc_terms.pop(key):
+                docs = self.postings.get(term)
+                if docs is not None:
+                    docs.pop(key, None)
+                    if not docs:
+                        del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(key, 0)
+            del self.passages[key]
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        n = len(self.doc_lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _score(self, key, tf, idf, avgdl):
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[key] / avgdl)
+        return idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def search(self, query, limit=50, candidates=None):
+        """Return ``[(article_id, score, passage_positions), ...]`` best first.
+
+        ``passage_positions`` lists the article's best matching passages.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            if not self.doc_lengths:
+                return []
+            avgdl = self.total_length / len(self.doc_lengths) or 1.0
+            postings = [(self.postings[term], self.idf(term)) for term in terms if term in self.postings]
+            scores = {}
+            if candidates is not None and len(candidates) < sum(len(docs) for docs, _ in postings):
+                # A narrow filter: look the candidates' passages up in the
+                # postings rather than walking the postings
+                for article_id in candidates:
+                    for key in self.articles.get(article_id, ()):
+                        for docs, idf in postings:
+                            tf = docs.get(key)
+                            if tf:
+                                scores[key] = scores.get(key, 0.0) + self._score(key, tf, idf, avgdl)
+            else:
+                for docs, idf in postings:
+                    for key, tf in docs.items():
+                        if candidates is not None and self.passages[key][0] not in candidates:
+                            continue
+                        scores[key] = scores.get(key, 0.0) + self._score(key, tf, idf, avgdl)
+            by_article = {}
+            for key, score in scores.items():
+                article_id, position = self.passages[key]
+                by_article.setdefault(article_id, []).append((score, position))
+
+        results = []
+        for article_id, found in by_article.items():
+            best = heapq.nlargest(len(PASSAGE_WEIGHTS), found)
+            score = sum(weight * passage_score for weight, (passage_score, _) in zip(PASSAGE_WEIGHTS, best))
+            results.append((article_id, score, tuple(position for _, position in best)))
+        return heapq.nlargest(limit, results, key=lambda item: item[1])
+
+    def match_all(self, text):
+        """Ids of articles containing every term of ``text``."""
+        terms = set(tokenize(text))
+        if not terms:
+            return None
+        with self._lock:
+            posting_sets = sorted((self.postings.get(t, {}) for t in terms), key=len)
+            result = {self.passages[key][0] for key in posting_sets[0]}
+            for docs in posting_sets[1:]:
+                if not result:
+                    break
+                result.intersection_update({self.passages[key][0] for key in docs})
+        return result
+
+
+keyword_index = KeywordSearch()
+
+_state = {'built': False, 'synced_at': None, 'checked': 0.0}
+_dirty = set()
+_sync_lock = threading.Lock()
+
+
+def _index_columns():
+    return db.session.query(
+        Article.id, Article.title, Article.summary, Article.content,
+        Article.is_published, Article.updated_at,
+    )
+
+
+def _apply(rows):
+    latest = None
+    for row, spans in with_passages(rows):
+        if row.is_published:
+            content = row.content or ''
+            keyword_index.add_article(row.id, row.title,
+                                      [(position, content[start:end]) for position, start, end in spans],
+                                      summary=row.summary)
+        else:
+            keyword_index.remove_article(row.id)
+        if row.updated_at and (latest is None or row.updated_at > latest):
+            latest = row.updated_at
+    if latest and (_state['synced_at'] is None or latest > _state['synced_at']):
+        _state['synced_at'] = latest
+
+
+def build_index():
+    """Rebuild the whole index from the articles table."""
+    with _sync_lock:
+        keyword_index.clear()
+        _dirty.clear()
+        _state['synced_at'] = None
+        _apply(_index_columns().filter(Article.is_published.is_(True)).yield_per(500))
+        _state['built'] = True
+        _state['checked'] = time.monotonic()
+
+
+@indexing_service.on_articles_changed
+def mark_dirty(article_ids):
+    _dirty.update(article_ids)
+
+
+def ensure_index():
+    """Build on first use, then apply local edits and other workers' edits."""
+    if not _state['built']:
+        build_index()
+        return
+
+    if _dirty:
+        with _sync_lock:
+            ids = set(_dirty)
+            _dirty.difference_update(ids)
+            for doc_id in ids:
+                keyword_index.remove_article(doc_id)
+            _apply(_index_columns().filter(Article.id.in_(ids)))
+
+    interval = current_app.config.get('SEARCH_INDEX_REFRESH_SECONDS', 30)
+    if time.monotonic() - _state['checked'] < interval:
+        return
+    with _sync_lock:
+        _state['checked'] = time.monotonic()
+        query = _index_columns()
+        if _state['synced_at'] is not None:
+            # Overlap the last refresh: a row stamped before it may have
+            # committed after it
+            margin = timedelta(seconds=current_app.config.get('SEARCH_INDEX_SYNC_MARGIN_SECONDS', 300))
+            query = query.filter(Article.updated_at >= _state['synced_at'] - margin)
+        _apply(query.yield_per(500))
+        # Deletes leave no updated_at behind; drop what the table no longer has
+        live = {row.id for row in db.session.query(Article.id).filter(Article.is_published.is_(True))}
+        for doc_id in set(keyword_index.articles) - live:
+            keyword_index.remove_article(doc_id)
+
+
+def search(query, limit=50, candidates=None):
+    ensure_index()
+    return keyword_index.search(query, limit=limit, candidates=candidates)
+
+
+def match_all(text):
+    ensure_index()
+    return keyword_index.match_all(text)
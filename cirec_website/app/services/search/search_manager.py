@@ -0,0 +1,226 @@
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.content import page_cache
+from app.services.search import indexing_service, keyword_search
+from app.utils.helpers import LRUCache
+from app.utils.text_processing import tokenize
+
+logger = logging.getLogger(__name__)
+
+FILTER_NAMES = ('date_range', 'category', 'company', 'product', 'region', 'doc_type')
+MODES = ('hybrid', 'keyword', 'semantic')
+# Best passages kept per result, for snippets
+PASSAGES_PER_RESULT = 3
+
+DATE_RANGES = {
+    '1_month': timedelta(days=30),
+    '3_months': timedelta(days=90),
+    '6_months': timedelta(days=180),
+    '1_year': timedelta(days=365),
+}
+
+
+def semantic():
+    """The semantic_search module, imported on first use.
+
+    It brings in NumPy and the embedding model, which processes that
+    never run a semantic query (CLI commands, most workers at boot)
+    should not pay for.
+    """
+    from app.services.search import semantic_search
+    return semantic_search
+
+
+@indexing_service.on_articles_changed
+def _semantic_changed(article_ids):
+    semantic().mark_dirty(article_ids)
+
+
+def facets():
+    """The facets module, imported on first use; it brings in NumPy too."""
+    from app.services.search import facets as module
+    return module
+
+
+@indexing_service.on_articles_changed
+def _facets_changed(article_ids):
+    # A process that has not loaded the bitmaps builds them fresh on first use
+    module = sys.modules.get('app.services.search.facets')
+    if module is not None:
+        module.mark_dirty(article_ids)
+
+
+def filters_from_args(args):
+    return {name: args.get(name).strip() for name in FILTER_NAMES if args.get(name, '').strip()}
+
+
+def mode_from_args(args, default='hybrid'):
+    """Resolve the search mode from ``mode`` or the search page's toggles."""
+    mode = args.get('mode')
+    if mode in MODES:
+        return mode
+    if args.get('ai_search') == 'off':
+        return 'keyword'
+    if args.get('keyword_search') == 'off':
+        return 'semantic'
+    return default
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists; each list contributes ``1 / (k + rank)``."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class SearchManager:
+    """Runs keyword and semantic retrieval and fuses their rankings.
+
+    Ranked ids are cached per normalised query, mode and filters. Keys
+    carry the archive generation of the page cache store, which every
+    worker shares with the Redis backend, so a commit anywhere moves all
+    workers to fresh keys; a commit in this process also clears the
+    cache. Entries live no longer than the index resync interval, which
+    bounds staleness with a per-process store too.
+    """
+
+    def __init__(self, max_workers=2, cache_size=512, cache_ttl=300, rrf_k=60):
+        self.rrf_k = rrf_k
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='search')
+        indexing_service.on_articles_changed(self.invalidate)
+
+    def invalidate(self, article_ids=None):
+        self.cache.clear()
+
+    @staticmethod
+    def generation():
+        """The archive generation, or None when the store cannot be reached."""
+        if 'page_cache' not in current_app.extensions:
+            return 0
+        generations = page_cache.get_store().generations([page_cache.SITE])
+        return generations[0] if generations is not None else None
+
+    @staticmethod
+    def normalize(query):
+        return ' '.join(tokenize(query, keep_stopwords=True))
+
+    def candidates(self, filters):
+        """Ids passing every active filter (None = unrestricted)."""
+        if not filters:
+            return None
+        return facets().candidates(filters)
+
+    def facet_counts(self, query, filters=None, hits=()):
+        """Facet value counts for the articles matching ``query``.
+
+        The base set is the articles containing every query term, or the
+        ranked hits when none does (a purely semantic match).
+        """
+        filters = filters or {}
+        normalized = self.normalize(query)
+        generation = self.generation()
+        key = ('facets', normalized, tuple(sorted(filters.items())), generation)
+        cached = self.cache.get(key) if generation is not None else None
+        if cached is not None:
+            return cached
+        base = None
+        if normalized:
+            base = keyword_search.match_all(normalized) or {doc_id for doc_id, _, _ in hits}
+        counts = facets().counts(filters, base_ids=base)
+        if generation is not None:
+            self.cache.set(key, counts)
+        return counts
+
+    def search(self, query, filters=None, mode='hybrid', limit=50):
+        """Return ``[(article_id, score, passage_positions), ...]`` best first.
+
+        ``passage_positions`` are the article's best matching passages.
+        """
+        normalized = self.normalize(query)
+        if not normalized:
+            return []
+        filters = filters or {}
+        generation = self.generation()
+        key = (normalized, mode, tuple(sorted(filters.items())), limit, generation)
+        cached = self.cache.get(key) if generation is not None else None
+        if cached is not None:
+            return cached
+
+        candidates = self.candidates(filters)
+        if candidates is not None and not candidates:
+            results = []
+        elif mode == 'keyword':
+            results = keyword_search.search(normalized, limit=limit, candidates=candidates)
+        elif mode == 'semantic':
+            results = self._semantic(normalized, limit, candidates)
+        else:
+            results = self._hybrid(normalized, limit, candidates)
+
+        if generation is not None:
+            self.cache.set(key, results)
+        return results
+
+    def _semantic(self, query, limit, candidates):
+        try:
+            return semantic().search(query, limit=limit, candidates=candidates)
+        except Exception:
+            logger.exception('Semantic search failed; returning keyword results only')
+            return []
+
+    def _in_app_context(self, fn, *args):
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                return fn(*args)
+        return self._executor.submit(run)
+
+    def _hybrid(self, query, limit, candidates):
+        depth = limit * 2
+        semantic = self._in_app_context(self._semantic, query, depth, candidates)
+        keyword = keyword_search.search(query, limit=depth, candidates=candidates)
+        semantic = semantic.result()
+        fused = reciprocal_rank_fusion(
+            [[doc_id for doc_id, _, _ in keyword], [doc_id for doc_id, _, _ in semantic]],
+            k=self.rrf_k,
+        )
+        # Keyword passages first: they hold the terms a snippet highlights
+        passages = {}
+        for doc_id, _, positions in keyword + semantic:
+            merged = passages.setdefault(doc_id, [])
+            merged.extend(p for p in positions if p not in merged)
+        return [(doc_id, score, tuple(passages[doc_id][:PASSAGES_PER_RESULT]))
+                for doc_id, score in fused[:limit]]
+
+
+_manager = None
+
+
+def get_search_manager():
+    global _manager
+    if _manager is None:
+        config = current_app.config
+        _manager = SearchManager(
+            cache_size=config.get('SEARCH_CACHE_SIZE', 512),
+            # Other workers' indexes may lag by up to one resync interval
+            cache_ttl=min(config.get('SEARCH_CACHE_TTL', 300), config.get('SEARCH_INDEX_REFRESH_SECONDS', 30)),
+        )
+    return _manager
+
+
+def search(query, filters=None, mode='hybrid', limit=50):
+    return get_search_manager().search(query, filters=filters, mode=mode, limit=limit)
+
+
+def facet_counts(query, filters=None, hits=()):
+    return get_search_manager().facet_counts(query, filters=filters, hits=hits)
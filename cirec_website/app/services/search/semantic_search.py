@@ -0,0 +1,420 @@
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.content.article_service import with_passages
+from app.services.tasks.task_queue import task
+from app.utils.text_processing import tokenize
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per matrix-vector product; bounds the float32 scratch space
+SCORE_BLOCK_ROWS = 16384
+# On-disk layout version; stores written by another layout are rebuilt
+STORE_FORMAT = 2
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder used offline and in tests.
+
+    Unigrams and bigrams are hashed into ``dim`` signed buckets, so the
+    vectors are stable across processes and need no model download.
+    """
+
+    name = 'hashing'
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=64):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [a + ' ' + b for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode('utf-8'))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        out = np.sign(out) * np.log1p(np.abs(out))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class SentenceTransformerEmbedder:
+    """Wraps a sentence-transformers model loaded on first use."""
+
+    def __init__(self, model_name, device=None):
+        self.name = model_name
+        self.device = device
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.name, device=self.device)
+        return self._model
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size=64):
+        vectors = self.model.encode(
+            list(texts), batch_size=batch_size,
+            convert_to_numpy=True, normalize_embeddings=True,
+        )
+        return vectors.astype(np.float32, copy=False)
+
+
+def create_embedder(config):
+    backend = config.get('SEMANTIC_EMBEDDER', 'sentence-transformers')
+    if backend == 'hashing':
+        return HashingEmbedder(config.get('SEMANTIC_HASHING_DIM', 384))
+    embedder = SentenceTransformerEmbedder(config.get('SENTENCE_TRANSFORMER_MODEL', 'all-MiniLM-L6-v2'))
+    try:
+        embedder.model
+    except Exception as exc:
+        logger.warning('Sentence transformer unavailable (%s); using hashing embedder', exc)
+        return HashingEmbedder(config.get('SEMANTIC_HASHING_DIM', 384))
+    return embedder
+
+
+class EmbeddingStore:
+    """Passage vectors in a memory-mapped ``.npy`` matrix on disk.
+
+    ``vectors-<generation>.npy`` holds one row per passage and
+    ``rows-<generation>.npy`` the ``(article_id, position)`` of each row
+    (article id -1 once superseded). Readers map the files
+    read-only, so every worker shares the same page-cache pages; writers
+    serialize on a lock file and publish by atomically replacing
+    ``meta.json``.
+    """
+
+    def __init__(self, path, dim, dtype='float32', model=''):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.model = model
+        self.meta = {}
+        self.vectors = None
+        self.rows = np.empty((0, 2), dtype=np.int64)
+        self._meta_mtime = None
+
+    @property
+    def count(self):
+        return self.meta.get('count', 0)
+
+    @property
+    def synced_at(self):
+        value = self.meta.get('synced_at')
+        return datetime.fromisoformat(value) if value else None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _compatible(self, meta):
+        return (meta.get('dim') == self.dim and meta.get('dtype') == self.dtype.name
+                and meta.get('model') == self.model and meta.get('format') == STORE_FORMAT)
+
+    def refresh(self):
+        """Re-map the files if another process published a new version."""
+        try:
+            mtime = os.stat(self._file('meta.json')).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        with open(self._file('meta.json')) as fh:
+            meta = json.load(fh)
+        self._meta_mtime = mtime
+        if not self._compatible(meta):
+            self.meta = {}
+            self.vectors = None
+            self.rows = np.empty((0, 2), dtype=np.int64)
+            return
+        self.meta = meta
+        self.vectors = np.load(self._file(meta['vectors']), mmap_mode='r')
+        self.rows = np.load(self._file(meta['rows']), mmap_mode='r')
+
+    def _lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        fh = open(self._file('.lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        return fh
+
+    def replace(self, article_ids, row_ids, vectors, synced_at=None):
+        """Drop the rows of ``article_ids`` and append ``vectors``.
+
+        ``row_ids`` gives the ``(article_id, position)`` of each vector.
+        """
+        lock = self._lock()
+        try:
+            self.refresh()
+            meta = dict(self.meta) if self.meta else {
+                'dim': self.dim, 'dtype': self.dtype.name, 'model': self.model,
+                'format': STORE_FORMAT, 'count': 0, 'generation': 0,
+            }
+            count = meta['count']
+            rows = np.array(self.rows[:count], dtype=np.int64).reshape(-1, 2)
+            if len(article_ids) and count:
+                rows[np.isin(rows[:, 0], np.fromiter(article_ids, dtype=np.int64)), 0] = -1
+
+            live = rows[:, 0] >= 0
+            new = len(row_ids)
+            capacity = 0 if self.vectors is None else self.vectors.shape[0]
+            generation = meta['generation'] + 1
+
+            if self.vectors is None or count + new > capacity or live.sum() < count // 2:
+                # Compact live rows into a fresh, larger file
+                keep = np.flatnonzero(live)
+                size = max(1024, 2 * (len(keep) + new))
+                name = 'vectors-%d.npy' % generation
+                target = np.lib.format.open_memmap(
+                    self._file(name), mode='w+', dtype=self.dtype, shape=(size, self.dim))
+                for start in range(0, len(keep), SCORE_BLOCK_ROWS):
+                    sel = keep[start:start + SCORE_BLOCK_ROWS]
+                    target[start:start + len(sel)] = self.vectors[sel]
+                rows = rows[keep]
+                count = len(keep)
+                old_vectors = meta.get('vectors')
+                meta['vectors'] = name
+            else:
+                target = np.load(self._file(meta['vectors']), mmap_mode='r+')
+                old_vectors = None
+
+            if new:
+                target[count:count + new] = np.asarray(vectors, dtype=self.dtype)
+                rows = np.concatenate([rows, np.asarray(row_ids, dtype=np.int64).reshape(-1, 2)])
+            target.flush()
+            del target
+
+            rows_name = 'rows-%d.npy' % generation
+            np.save(self._file(rows_name), rows)
+            old_rows = meta.get('rows')
+
+            meta.update(count=int(len(rows)), rows=rows_name, generation=generation)
+            if synced_at is not None:
+                meta['synced_at'] = synced_at.isoformat()
+            tmp = self._file('meta.json.tmp')
+            with open(tmp, 'w') as fh:
+                json.dump(meta, fh)
+            os.replace(tmp, self._file('meta.json'))
+
+            # Mapped pages of unlinked files stay valid for current readers
+            for stale in (old_vectors, old_rows):
+                if stale:
+                    try:
+                        os.remove(self._file(stale))
+                    except FileNotFoundError:
+                        pass
+            self.refresh()
+        finally:
+            lock.close()
+
+    def search(self, query_vector, limit=10, candidates=None, per_article=3):
+        """Top ``limit`` articles as ``[(article_id, score, passage_positions), ...]``.
+
+        An article scores as its best passage; ``passage_positions`` lists
+        up to ``per_article`` of its best passages.
+        """
+        count = self.count
+        if not count or self.vectors is None:
+            return []
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        rows = np.asarray(self.rows[:count, 0])
+        positions = np.asarray(self.rows[:count, 1])
+        valid = rows >= 0
+        if candidates is not None:
+            valid &= np.isin(rows, np.fromiter(candidates, dtype=np.int64))
+        selected = np.flatnonzero(valid) if candidates is not None else None
+        if selected is not None and len(selected) < count // 4:
+            # A narrow filter: read and score only the candidates' rows
+            scores = np.full(count, -np.inf, dtype=np.float32)
+            for start in range(0, len(selected), SCORE_BLOCK_ROWS):
+                sel = selected[start:start + SCORE_BLOCK_ROWS]
+                scores[sel] = self.vectors[sel].astype(np.float32, copy=False) @ query_vector
+        else:
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SCORE_BLOCK_ROWS):
+                end = min(start + SCORE_BLOCK_ROWS, count)
+                scores[start:end] = self.vectors[start:end].astype(np.float32, copy=False) @ query_vector
+            scores[~valid] = -np.inf
+
+        k = min(count, max(limit * 8 * per_article, limit))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        best = {}
+        for idx in top:
+            score = scores[idx]
+            if not np.isfinite(score):
+                break
+            article_id = int(rows[idx])
+            found = best.get(article_id)
+            if found is None:
+                if len(best) == limit:
+                    continue
+                best[article_id] = found = (float(score), [])
+            if len(found[1]) < per_article:
+                found[1].append(int(positions[idx]))
+        # Dicts keep insertion order: best passage score first
+        return [(article_id, score, tuple(found)) for article_id, (score, found) in best.items()]
+
+
+class SemanticSearch:
+    def __init__(self, embedder, store, batch_size=64):
+        self.embedder = embedder
+        self.store = store
+        self.batch_size = batch_size
+
+    def chunks(self, article, spans):
+        """``[(position, text), ...]`` to embed for ``article``'s passages."""
+        head = article.title or ''
+        if not spans:
+            # No content: embed the title and summary as passage 0
+            text = ('%s. %s' % (head, article.summary)) if article.summary else head
+            return [(0, text)] if text else []
+        content = article.content
+        return [(position, '%s. %s' % (head, content[start:end])) for position, start, end in spans]
+
+    def index(self, articles, track_sync=False):
+        """Embed ``articles`` in batches and replace their rows in the store.
+
+        With ``track_sync`` the articles must arrive ordered by
+        ``updated_at``; each flushed batch then advances the store's sync
+        point, so an interrupted run resumes where it stopped.
+        """
+        article_ids, row_ids, texts = [], [], []
+        latest = [None]
+
+        def flush():
+            vectors = self.embedder.encode(texts, batch_size=self.batch_size) if texts else []
+            self.store.replace(article_ids, row_ids, vectors, synced_at=latest[0])
+            del article_ids[:], row_ids[:], texts[:]
+
+        for article, spans in with_passages(articles):
+            article_ids.append(article.id)
+            if article.is_published:
+                for position, text in self.chunks(article, spans):
+                    texts.append(text)
+                    row_ids.append((article.id, position))
+            if track_sync and article.updated_at is not None:
+                latest[0] = article.updated_at
+            if len(texts) >= self.batch_size * 8:
+                flush()
+        if article_ids:
+            flush()
+
+    def search(self, query, limit=10, candidates=None):
+        if not query.strip():
+            return []
+        self.store.refresh()
+        vector = self.embedder.encode([query])[0]
+        return self.store.search(vector, limit=limit, candidates=candidates)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(app=None):
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                config = (app or current_app).config
+                embedder = create_embedder(config)
+                store = EmbeddingStore(
+                    config.get('SEMANTIC_INDEX_PATH', 'instance/semantic_index'),
+                    embedder.dim,
+                    config.get('SEMANTIC_INDEX_DTYPE', 'float32'),
+                    model=embedder.name,
+                )
+                store.refresh()
+                _engine = SemanticSearch(embedder, store)
+    return _engine
+
+
+def _index_query():
+    return db.session.query(
+        Article.id, Article.title, Article.summary, Article.content,
+        Article.is_published, Article.updated_at,
+    )
+
+
+def mark_dirty(article_ids):
+    # Registered by search_manager, which imports this module lazily.
+    # The ids travel with the job, so a Celery worker embeds them too.
+    embed_articles.delay(sorted(article_ids))
+
+
+@task('search.embed_articles', max_retries=3, retry_delay=10)
+def embed_articles(article_ids=None):
+    """Re-embed ``article_ids``, then catch up with the articles table."""
+    sync(article_ids)
+
+
+def sync(article_ids=None):
+    """Embed ``article_ids`` and articles written since the last sync.
+
+    Run by the background task and the CLI, never by a query: the first
+    sync of a new deployment embeds the whole archive. ``article_ids``
+    covers changes the ``updated_at`` sync point cannot see, such as
+    deletes.
+    """
+    engine = get_engine()
+    engine.store.refresh()
+    if article_ids:
+        ids = set(article_ids)
+        rows = _index_query().filter(Article.id.in_(ids)).all()
+        missing = ids - {row.id for row in rows}
+        if missing:
+            engine.store.replace(missing, [], [])
+        engine.index(rows)
+
+    synced_at = engine.store.synced_at
+    latest = db.session.query(db.func.max(Article.updated_at)).scalar()
+    if latest is None or (synced_at is not None and latest <= synced_at):
+        return engine
+    query = _index_query().order_by(Article.updated_at)
+    if synced_at is None:
+        query = query.filter(Article.is_published.is_(True))
+    else:
+        query = query.filter(Article.updated_at >= synced_at)
+    engine.index(query.yield_per(200), track_sync=True)
+    return engine
+
+
+def rebuild():
+    """Drop every stored vector and embed the whole published archive."""
+    engine = get_engine()
+    engine.store.refresh()
+    existing = set(int(i) for i in np.unique(engine.store.rows[:engine.store.count, 0]) if i >= 0)
+    if existing:
+        engine.store.replace(existing, [], [])
+    engine.store.meta.pop('synced_at', None)
+    return sync()
+
+
+def search(query, limit=10, candidates=None):
+    # Queries the store as the last sync left it; embedding is left to
+    # embed_articles and build_semantic_index
+    return get_engine().search(query, limit=limit, candidates=candidates)
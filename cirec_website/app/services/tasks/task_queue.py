@@ -0,0 +1,231 @@
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Retry(Exception):
+    """Raised by a task to be run again, optionally with new arguments.
+
+    A task that finished part of its work (e.g. sent half a batch of
+    mail) retries with only the remainder instead of repeating it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__('retry requested')
+        self.call_args = args
+        self.call_kwargs = kwargs
+
+
+class Task:
+    def __init__(self, queue, fn, name, max_retries=3, retry_delay=5):
+        self.queue = queue
+        self.fn = fn
+        self.name = name
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.__doc__ = fn.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.fn(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """Queue a call to the task; returns immediately."""
+        self.queue.enqueue(self.name, args, kwargs)
+
+    def backoff(self, attempt):
+        return self.retry_delay * 2 ** attempt
+
+
+class LocalBroker:
+    """In-process stand-in for a message broker.
+
+    Jobs wait in a heap ordered by the time they become due, so retries
+    can be scheduled with a backoff. Used by the thread-pool backend and
+    in tests, where ``TASK_WORKERS = 0`` leaves jobs queued until
+    ``TaskQueue.run_pending`` runs them in the calling thread.
+    """
+
+    def __init__(self):
+        self._jobs = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+
+    def put(self, job, eta=None):
+        with self._cond:
+            heapq.heappush(self._jobs, (eta or time.monotonic(), next(self._seq), job))
+            self._cond.notify()
+
+    def get(self, timeout=None, due_only=True):
+        """Take the next due job, waiting up to ``timeout`` seconds for one."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._jobs and (not due_only or self._jobs[0][0] <= now):
+                    self._running += 1
+                    return heapq.heappop(self._jobs)[2]
+                wait = self._jobs[0][0] - now if self._jobs else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
+
+    def done(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Wait until no job is queued or running; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._jobs or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+class TaskQueue:
+    """Background jobs on Celery, or on local worker threads without it.
+
+    Tasks are registered with ``@task(...)`` at import time and queued
+    with ``.delay()``. When ``CELERY_BROKER_URL`` is set and celery is
+    installed, jobs go to Celery; otherwise a ``LocalBroker`` feeds
+    ``TASK_WORKERS`` daemon threads in this process. Failed jobs are
+    retried with exponential backoff up to the task's ``max_retries``.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.app = None
+        self.celery = None
+        self.broker = LocalBroker()
+        self.workers = 2
+        self._celery_tasks = {}
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def task(self, name, max_retries=3, retry_delay=5):
+        def decorator(fn):
+            task = Task(self, fn, name, max_retries=max_retries, retry_delay=retry_delay)
+            self.tasks[name] = task
+            if self.celery is not None:
+                self._register_celery(task)
+            return task
+        return decorator
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('TASK_WORKERS', 2)
+        broker_url = app.config.get('CELERY_BROKER_URL')
+        if broker_url and self.celery is None:
+            try:
+                from celery import Celery
+            except ImportError:
+                logger.warning('CELERY_BROKER_URL is set but celery is not installed; '
+                               'running tasks on local worker threads')
+            else:
+                self.celery = Celery(app.import_name, broker=broker_url)
+                self.celery.conf.update(task_acks_late=True, task_ignore_result=True)
+                for task in self.tasks.values():
+                    self._register_celery(task)
+        atexit.register(self.shutdown)
+
+    def _register_celery(self, task):
+        queue = self
+
+        def run(celery_task, *args, **kwargs):
+            with queue.app.app_context():
+                try:
+                    return task.fn(*args, **kwargs)
+                except Retry as exc:
+                    raise celery_task.retry(args=exc.call_args or args, kwargs=exc.call_kwargs or kwargs,
+                                            countdown=task.backoff(celery_task.request.retries))
+                except Exception as exc:
+                    raise celery_task.retry(exc=exc, countdown=task.backoff(celery_task.request.retries))
+
+        self._celery_tasks[task.name] = self.celery.task(
+            run, name=task.name, bind=True, max_retries=task.max_retries)
+
+    def enqueue(self, name, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        if self.celery is not None:
+            try:
+                self._celery_tasks[name].apply_async(args=args, kwargs=kwargs)
+                return
+            except Exception:
+                logger.exception('Could not publish %s to Celery; running it locally', name)
+        self.broker.put({'name': name, 'args': tuple(args), 'kwargs': kwargs, 'attempt': 0})
+        self._ensure_workers()
+
+    def _ensure_workers(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._start_lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='task-worker-%d' % len(self._threads),
+                                          daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _work(self):
+        while True:
+            job = self.broker.get()
+            try:
+                self.execute(job)
+            finally:
+                self.broker.done()
+
+    def execute(self, job):
+        """Run one job from the local broker, re-queueing it if it fails."""
+        task = self.tasks[job['name']]
+        try:
+            with self.app.app_context():
+                task.fn(*job['args'], **job['kwargs'])
+            return True
+        except Exception as exc:
+            if job['attempt'] >= task.max_retries:
+                logger.exception('Task %s failed after %d attempts', task.name, job['attempt'] + 1)
+                return False
+            if isinstance(exc, Retry):
+                job = dict(job, args=exc.call_args or job['args'], kwargs=exc.call_kwargs or job['kwargs'])
+            else:
+                logger.warning('Task %s failed (%s); retrying', task.name, exc)
+            self.broker.put(dict(job, attempt=job['attempt'] + 1),
+                            eta=time.monotonic() + task.backoff(job['attempt']))
+            return False
+
+    def run_pending(self, ignore_eta=True):
+        """Run queued jobs in this thread until none are left; for tests."""
+        count = 0
+        while True:
+            job = self.broker.get(timeout=0, due_only=not ignore_eta)
+            if job is None:
+                return count
+            try:
+                self.execute(job)
+            finally:
+                self.broker.done()
+            count += 1
+
+    def shutdown(self, timeout=10):
+        """Give local workers a chance to finish queued jobs at exit."""
+        if self._threads:
+            self.broker.join(timeout)
+
+
+queue = TaskQueue()
+task = queue.task
+
+
+def init_app(app):
+    queue.init_app(app)
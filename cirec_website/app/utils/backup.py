@@ -0,0 +1,550 @@
+"""Streaming, compressed database backups and their parallel restore.
+
+A backup is a directory with one gzip file per table and a manifest::
+
+    instance/backups/20261018T093000-full/
+        manifest.json          row counts and the SHA-256 of every file
+        articles.copy.gz       rows in PostgreSQL's COPY text format
+        users.copy.gz
+        ...
+
+Tables are read by parallel workers, one table each, in keyset-ordered
+chunks (``WHERE pk > :last ORDER BY pk LIMIT n``). Chunk sizes adapt to
+keep about ``BACKUP_CHUNK_BYTES`` of rows in memory per worker, so the
+large article bodies never spike RAM. On PostgreSQL every worker reads
+the same exported snapshot in a REPEATABLE READ transaction, so the
+backup is consistent across tables and, being an MVCC read, never
+blocks writers. The manifest is written last and the directory renamed
+into place, so an unfinished backup is never mistaken for a complete one.
+
+An incremental backup holds the articles whose ``updated_at`` moved
+since the previous backup, with the rows derived from them, plus the ids
+of all articles so a restore can drop deleted ones. ``updated_at`` is
+stamped by the writer before its transaction commits, so a row can
+become visible after a backup with a later watermark has been taken;
+each incremental therefore starts ``BACKUP_WATERMARK_MARGIN_SECONDS``
+before the previous watermark, and the rows it copies twice are simply
+replaced on restore. The other tables are
+small and are copied in full every time. (View counts are flushed
+without touching ``updated_at``; an article's ``view_count`` is restored
+as of the last backup that carried the article, while the daily counts
+are always complete.)
+
+A restore replaces the contents of the backed-up tables. Tables load in
+foreign-key order, each level's tables in parallel: straight into
+``COPY ... FROM STDIN`` on PostgreSQL, and through ``executemany``
+elsewhere. Every file is checked against its SHA-256 before any table
+is emptied, and again as it is loaded, inside the table's transaction.
+Secondary indexes are dropped first and built once the data is in.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.sql import sqltypes
+
+from app.extensions import db
+from app.utils.bulk_loader import copy_value, create_indexes, drop_indexes
+from app.utils.record_sources import copy_unescape
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+MANIFEST = 'manifest.json'
+FIRST_CHUNK = 1000
+MIN_CHUNK = 50
+MAX_CHUNK = 50000
+KEYS_CHUNK = 50000
+INSERT_BATCH = 1000
+READ_SIZE = 1024 * 1024
+SNAPSHOT_RE = re.compile(r'^[0-9A-F-]+$')
+
+# Tables copied incrementally, by their change-tracking column
+TRACKED = {'articles': 'updated_at'}
+# Tables derived from a tracked table's rows: {table: (parent, column)}
+DERIVED = {
+    'article_term_offsets': ('articles', 'article_id'),
+    'article_passages': ('articles', 'article_id'),
+    'article_entities': ('articles', 'article_id'),
+}
+
+
+class BackupError(Exception):
+    pass
+
+
+class HashingFile:
+    """A binary file that hashes the bytes written to or read from it."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.fh.write(data)
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+    def flush(self):
+        self.fh.flush()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+
+def _encoder(column):
+    if isinstance(column.type, sqltypes.JSON):
+        return lambda value: copy_value(None if value is None else json.dumps(value))
+    return copy_value
+
+
+def _decoder(column):
+    """Parses a COPY text field back into ``column``'s Python type."""
+    kind = column.type
+    if isinstance(kind, sqltypes.Boolean):
+        parse = lambda value: value == 't'
+    elif isinstance(kind, sqltypes.DateTime):
+        parse = datetime.fromisoformat
+    elif isinstance(kind, sqltypes.Date):
+        parse = date.fromisoformat
+    elif isinstance(kind, sqltypes.Integer):
+        parse = int
+    elif isinstance(kind, sqltypes.Float):
+        parse = float
+    elif isinstance(kind, sqltypes.Numeric):
+        parse = Decimal
+    elif isinstance(kind, sqltypes.JSON):
+        parse = json.loads
+    else:
+        return copy_unescape
+
+    def decode(field):
+        value = copy_unescape(field)
+        return None if value is None else parse(value)
+    return decode
+
+
+def _tables():
+    return {table.name: table for table in db.metadata.sorted_tables}
+
+
+def _levels(tables):
+    """``tables`` grouped so each group only references earlier groups."""
+    names = {table.name for table in tables}
+    level = {}
+    for table in db.metadata.sorted_tables:  # parents before children
+        if table.name not in names:
+            continue
+        parents = {fk.column.table.name for fk in table.foreign_keys} & names - {table.name}
+        level[table.name] = 1 + max((level[parent] for parent in parents), default=-1)
+    groups = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for table in tables:
+        groups[level[table.name]].append(table)
+    return groups
+
+
+# Backup
+
+@contextmanager
+def _snapshot():
+    """An exported snapshot id on PostgreSQL, held open for the workers."""
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        yield None
+        return
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level='REPEATABLE READ')
+        with connection.begin():
+            connection.execute(text('SET TRANSACTION READ ONLY'))
+            yield connection.execute(text('SELECT pg_export_snapshot()')).scalar()
+
+
+@contextmanager
+def _reader(snapshot):
+    with db.engine.connect() as connection:
+        if snapshot is not None:
+            if not SNAPSHOT_RE.match(snapshot):
+                raise BackupError('Unexpected snapshot id %r' % snapshot)
+            connection.execution_options(isolation_level='REPEATABLE READ')
+        with connection.begin():
+            if snapshot is not None:
+                connection.execute(text("SET TRANSACTION SNAPSHOT '%s'" % snapshot))
+            yield connection
+
+
+def _keyset(connection, columns, key, where, chunk_bytes, encode):
+    """Encoded chunks of ``columns`` in ``key`` order, sized to ``chunk_bytes``."""
+    limit = FIRST_CHUNK
+    last = None
+    positions = [columns.index(column) for column in key]
+    while True:
+        query = select(*columns).order_by(*key).limit(limit)
+        if where is not None:
+            query = query.where(where)
+        if last is not None:
+            query = query.where(key[0] > last[0] if len(key) == 1 else tuple_(*key) > tuple_(*last))
+        rows = connection.execute(query).fetchall()
+        if not rows:
+            return
+        data = ''.join(encode(row) for row in rows).encode('utf-8')
+        yield len(rows), data
+        if len(rows) < limit:
+            return
+        last = [rows[-1][i] for i in positions]
+        limit = max(MIN_CHUNK, min(MAX_CHUNK, len(rows) * chunk_bytes // max(len(data), 1)))
+
+
+def _write_file(path, chunks, level):
+    """Compress ``chunks`` into ``path``; returns ``(rows, bytes, sha256)``."""
+    rows = 0
+    with open(path, 'wb') as raw:
+        hashing = HashingFile(raw)
+        with gzip.GzipFile(fileobj=hashing, mode='wb', compresslevel=level, mtime=0) as out:
+            for count, data in chunks:
+                out.write(data)
+                rows += count
+    return rows, hashing.size, hashing.hexdigest()
+
+
+def _selection(table, tables, since):
+    """Filter of an incremental backup for ``table``, and its mode."""
+    if since is None:
+        return None, 'full'
+    if table.name in TRACKED:
+        return table.c[TRACKED[table.name]] >= since, 'changed'
+    if table.name in DERIVED:
+        parent_name, column = DERIVED[table.name]
+        parent = tables[parent_name]
+        changed = select(parent.c.id).where(parent.c[TRACKED[parent_name]] >= since)
+        return table.c[column].in_(changed), 'changed'
+    return None, 'full'
+
+
+def _dump_table(app, table, directory, snapshot, since):
+    with app.app_context():
+        started = time.perf_counter()
+        chunk_bytes = _config('BACKUP_CHUNK_BYTES', 8 * 1024 * 1024)
+        level = _config('BACKUP_COMPRESSLEVEL', 6)
+        columns = list(table.columns)
+        key = list(table.primary_key.columns)
+        encoders = [_encoder(column) for column in columns]
+
+        def encode(row):
+            return '\t'.join(encoder(value) for encoder, value in zip(encoders, row)) + '\n'
+
+        entry = {'file': table.name + '.copy.gz', 'columns': [column.name for column in columns]}
+        with _reader(snapshot) as connection:
+            where, entry['mode'] = _selection(table, _tables(), since)
+            chunks = _keyset(connection, columns, key, where, chunk_bytes, encode)
+            entry['rows'], entry['bytes'], entry['sha256'] = _write_file(
+                os.path.join(directory, entry['file']), chunks, level)
+            if entry['mode'] == 'changed' and table.name in TRACKED:
+                # Every current id, so a restore can tell deletions from old rows
+                keys = _keyset(connection, [table.c.id], [table.c.id], None, KEYS_CHUNK * 8,
+                               lambda row: '%d\n' % row[0])
+                entry['keys'] = {'file': table.name + '.keys.gz'}
+                entry['keys']['rows'], entry['keys']['bytes'], entry['keys']['sha256'] = _write_file(
+                    os.path.join(directory, entry['keys']['file']), keys, level)
+        entry['seconds'] = round(time.perf_counter() - started, 2)
+        logger.info('Backed up %s: %d rows, %d bytes', table.name, entry['rows'], entry['bytes'])
+        return table.name, entry
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        raise BackupError('%s is not a complete backup' % path)
+    if manifest.get('format') != FORMAT:
+        raise BackupError('%s has unsupported format %r' % (path, manifest.get('format')))
+    return manifest
+
+
+def list_backups(root=None):
+    """Complete backups under ``root``, oldest first."""
+    root = root or _config('BACKUP_DIR', 'instance/backups')
+    if not os.path.isdir(root):
+        return []
+    return [os.path.join(root, name) for name in sorted(os.listdir(root))
+            if os.path.isfile(os.path.join(root, name, MANIFEST))]
+
+
+def backup(root=None, incremental=False, workers=None):
+    """Write a backup under ``root``; returns its path and manifest."""
+    root = root or _config('BACKUP_DIR', 'instance/backups')
+    workers = workers or _config('BACKUP_WORKERS', 4)
+    base = None
+    since = None
+    if incremental:
+        previous = list_backups(root)
+        if not previous:
+            raise BackupError('No earlier backup in %s to base an incremental backup on' % root)
+        base = os.path.basename(previous[-1])
+        watermark = read_manifest(previous[-1])['watermark']
+        if watermark:
+            # Catch rows committed late, by writers that stamped them earlier
+            margin = _config('BACKUP_WATERMARK_MARGIN_SECONDS', 900)
+            since = datetime.fromisoformat(watermark) - timedelta(seconds=margin)
+        else:
+            since = None
+
+    started = datetime.utcnow()
+    name = '%s-%s' % (started.strftime('%Y%m%dT%H%M%S'), 'incr' if incremental else 'full')
+    final = os.path.join(root, name)
+    directory = final + '.partial'
+    os.makedirs(directory)
+    tables = _tables()
+    app = current_app._get_current_object()
+    # The big tables first, so they do not end up last on one worker
+    order = sorted(tables.values(), key=lambda t: (t.name not in TRACKED, t.name not in DERIVED, t.name))
+    try:
+        with _snapshot() as snapshot:
+            with _reader(snapshot) as connection:
+                articles = tables['articles']
+                watermark = connection.execute(select(db.func.max(articles.c.updated_at))).scalar()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_dump_table, app, table, directory, snapshot, since) for table in order]
+                entries = dict(future.result() for future in futures)
+        manifest = {
+            'format': FORMAT, 'name': name, 'kind': 'incremental' if incremental else 'full',
+            'base': base, 'since': since.isoformat() if since else None,
+            'watermark': watermark.isoformat() if watermark else None,
+            'created_at': started.isoformat(), 'dialect': db.engine.dialect.name,
+            'seconds': round((datetime.utcnow() - started).total_seconds(), 2),
+            'tables': {name: entries[name] for name in tables},
+        }
+        with open(os.path.join(directory, MANIFEST), 'w') as fh:
+            json.dump(manifest, fh, indent=2)
+        os.replace(directory, final)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return final, manifest
+
+
+# Restore
+
+def backup_chain(path):
+    """The full backup ``path`` builds on, then the incrementals up to it."""
+    chain = []
+    while True:
+        manifest = read_manifest(path)
+        chain.append((path, manifest))
+        if manifest['kind'] == 'full':
+            return list(reversed(chain))
+        if not manifest['base']:
+            raise BackupError('%s has no base backup' % path)
+        path = os.path.join(os.path.dirname(path), manifest['base'])
+
+
+@contextmanager
+def _checked(path, expected):
+    """Decompressed contents of ``path``; raises unless its SHA-256 is ``expected``."""
+    try:
+        with open(path, 'rb') as raw:
+            hashing = HashingFile(raw)
+            with gzip.GzipFile(fileobj=hashing, mode='rb') as data:
+                yield data
+            while hashing.read(READ_SIZE):
+                pass
+    except (EOFError, gzip.BadGzipFile, zlib.error) as exc:
+        raise BackupError('%s is damaged: %s' % (path, exc))
+    except FileNotFoundError:
+        raise BackupError('%s is missing' % path)
+    if hashing.hexdigest() != expected:
+        raise BackupError('%s is damaged: checksum mismatch' % path)
+
+
+def _read_ids(path, entry, column=0):
+    """Integer values of ``column`` in a backup file."""
+    ids = set()
+    with _checked(path, entry['sha256']) as data:
+        for line in io.TextIOWrapper(data, encoding='utf-8'):
+            ids.add(int(line.split('\t', column + 1)[column]))
+    return ids
+
+
+def verify_backup(path):
+    """Check every file of ``path`` and the backups it builds on."""
+    checked = 0
+    for directory, manifest in backup_chain(path):
+        for entry in manifest['tables'].values():
+            for item in (entry, entry.get('keys')):
+                if item:
+                    with _checked(os.path.join(directory, item['file']), item['sha256']) as data:
+                        while data.read(READ_SIZE):
+                            pass
+                    checked += 1
+    return checked
+
+
+def _stale_ids(chain, table_name):
+    """Per incremental backup, the ids of ``table_name`` it replaces or deletes."""
+    directory, manifest = chain[0]
+    entry = manifest['tables'][table_name]
+    id_column = entry['columns'].index('id')
+    present = _read_ids(os.path.join(directory, entry['file']), entry, id_column)
+    stale = []
+    for directory, manifest in chain[1:]:
+        entry = manifest['tables'][table_name]
+        changed = _read_ids(os.path.join(directory, entry['file']), entry, id_column)
+        if entry['mode'] == 'full':
+            # No watermark to go by (the base had no articles): the table was copied whole
+            stale.append(present)
+            present = changed
+            continue
+        current = _read_ids(os.path.join(directory, entry['keys']['file']), entry['keys'])
+        stale.append(changed | (present - current))
+        present = current
+    return stale
+
+
+def _load_file(connection, table, path, entry):
+    columns = [table.c[name] for name in entry['columns']]
+    with _checked(path, entry['sha256']) as data:
+        if connection.dialect.name == 'postgresql':
+            quote = connection.dialect.identifier_preparer.quote
+            statement = 'COPY %s (%s) FROM STDIN' % (
+                quote(table.name), ', '.join(quote(column.name) for column in columns))
+            cursor = connection.connection.cursor()
+            try:
+                cursor.copy_expert(statement, data, size=READ_SIZE)
+            finally:
+                cursor.close()
+            return
+        decoders = [_decoder(column) for column in columns]
+        names = [column.name for column in columns]
+        batch = []
+        for line in io.TextIOWrapper(data, encoding='utf-8', newline='\n'):
+            fields = line.rstrip('\n').split('\t')
+            batch.append(dict(zip(names, (decode(field) for decode, field in zip(decoders, fields)))))
+            if len(batch) >= INSERT_BATCH:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+
+
+def _delete_ids(connection, column, ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), 500):
+        connection.execute(column.table.delete().where(column.in_(ids[start:start + 500])))
+
+
+def _restore_table(app, table, chain, stale):
+    """Load ``table`` from the full backup, then apply each incremental."""
+    with app.app_context():
+        started = time.perf_counter()
+        with db.engine.begin() as connection:
+            tracked = table.name in TRACKED or table.name in DERIVED
+            # Untracked tables are complete in every backup: take the newest
+            sources = chain if tracked else chain[-1:]
+            for step, (directory, manifest) in enumerate(sources):
+                entry = manifest['tables'].get(table.name)
+                if entry is None:
+                    continue
+                if tracked and step > 0:
+                    column = table.c.id if table.name in TRACKED else table.c[DERIVED[table.name][1]]
+                    _delete_ids(connection, column, stale[step - 1])
+                _load_file(connection, table, os.path.join(directory, entry['file']), entry)
+        logger.info('Restored %s in %.1f s', table.name, time.perf_counter() - started)
+        return table.name, round(time.perf_counter() - started, 2)
+
+
+def _clear(tables):
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            quote = connection.dialect.identifier_preparer.quote
+            connection.execute(text('TRUNCATE %s RESTART IDENTITY CASCADE'
+                                    % ', '.join(quote(table.name) for table in tables)))
+            return
+        for table in reversed([t for t in db.metadata.sorted_tables if t in tables]):
+            connection.execute(table.delete())
+
+
+def _reset_sequences(tables):
+    with db.engine.begin() as connection:
+        if connection.dialect.name != 'postgresql':
+            return
+        quote = connection.dialect.identifier_preparer.quote
+        for table in tables:
+            if 'id' in table.c and isinstance(table.c.id.type, sqltypes.Integer):
+                connection.execute(text(
+                    "SELECT setval(pg_get_serial_sequence(:name, 'id'), COALESCE(MAX(id), 1)) FROM %s"
+                    % quote(table.name)), {'name': table.name})
+
+
+def restore(path, workers=None, defer_indexes=True, verify=True):
+    """Replace the backed-up tables with the contents of ``path``.
+
+    With ``verify`` every file is checked before any table is emptied, so
+    a damaged backup leaves the database as it was.
+    """
+    chain = backup_chain(path)
+    if verify:
+        verify_backup(path)
+    workers = workers or _config('BACKUP_WORKERS', 4)
+    if db.engine.dialect.name == 'sqlite':
+        workers = 1  # one writer at a time
+    all_tables = _tables()
+    names = chain[-1][1]['tables']
+    missing = [name for name in names if name not in all_tables]
+    if missing:
+        raise BackupError('Backup has tables this schema lacks: %s' % ', '.join(missing))
+    tables = [all_tables[name] for name in names]
+    stale = {name: _stale_ids(chain, name) for name in TRACKED if name in names and len(chain) > 1}
+    for name, (parent, _) in DERIVED.items():
+        if parent in stale:
+            stale[name] = stale[parent]
+
+    started = time.perf_counter()
+    app = current_app._get_current_object()
+    timings = {}
+    _clear(tables)
+    if defer_indexes:
+        drop_indexes(tables)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for group in _levels(tables):
+                futures = [executor.submit(_restore_table, app, table, chain, stale.get(table.name, []))
+                           for table in group]
+                timings.update(future.result() for future in futures)
+    finally:
+        if defer_indexes:
+            index_started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda table: _in_app(app, create_indexes, [table]), tables))
+            timings['indexes'] = round(time.perf_counter() - index_started, 2)
+    _reset_sequences(tables)
+    return {'backups': [os.path.basename(directory) for directory, _ in chain],
+            'seconds': round(time.perf_counter() - started, 2), 'tables': timings}
+
+
+def _in_app(app, fn, *args):
+    with app.app_context():
+        return fn(*args)
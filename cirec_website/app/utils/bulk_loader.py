@@ -0,0 +1,646 @@
+"""Bulk loading of legacy subscribers and articles.
+
+Records (see ``app.utils.record_sources``) are mapped onto the
+``users`` or ``articles`` columns and written in large batches: through
+``COPY ... FROM STDIN`` on PostgreSQL and ``executemany`` elsewhere,
+with the tables' secondary indexes dropped for the load and rebuilt
+once at the end. The CPU-heavy part of each batch runs in a process
+pool while the previous batch is being written: password hashing for
+users; previews, snippet offsets, passages and facets for articles.
+
+Loads are idempotent and resumable. Rows whose key is already in the
+table (a user's email; an article's legacy id, or its title and date)
+are skipped, and a checkpoint file records how many source records have
+been committed, so an interrupted run continues where it stopped.
+Articles take new ids from the table's sequence; the id a record had in
+the old site is kept in ``articles.legacy_id``.
+
+Rows are written with Core inserts, so the ORM's write hooks do not
+run: the loader writes the derived rows of new articles itself, and
+stamps ``updated_at`` with the load time so the search indexes'
+periodic refresh picks the articles up.
+"""
+import abc
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import inspect, text
+
+from app.extensions import db
+from app.models.article import Article
+from app.models.search_index import ArticleEntity, ArticlePassage
+from app.models.user import User
+from app.services.content.article_service import (derived_fields, passage_spans, term_offsets,
+                                                  write_passages, write_term_offsets)
+from app.services.content.entity_extractor import extract, write_entities
+from app.utils import security
+
+logger = logging.getLogger(__name__)
+
+KEY_CHUNK = 500  # keys per IN (...) lookup; under SQLite's variable limit
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'on'}
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%d.%m.%Y', '%m/%d/%Y')
+
+# Column names of common legacy schemas, by the column they fill
+USER_ALIASES = {
+    'email': ('email', 'e_mail', 'mail', 'user_email'),
+    'username': ('username', 'user_name', 'login', 'user_login'),
+    'first_name': ('first_name', 'firstname', 'fname', 'given_name'),
+    'last_name': ('last_name', 'lastname', 'lname', 'surname', 'family_name'),
+    'name': ('name', 'full_name', 'fullname', 'display_name'),
+    'company': ('company', 'organisation', 'organization', 'company_name'),
+    'telephone': ('telephone', 'phone', 'tel', 'phone_number'),
+    'password': ('password', 'pass', 'passwd', 'plain_password'),
+    'password_hash': ('password_hash',),
+    'is_admin': ('is_admin', 'admin'),
+    'is_active': ('is_active', 'active', 'enabled'),
+    'created_at': ('created_at', 'created', 'date_joined', 'registered', 'registration_date'),
+    'last_login': ('last_login', 'last_login_at'),
+    'account_type': ('account_type',),
+    'subscription_status': ('subscription_status', 'status'),
+    'subscription_start': ('subscription_start', 'start_date', 'subscribed_at'),
+    'subscription_end': ('subscription_end', 'end_date', 'expires', 'expiry_date'),
+    'subscription_plan': ('subscription_plan', 'plan'),
+    'auto_renew': ('auto_renew',),
+    'monthly_news': ('monthly_news',),
+    'newsletter': ('newsletter', 'mailing_list'),
+}
+ARTICLE_ALIASES = {
+    'id': ('id', 'article_id'),
+    'title': ('title', 'headline', 'subject'),
+    'content': ('content', 'body', 'text', 'article_text'),
+    'summary': ('summary', 'abstract', 'lead'),
+    'author': ('author', 'byline'),
+    'source_file': ('source_file', 'issue', 'source'),
+    'file_path': ('file_path',),
+    'created_at': ('created_at', 'created', 'date', 'published_at', 'pub_date'),
+    'is_published': ('is_published', 'published', 'visible'),
+    'view_count': ('view_count', 'views', 'hits'),
+}
+
+
+def _text(value, length=None):
+    if value is None:
+        return None
+    value = str(value).replace('\x00', '').strip()
+    if not value:
+        return None
+    return value[:length] if length else value
+
+
+def _bool(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def _int(value, default=None):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _datetime(value):
+    """A naive UTC datetime from ISO text, common date formats or a timestamp."""
+    if value is None or isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    if not value or value.startswith('0000-00-00'):
+        return None
+    if value.replace('.', '', 1).isdigit() and len(value) >= 9:
+        return datetime.utcfromtimestamp(float(value))
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+        return None
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def _column_defaults(table):
+    """Python-side column defaults, which COPY would not apply."""
+    defaults = {}
+    for column in table.columns:
+        default = column.default
+        if default is not None and (default.is_scalar or default.is_callable):
+            defaults[column.name] = default
+    return defaults
+
+
+def _apply_defaults(row, defaults):
+    for name, default in defaults.items():
+        if row.get(name) is None:
+            row[name] = default.arg if default.is_scalar else default.arg(None)
+    return row
+
+
+class Target(abc.ABC):
+    """How records become rows of one table."""
+
+    table = None
+    aliases = {}
+    derived_tables = ()
+
+    def __init__(self, mapping=None):
+        self.mapping = {target: source.lower() for target, source in (mapping or {}).items()}
+        self.defaults = _column_defaults(self.table)
+        self.lengths = {column.name: getattr(column.type, 'length', None) for column in self.table.columns}
+
+    def fields(self, record):
+        """``record`` renamed onto target field names."""
+        record = {str(name).strip().lower(): value for name, value in record.items()}
+        fields = {}
+        for target, source in self.mapping.items():
+            if source in record:
+                fields[target] = record[source]
+        for target, names in self.aliases.items():
+            if target in fields:
+                continue
+            for name in names:
+                if record.get(name) not in (None, ''):
+                    fields[target] = record[name]
+                    break
+        return fields
+
+    @abc.abstractmethod
+    def prepare(self, record):
+        """The row for ``record``, or None when it cannot be loaded."""
+
+    def compute(self, rows):
+        """CPU-heavy completion of ``rows``; runs in a worker process."""
+        return rows
+
+    @abc.abstractmethod
+    def key(self, row):
+        """What identifies ``row`` across loads."""
+
+    @abc.abstractmethod
+    def existing(self, connection, rows):
+        """Keys of ``rows`` already in the table."""
+
+    def allocate(self, connection, rows):
+        """Last chance to adjust new rows before they are written."""
+
+    def insert(self, connection, rows):
+        columns = [column.name for column in self.table.columns if column.name in rows[0]]
+        insert_rows(connection, self.table, columns, rows)
+
+    def after_insert(self, connection, rows):
+        """Write rows that depend on the new ones."""
+
+
+class UserTarget(Target):
+    table = User.__table__
+    aliases = USER_ALIASES
+
+    def prepare(self, record):
+        fields = self.fields(record)
+        email = _text(fields.get('email'), self.lengths['email'])
+        if not email or '@' not in email:
+            return None
+        email = email.lower()
+        first, last = _text(fields.get('first_name')), _text(fields.get('last_name'))
+        if not first and not last and fields.get('name'):
+            first, _, last = _text(fields['name']).partition(' ')
+        now = datetime.utcnow()
+        end = _datetime(fields.get('subscription_end'))
+        status = _text(fields.get('subscription_status'), 20)
+        if status not in ('active', 'inactive', 'expired'):
+            status = ('active' if end > now else 'expired') if end else 'inactive'
+        row = {
+            'email': email,
+            'username': _text(fields.get('username'), self.lengths['username']) or email[:self.lengths['username']],
+            'first_name': (first or '')[:self.lengths['first_name']],
+            'last_name': (last or '').strip()[:self.lengths['last_name']],
+            'company': _text(fields.get('company'), self.lengths['company']),
+            'telephone': _text(fields.get('telephone'), self.lengths['telephone']),
+            'password_hash': _text(fields.get('password_hash'), self.lengths['password_hash']),
+            'is_admin': _bool(fields.get('is_admin'), False),
+            'is_active': _bool(fields.get('is_active'), True),
+            'created_at': _datetime(fields.get('created_at')),
+            'last_login': _datetime(fields.get('last_login')),
+            'account_type': _text(fields.get('account_type'), 20),
+            'subscription_status': status,
+            'subscription_start': _datetime(fields.get('subscription_start')),
+            'subscription_end': end,
+            'subscription_plan': _text(fields.get('subscription_plan'), 20),
+            'auto_renew': _bool(fields.get('auto_renew'), False),
+            'monthly_news': _text(fields.get('monthly_news'), 20),
+            'newsletter': _bool(fields.get('newsletter'), True),
+        }
+        # Hashed in compute(); never written as given
+        row['_password'] = None if row['password_hash'] else _text(fields.get('password'))
+        return _apply_defaults(row, self.defaults)
+
+    def compute(self, rows):
+        for row in rows:
+            password = row.pop('_password', None)
+            if password:
+                row['password_hash'] = security.hash_password(password)
+        return rows
+
+    def key(self, row):
+        return row['email']
+
+    def existing(self, connection, rows):
+        column = self.table.c.email
+        return _lookup(connection, column, [row['email'] for row in rows])
+
+    def allocate(self, connection, rows):
+        # Usernames are unique too; a taken one gets a suffix from the email
+        column = self.table.c.username
+        taken = _lookup(connection, column, [row['username'] for row in rows])
+        length = self.lengths['username']
+        for row in rows:
+            if row['username'] in taken:
+                suffix = '-' + hashlib.sha1(row['email'].encode('utf-8')).hexdigest()[:8]
+                row['username'] = row['username'][:length - len(suffix)] + suffix
+            taken.add(row['username'])
+
+
+class ArticleTarget(Target):
+    table = Article.__table__
+    aliases = ARTICLE_ALIASES
+    derived_tables = (ArticlePassage.__table__, ArticleEntity.__table__)
+
+    def prepare(self, record):
+        fields = self.fields(record)
+        title = _text(fields.get('title'), self.lengths['title'])
+        if not title:
+            return None
+        row = {
+            'id': None,
+            'legacy_id': _int(fields.get('id')),
+            'title': title,
+            'content': _text(fields.get('content')),
+            'summary': _text(fields.get('summary')),
+            'author': _text(fields.get('author'), self.lengths['author']),
+            'source_file': _text(fields.get('source_file'), self.lengths['source_file']),
+            'file_path': _text(fields.get('file_path'), self.lengths['file_path']),
+            'created_at': _datetime(fields.get('created_at')),
+            'is_published': _bool(fields.get('is_published'), True),
+            'view_count': _int(fields.get('view_count'), 0),
+            # Load time, so the search indexes' refresh finds the new rows
+            'updated_at': datetime.utcnow(),
+        }
+        return _apply_defaults(row, self.defaults)
+
+    def compute(self, rows):
+        for row in rows:
+            row.update(derived_fields(row['content']))
+            # Snippet offsets, passages and facets, written once ids are known
+            row['_offsets'] = term_offsets(row['content'])
+            row['_passages'] = passage_spans(row['content'])
+            row['_entities'] = extract(row['title'], row['content'])
+        return rows
+
+    def key(self, row):
+        if row['legacy_id'] is not None:
+            return ('legacy', row['legacy_id'])
+        return (row['title'], row['created_at'])
+
+    def existing(self, connection, rows):
+        legacy_ids = [row['legacy_id'] for row in rows if row['legacy_id'] is not None]
+        found = {('legacy', legacy_id) for legacy_id in _lookup(connection, self.table.c.legacy_id, legacy_ids)}
+        titles = [row['title'] for row in rows if row['legacy_id'] is None]
+        for start in range(0, len(titles), KEY_CHUNK):
+            query = (self.table.select().with_only_columns(self.table.c.title, self.table.c.created_at)
+                     .where(self.table.c.title.in_(titles[start:start + KEY_CHUNK])))
+            found.update((row.title, row.created_at) for row in connection.execute(query))
+        return found
+
+    def allocate(self, connection, rows):
+        # Drawn from the sequence, as the app's own inserts are, so COPY
+        # needs no RETURNING and nothing written meanwhile can collide
+        if connection.dialect.name != 'postgresql':
+            return
+        ids = connection.execute(
+            text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :n)"),
+            {'table': self.table.name, 'n': len(rows)}).scalars()
+        for row, article_id in zip(rows, ids):
+            row['id'] = article_id
+
+    def insert(self, connection, rows):
+        if connection.dialect.name == 'postgresql':
+            return super().insert(connection, rows)
+        # No sequence to draw from; let the database number the rows
+        columns = [column.name for column in self.table.columns if column.name in rows[0] and column.name != 'id']
+        result = connection.execute(self.table.insert().returning(self.table.c.id, sort_by_parameter_order=True),
+                                    [{name: row[name] for name in columns} for row in rows])
+        for row, article_id in zip(rows, result.scalars()):
+            row['id'] = article_id
+
+    def after_insert(self, connection, rows):
+        write_term_offsets(connection, [(row['id'], row.pop('_offsets')) for row in rows])
+        write_passages(connection, [(row['id'], row.pop('_passages')) for row in rows])
+        write_entities(connection, [(row['id'], row.pop('_entities')) for row in rows])
+
+
+TARGETS = {'users': UserTarget, 'articles': ArticleTarget}
+
+
+def _lookup(connection, column, values):
+    """The subset of ``values`` present in ``column``."""
+    values = list(set(values))
+    found = set()
+    for start in range(0, len(values), KEY_CHUNK):
+        query = column.table.select().with_only_columns(column).where(column.in_(values[start:start + KEY_CHUNK]))
+        found.update(connection.execute(query).scalars())
+    return found
+
+
+def copy_value(value):
+    """``value`` in PostgreSQL's COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    value = str(value)
+    if '\\' in value or '\t' in value or '\n' in value or '\r' in value:
+        value = value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return value
+
+
+def copy_rows(connection, table, columns, rows):
+    """Write ``rows`` with a single ``COPY ... FROM STDIN``."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(row[name]) for name in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+    quote = connection.dialect.identifier_preparer.quote
+    statement = 'COPY %s (%s) FROM STDIN' % (quote(table.name), ', '.join(quote(name) for name in columns))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table, columns, rows):
+    if connection.dialect.name == 'postgresql':
+        copy_rows(connection, table, columns, rows)
+    else:
+        connection.execute(table.insert(), [{name: row[name] for name in columns} for row in rows])
+
+
+def _deferrable(tables, connection):
+    """The non-unique indexes of ``tables`` present in the database."""
+    inspector = inspect(connection)
+    present = {index['name'] for table in tables for index in inspector.get_indexes(table.name)}
+    indexes = [index for table in tables for index in table.indexes if not index.unique]
+    return indexes, [index for index in indexes if index.name in present]
+
+
+def drop_indexes(tables):
+    with db.engine.begin() as connection:
+        indexes, present = _deferrable(tables, connection)
+        for index in present:
+            index.drop(connection)
+    logger.info('Dropped %d indexes for the load', len(present))
+    return indexes
+
+
+def create_indexes(tables):
+    """Create the tables' secondary indexes that are missing, e.g. after a
+    load that was interrupted before it could rebuild them."""
+    with db.engine.begin() as connection:
+        indexes, present = _deferrable(tables, connection)
+        names = {index.name for index in present}
+        missing = [index for index in indexes if index.name not in names]
+        for index in missing:
+            index.create(connection)
+    logger.info('Built %d indexes', len(missing))
+    return missing
+
+
+class Checkpoint:
+    """How far a load of one source got, kept in a small JSON file."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.position = 0
+        self.counts = {}
+        if path and os.path.exists(path):
+            with open(path) as fh:
+                state = json.load(fh)
+            if state.get('source') == source:
+                self.position = state['position']
+                self.counts = state.get('counts', {})
+            else:
+                logger.warning('Checkpoint %s belongs to another source; starting over', path)
+
+    def save(self, position, counts):
+        self.position = position
+        self.counts = dict(counts)
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({'source': self.source, 'position': position, 'counts': self.counts,
+                       'saved_at': datetime.utcnow().isoformat()}, fh)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def source_signature(path):
+    """Identifies a source file, so a checkpoint is only reused for it."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+_worker_targets = {}
+
+
+def _init_worker(settings):
+    # Workers have no app context; hash with the app's configured cost
+    security.DEFAULTS.update(settings)
+
+
+def _compute(kind, rows):
+    if kind not in _worker_targets:
+        _worker_targets[kind] = TARGETS[kind]()
+    return _worker_targets[kind].compute(rows)
+
+
+class BulkLoader:
+    """Loads records into ``users`` or ``articles`` in large batches."""
+
+    def __init__(self, kind, batch_size=5000, workers=None, defer_indexes=True, mapping=None,
+                 progress=None):
+        if kind not in TARGETS:
+            raise ValueError('Unknown table %r; use one of %s' % (kind, ', '.join(TARGETS)))
+        self.kind = kind
+        self.target = TARGETS[kind](mapping)
+        self.batch_size = batch_size
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.defer_indexes = defer_indexes
+        self.progress = progress
+
+    @property
+    def tables(self):
+        return (self.target.table,) + self.target.derived_tables
+
+    def _new_rows(self, connection, rows):
+        """``rows`` without those already stored or repeated in the batch."""
+        existing = self.target.existing(connection, rows)
+        new = {}
+        for row in rows:
+            key = self.target.key(row)
+            if key not in existing and key not in new:
+                new[key] = row
+        return list(new.values())
+
+    def _batches(self, records, skip):
+        """``(position, rows, counts)`` per batch of records after ``skip``.
+
+        Rows already stored are dropped here, before any hashing is spent
+        on them, so re-running a finished load is cheap.
+        """
+        batch = []
+        invalid = 0
+        position = skip
+        for position, record in enumerate(records, 1):
+            if position <= skip:
+                continue
+            row = self.target.prepare(record)
+            if row is None:
+                invalid += 1
+            else:
+                batch.append(row)
+            if len(batch) + invalid >= self.batch_size:
+                yield self._batch(position, batch, invalid)
+                batch, invalid = [], 0
+        if batch or invalid:
+            yield self._batch(position, batch, invalid)
+
+    def _batch(self, position, rows, invalid):
+        with db.engine.connect() as connection:
+            new = self._new_rows(connection, rows) if rows else []
+        return position, new, {'invalid': invalid, 'skipped': len(rows) - len(new)}
+
+    def _computed(self, batches):
+        """The batches with their rows computed in the pool, one batch ahead
+        of the writer."""
+        if self.workers <= 1:
+            for position, rows, counts in batches:
+                yield position, self.target.compute(rows), counts
+            return
+        settings = {name: current_app.config.get(name, default) for name, default in security.DEFAULTS.items()}
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(settings,)) as executor:
+            pending = deque()
+            for position, rows, counts in batches:
+                size = max(1, -(-len(rows) // self.workers))
+                futures = [executor.submit(_compute, self.kind, rows[start:start + size])
+                           for start in range(0, len(rows), size)]
+                pending.append((position, futures, counts))
+                if len(pending) > 1:
+                    position, futures, counts = pending.popleft()
+                    yield position, [row for future in futures for row in future.result()], counts
+            while pending:
+                position, futures, counts = pending.popleft()
+                yield position, [row for future in futures for row in future.result()], counts
+
+    def _write(self, rows):
+        """Insert the new rows of a batch in one transaction; returns how many."""
+        with db.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                # Losing the last batches in a crash is fine: the checkpoint
+                # is only written after the commit returns
+                connection.execute(text('SET LOCAL synchronous_commit TO OFF'))
+            # Checked again: an earlier batch may have held the same keys
+            rows = self._new_rows(connection, rows)
+            if rows:
+                self.target.allocate(connection, rows)
+                self.target.insert(connection, rows)
+                self.target.after_insert(connection, rows)
+        return len(rows)
+
+    def _finish(self):
+        with db.engine.begin() as connection:
+            if connection.dialect.name != 'postgresql':
+                return
+            for name in (t.name for t in self.tables):
+                connection.execute(text('ANALYZE %s' % name))
+
+    def load(self, records, checkpoint=None):
+        """Load ``records``; returns counts and throughput."""
+        checkpoint = checkpoint or Checkpoint(None, None)
+        counts = {'read': 0, 'inserted': 0, 'skipped': 0, 'invalid': 0}
+        counts.update(checkpoint.counts)
+        resumed_from = checkpoint.position
+        if resumed_from:
+            logger.info('Resuming after record %d', resumed_from)
+
+        started = time.perf_counter()
+        loaded = 0
+        if self.defer_indexes:
+            drop_indexes(self.tables)
+        try:
+            batches = self._computed(self._batches(records, resumed_from))
+            for position, rows, batch_counts in batches:
+                inserted = self._write(rows)
+                read = position - checkpoint.position
+                counts['read'] += read
+                counts['inserted'] += inserted
+                counts['invalid'] += batch_counts['invalid']
+                counts['skipped'] += batch_counts['skipped'] + len(rows) - inserted
+                checkpoint.save(position, counts)
+                loaded += read
+                rate = loaded / max(time.perf_counter() - started, 1e-9)
+                logger.info('%d records, %d inserted, %.0f rows/s', position, counts['inserted'], rate)
+                if self.progress:
+                    self.progress(position, counts, rate)
+        finally:
+            if self.defer_indexes:
+                start = time.perf_counter()
+                create_indexes(self.tables)
+                logger.info('Rebuilt indexes in %.1f s', time.perf_counter() - start)
+        self._finish()
+
+        seconds = time.perf_counter() - started
+        return {
+            'counts': counts,
+            'resumed_from': resumed_from,
+            'seconds': round(seconds, 2),
+            'rows_per_second': round(loaded / seconds, 1) if seconds else None,
+        }
+
+
+def load_records(kind, records, **options):
+    """Load an iterable of dicts with the default settings; returns the report."""
+    checkpoint = options.pop('checkpoint', None)
+    return BulkLoader(kind, **options).load(records, checkpoint=checkpoint)
+
+
+def admin_record(config):
+    """The initial admin account, from ``ADMIN_EMAIL`` and ``ADMIN_PASSWORD``."""
+    return {'email': config['ADMIN_EMAIL'], 'username': 'admin', 'first_name': 'Admin',
+            'last_name': 'User', 'is_admin': True, 'password': config['ADMIN_PASSWORD']}
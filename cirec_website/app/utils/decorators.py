@@ -0,0 +1,40 @@
+from functools import wraps
+
+from flask import flash, g, jsonify, redirect, url_for
+from werkzeug.exceptions import HTTPException
+
+
+def read_only(f):
+    """Run the view's queries against the read replica, if one is configured."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        previous = g.get('use_replica', False)
+        g.use_replica = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.use_replica = previous
+    return decorated_function
+
+
+def subscription_required(f):
+    """Send users without an active subscription to the subscription page."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from app.services.payment.subscription_manager import has_access
+        if not has_access():
+            flash('An active subscription is required to read full articles.', 'info')
+            return redirect(url_for('user.subscription'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def json_errors(f):
+    """Answer ``abort()`` and other HTTP errors from the view as JSON."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except HTTPException as exc:
+            return jsonify({'error': exc.description, 'status': exc.code}), exc.code
+    return decorated_function
@@ -0,0 +1,28 @@
+import hashlib
+import os
+
+from werkzeug.utils import secure_filename
+
+ALLOWED_EXTENSIONS = {'pdf'}
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def file_sha256(path, block_size=HASH_BLOCK_SIZE):
+    """Hex SHA-256 of a file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_upload(file_storage, folder):
+    """Save an uploaded file under ``folder`` and return its path."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, secure_filename(file_storage.filename))
+    file_storage.save(path)
+    return path
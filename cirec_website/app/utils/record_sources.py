@@ -0,0 +1,238 @@
+"""Streaming readers for legacy data exports.
+
+Each reader yields one dict per record without loading the file:
+
+* CSV with a header row;
+* JSON, either an array of objects or one object per line (JSON Lines),
+  decoded incrementally;
+* SQL dumps: the rows of one table from ``INSERT ... VALUES`` statements
+  (MySQL or PostgreSQL quoting) or from pg_dump ``COPY ... FROM stdin``
+  blocks.
+
+``.gz`` files are decompressed on the fly.
+"""
+import csv
+import gzip
+import itertools
+import json
+import os
+import re
+
+READ_SIZE = 1024 * 1024
+
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+COPY_ESCAPE_RE = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))')
+MYSQL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+MYSQL_ESCAPE_RE = re.compile(r'\\(.)', re.S)
+
+NAME = r'[`"]?(?:\w+[`"]?\.[`"]?)?(\w+)[`"]?'
+INSERT_RE = re.compile(r'INSERT\s+(?:IGNORE\s+)?INTO\s+' + NAME + r'\s*(?:\(([^)]*)\))?\s*VALUES\s*', re.I)
+CREATE_RE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?' + NAME + r'\s*\(', re.I)
+COPY_RE = re.compile(r'COPY\s+' + NAME + r'\s*\(([^)]*)\)\s+FROM\s+stdin', re.I)
+COLUMN_RE = re.compile(r'\s*[`"]?(\w+)[`"]?\s')
+NOT_COLUMNS = {'primary', 'key', 'unique', 'constraint', 'index', 'foreign', 'check', 'fulltext'}
+# Backslash escapes a quote only in MySQL strings
+MYSQL_SCAN_RE = re.compile(r"\\.|'|;")
+SQL_SCAN_RE = re.compile(r"'|;")
+MYSQL_HEADERS = ('mysql', 'mariadb', 'phpmyadmin')
+VALUES_PATTERN = r"""
+    '(%s)'                                    # quoted string
+  | (NULL)\b
+  | (TRUE|FALSE)\b
+  | ([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | ([(),;])
+  | (\s+)
+"""
+MYSQL_VALUE_RE = re.compile(VALUES_PATTERN % r"(?:[^'\\]|\\.|'')*", re.I | re.S | re.X)
+SQL_VALUE_RE = re.compile(VALUES_PATTERN % r"(?:[^']|'')*", re.I | re.S | re.X)
+
+
+def source_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower().lstrip('.')
+    return {'jsonl': 'json', 'ndjson': 'json'}.get(extension, extension)
+
+
+def open_source(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_records(path, fmt=None, table=None):
+    """Records of ``path`` as dicts; ``table`` picks the table of a SQL dump."""
+    fmt = fmt or source_format(path)
+    readers = {'csv': read_csv, 'json': read_json, 'sql': lambda fh: read_sql(fh, table)}
+    if fmt not in readers:
+        raise ValueError('Unsupported format %r; use csv, json or sql' % fmt)
+    if fmt == 'sql' and not table:
+        raise ValueError('Reading a SQL dump needs the name of the table to load')
+    with open_source(path) as fh:
+        yield from readers[fmt](fh)
+
+
+def read_csv(fh):
+    yield from csv.DictReader(fh)
+
+
+def read_json(fh):
+    """Objects of a JSON array, or of JSON Lines, decoded as the file is read."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    while True:
+        # Skip the array brackets, separators and whitespace between objects
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,[]':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                return
+            buffer, pos = fh.read(READ_SIZE), 0
+            eof = not buffer
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            if eof:
+                raise
+            chunk = fh.read(READ_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        if not isinstance(record, dict):
+            raise ValueError('Expected JSON objects, found %s' % type(record).__name__)
+        yield record
+        pos = end
+
+
+def copy_unescape(field):
+    """A value of PostgreSQL's COPY text format; ``\\N`` is NULL."""
+    if field == '\\N':
+        return None
+    if '\\' not in field:
+        return field
+
+    def replace(match):
+        octal, hexa, char = match.groups()
+        if octal:
+            return chr(int(octal, 8))
+        if hexa:
+            return chr(int(hexa, 16))
+        return COPY_ESCAPES.get(char, char)
+    return COPY_ESCAPE_RE.sub(replace, field)
+
+
+def _statements(lines, mysql):
+    """SQL statements of a dump, and the data lines of its COPY blocks.
+
+    Yields ``('sql', text)`` and ``('copy', line)``; a statement may span
+    lines when its strings contain newlines.
+    """
+    scan = MYSQL_SCAN_RE if mysql else SQL_SCAN_RE
+    parts = []
+    quoted = False
+    copying = False
+    for line in lines:
+        if copying:
+            line = line.rstrip('\r\n')
+            if line == '\\.':
+                copying = False
+            else:
+                yield 'copy', line
+            continue
+        if not parts and (not line.strip() or line.lstrip().startswith('--')):
+            continue
+        start = 0
+        for match in scan.finditer(line):
+            token = match.group(0)
+            if token == "'":
+                quoted = not quoted  # '' toggles twice
+            elif token == ';' and not quoted:
+                parts.append(line[start:match.end()])
+                statement = ''.join(parts)
+                parts = []
+                start = match.end()
+                yield 'sql', statement
+                if COPY_RE.match(statement.lstrip()):
+                    copying = True
+                    break
+        rest = line[start:]
+        if rest.strip() and not copying:
+            parts.append(rest)
+
+
+def _unquote(text, mysql):
+    text = text.replace("''", "'")
+    if mysql and '\\' in text:
+        text = MYSQL_ESCAPE_RE.sub(lambda m: MYSQL_ESCAPES.get(m.group(1), m.group(1)), text)
+    return text
+
+
+def _value_rows(values, mysql):
+    """Tuples of the ``(...), (...)`` list of an INSERT statement."""
+    row = None
+    for match in (MYSQL_VALUE_RE if mysql else SQL_VALUE_RE).finditer(values):
+        string, null, boolean, number, punct, _ = match.groups()
+        if punct == '(':
+            row = []
+        elif punct == ')':
+            yield row
+            row = None
+        elif row is None:
+            continue
+        elif string is not None:
+            row.append(_unquote(string, mysql))
+        elif null:
+            row.append(None)
+        elif boolean:
+            row.append(boolean.lower() == 'true')
+        elif number is not None:
+            row.append(number)
+
+
+def _create_columns(statement):
+    body = statement[statement.index('(') + 1:]
+    columns = []
+    depth = 0
+    for line in body.split('\n'):
+        match = COLUMN_RE.match(line)
+        if depth == 0 and match and match.group(1).lower() not in NOT_COLUMNS:
+            columns.append(match.group(1))
+        depth += line.count('(') - line.count(')')
+    return columns
+
+
+def _column_list(text):
+    return [name.strip().strip('`"') for name in text.split(',')]
+
+
+def read_sql(fh, table):
+    """Rows of ``table`` from a MySQL or PostgreSQL dump."""
+    first = fh.readline()
+    mysql = any(name in first.lower() for name in MYSQL_HEADERS)
+    columns = None
+    copy_columns = None
+    for kind, text in _statements(itertools.chain([first], fh), mysql):
+        if kind == 'copy':
+            if copy_columns is not None:
+                yield dict(zip(copy_columns, map(copy_unescape, text.split('\t'))))
+            continue
+        statement = text.lstrip()
+        match = COPY_RE.match(statement)
+        if match:
+            copy_columns = _column_list(match.group(2)) if match.group(1) == table else None
+            continue
+        match = CREATE_RE.match(statement)
+        if match:
+            if match.group(1) == table:
+                columns = _create_columns(statement)
+            continue
+        match = INSERT_RE.match(statement)
+        if not match or match.group(1) != table:
+            continue
+        names = _column_list(match.group(2)) if match.group(2) else columns
+        if not names:
+            raise ValueError('INSERT into %s has no column list and no CREATE TABLE was seen' % table)
+        for row in _value_rows(statement[match.end():], mysql):
+            yield dict(zip(names, row))
@@ -0,0 +1,63 @@
+import base64
+import hashlib
+import hmac
+
+import bcrypt
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+BCRYPT_PREFIX = 'bcrypt-sha256$'
+
+DEFAULTS = {
+    'PASSWORD_HASH_METHOD': 'bcrypt',  # bcrypt, pbkdf2 or scrypt
+    'PASSWORD_BCRYPT_ROUNDS': 12,
+    'PASSWORD_PBKDF2_ITERATIONS': 600000,
+    'PASSWORD_SCRYPT_N': 32768,
+}
+
+
+def _setting(name):
+    if has_app_context():
+        return current_app.config.get(name, DEFAULTS[name])
+    return DEFAULTS[name]
+
+
+def _bcrypt_input(password):
+    # bcrypt only reads 72 bytes; hash first so long passphrases count in full
+    return base64.b64encode(hashlib.sha256(password.encode('utf-8')).digest())
+
+
+def hash_password(password):
+    """Hash ``password`` with the configured method and cost."""
+    method = _setting('PASSWORD_HASH_METHOD')
+    if method == 'bcrypt':
+        salt = bcrypt.gensalt(rounds=_setting('PASSWORD_BCRYPT_ROUNDS'))
+        return BCRYPT_PREFIX + bcrypt.hashpw(_bcrypt_input(password), salt).decode('ascii')
+    if method == 'scrypt':
+        return generate_password_hash(password, method='scrypt:%d:8:1' % _setting('PASSWORD_SCRYPT_N'))
+    return generate_password_hash(password, method='pbkdf2:sha256:%d' % _setting('PASSWORD_PBKDF2_ITERATIONS'))
+
+
+def verify_password(stored, password):
+    if not stored or password is None:
+        return False
+    if stored.startswith(BCRYPT_PREFIX):
+        digest = stored[len(BCRYPT_PREFIX):].encode('ascii')
+        return hmac.compare_digest(bcrypt.hashpw(_bcrypt_input(password), digest), digest)
+    return check_password_hash(stored, password)
+
+
+def needs_rehash(stored):
+    """True when ``stored`` was made with another method or cost than configured."""
+    method = _setting('PASSWORD_HASH_METHOD')
+    if not stored:
+        return True
+    if stored.startswith(BCRYPT_PREFIX):
+        rounds = int(stored[len(BCRYPT_PREFIX):].split('$')[2])
+        return method != 'bcrypt' or rounds != _setting('PASSWORD_BCRYPT_ROUNDS')
+    params = stored.split('$', 1)[0].split(':')
+    if method == 'scrypt':
+        return params[0] != 'scrypt' or params[1:2] != [str(_setting('PASSWORD_SCRYPT_N'))]
+    if method == 'pbkdf2':
+        return params[0] != 'pbkdf2' or params[2:3] != [str(_setting('PASSWORD_PBKDF2_ITERATIONS'))]
+    return True
@@ -0,0 +1,75 @@
+"""Import time and memory of application startup, measured in a fresh interpreter."""
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs under ``python -X importtime``; prints RSS checkpoints as JSON
+PROBE = '''
+import json, sys
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+report = {'interpreter': rss_mb()}
+from app import create_app, preload
+report['imported'] = rss_mb()
+app = create_app()
+report['create_app'] = rss_mb()
+if %(preload)r:
+    preload(app)
+    report['preload'] = rss_mb()
+report['modules'] = len(sys.modules)
+print(json.dumps(report))
+'''
+
+
+def parse_importtime(stderr):
+    """``{module: (self_us, cumulative_us, depth)}`` from ``-X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        head, cumulative, name = line.split('|')
+        self_us = head.split(':')[1]
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative), depth)
+    return modules
+
+
+def measure(preload=False, top=15):
+    """Start the app in a subprocess and report import times and RSS."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE % {'preload': preload}],
+        cwd=PROJECT_ROOT, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=PROJECT_ROOT),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    memory = json.loads(result.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(result.stderr)
+
+    # Charge every module's own time to its top-level package
+    packages = defaultdict(int)
+    for name, (self_us, _, _) in modules.items():
+        packages[name.split('.')[0]] += self_us
+    total_us = sum(cumulative for self_us, cumulative, depth in modules.values() if depth == 0)
+    return {
+        'import_ms': round(total_us / 1000, 1),
+        'modules': memory.pop('modules'),
+        'rss_mb': {stage: round(mb, 1) for stage, mb in memory.items()},
+        'packages_ms': [(name, round(us / 1000, 1))
+                        for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]],
+    }
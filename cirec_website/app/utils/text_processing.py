@@ -0,0 +1,40 @@
+import re
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been
+before being below between both but by can could did do does doing down during each
+few for from further had has have having he her here hers him his how i if in into is
+it its itself just me more most my no nor not now of off on once only or other our
+ours out over own per same she should so some such than that the their theirs them
+then there these they this those through to too under until up very was we were what
+when where which while who whom why will with would you your yours
+""".split())
+
+
+def tokenize(text, keep_stopwords=False):
+    """Split text into lower-cased word tokens."""
+    if not text:
+        return []
+    tokens = TOKEN_RE.findall(text.lower())
+    if keep_stopwords:
+        return tokens
+    return [t for t in tokens if t not in STOPWORDS]
+
+
+def chunk_spans(text, size=200, overlap=50):
+    """Character spans of overlapping windows of ``size`` words."""
+    if not text:
+        return []
+    words = [m.span() for m in re.finditer(r'\S+', text)]
+    if not words:
+        return []
+    step = max(size - overlap, 1)
+    spans = []
+    for start in range(0, len(words), step):
+        window = words[start:start + size]
+        spans.append((window[0][0], window[-1][1]))
+        if start + size >= len(words):
+            break
+    return spans
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('admin', __name__)
 
-from app.views.admin import routes, content
\ No newline at end of file
+from app.views.admin import routes, content, analytics, metrics
\ No newline at end of file
@@ -0,0 +1,19 @@
+from flask import render_template
+from flask_login import login_required
+from app.views.admin import bp
+from app.views.admin.routes import admin_required
+from app.services.analytics import stats_service
+from app.services.content import view_counter
+
+@bp.route('/analytics')
+@login_required
+@admin_required
+def analytics():
+    daily = stats_service.views_per_day(days=30)
+    top_articles = view_counter.top_articles(days=7, limit=10)
+    return render_template('admin/analytics/stats.html',
+                         daily_views=daily,
+                         total_views=sum(views for _, views in daily),
+                         registrations=stats_service.registrations_per_day(days=30),
+                         stats=stats_service.dashboard_stats(),
+                         top_articles=top_articles)
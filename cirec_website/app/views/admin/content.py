@@ -1,15 +1,67 @@
-from flask import render_template, request, flash, redirect, url_for
+from flask import render_template, request, flash, redirect, url_for, jsonify
 from flask_login import login_required
 from app.views.admin import bp
-from app.models.article import Article
-from app.extensions import db
+from app.views.admin.routes import admin_required
+from app.services.content import uploads
+from app.utils.decorators import json_errors
+from app.utils.file_handlers import allowed_file
 
 @bp.route('/content/upload', methods=['GET', 'POST'])
 @login_required
+@admin_required
 def upload():
     if request.method == 'POST':
-        # Handle file upload logic here
-        flash('Article uploaded successfully!', 'success')
+        file = request.files.get('file')
+        if not file or not file.filename or not allowed_file(file.filename):
+            flash('Please choose a PDF file to upload', 'error')
+            return redirect(url_for('admin.upload'))
+        
+        result = uploads.save_file(file)
+        if result['status'] == 'duplicate':
+            flash('This file has already been uploaded as %s.' % result['duplicate_of'], 'info')
+        else:
+            flash('Upload received. Articles will appear once the issue has been processed.', 'success')
         return redirect(url_for('admin.dashboard'))
     
-    return render_template('admin/content/upload.html')
\ No newline at end of file
+    return render_template('admin/content/upload.html')
+
+
+# Chunked uploads for files larger than one request allows, used by the
+# upload page's script; see app/services/content/uploads.py for the protocol
+
+@bp.route('/content/uploads', methods=['POST'])
+@login_required
+@admin_required
+@json_errors
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    result = uploads.create_upload(data.get('filename'), data.get('size'), data.get('sha256'))
+    return jsonify(result), 201 if result['status'] == 'open' else 200
+
+
+@bp.route('/content/uploads/<upload_id>', methods=['GET', 'DELETE'])
+@login_required
+@admin_required
+@json_errors
+def upload_status(upload_id):
+    if request.method == 'DELETE':
+        uploads.abort_upload(upload_id)
+        return '', 204
+    return jsonify(uploads.upload_state(upload_id))
+
+
+@bp.route('/content/uploads/<upload_id>/parts/<int:index>', methods=['PUT'])
+@login_required
+@admin_required
+@json_errors
+def upload_part(upload_id, index):
+    # Read from the stream so the part goes to disk without being buffered
+    return jsonify(uploads.write_part(upload_id, index, request.stream, request.headers.get('X-Part-SHA256')))
+
+
+@bp.route('/content/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+@admin_required
+@json_errors
+def complete_upload(upload_id):
+    return jsonify(uploads.complete_upload(upload_id))
@@ -0,0 +1,47 @@
+import hmac
+
+from flask import Response, abort, current_app, request
+from flask_login import current_user
+from app.views.admin import bp
+from app.services.monitoring import instrumentation
+
+
+def _authorised():
+    """Admins, or a scraper presenting METRICS_TOKEN as a bearer token."""
+    token = current_app.config.get('METRICS_TOKEN')
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer ') and hmac.compare_digest(header[7:], token):
+        return True
+    return current_user.is_authenticated and current_user.is_admin
+
+
+def _text(body):
+    return Response(body, mimetype='text/plain')
+
+
+@bp.route('/metrics')
+def metrics():
+    if not _authorised():
+        abort(403)
+    return Response(instrumentation.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/metrics/profiles')
+def profiles():
+    if not _authorised():
+        abort(403)
+    lines = ['%s  %s  %7.1f ms  %s  %s' % (p['id'], p['at'].isoformat(timespec='seconds'), p['seconds'] * 1000,
+                                           p['endpoint'], p['path'])
+             for p in instrumentation.recent_profiles()]
+    return _text('\n'.join(lines) + '\n' if lines else 'No profiled requests yet.\n')
+
+
+@bp.route('/metrics/profiles/<profile_id>')
+def profile(profile_id):
+    if not _authorised():
+        abort(403)
+    found = instrumentation.get_profile(profile_id)
+    if found is None:
+        abort(404)
+    return _text('%s %s (%.1f ms)\n\n%s' % (found['endpoint'], found['path'], found['seconds'] * 1000,
+                                            found['report']))
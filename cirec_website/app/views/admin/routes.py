@@ -1,9 +1,7 @@
 from flask import render_template, redirect, url_for, flash
 from flask_login import login_required, current_user
 from app.views.admin import bp
-from app.models.user import User
-from app.models.article import Article
-from app.extensions import db
+from app.services.analytics import stats_service
 
 def admin_required(f):
     def decorated_function(*args, **kwargs):
@@ -18,16 +16,13 @@ def admin_required(f):
 @login_required
 @admin_required
 def dashboard():
-    total_users = User.query.count()
-    total_articles = Article.query.count()
-    active_subscriptions = User.query.filter_by(subscription_status='active').count()
-    recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
+    stats = stats_service.dashboard_stats()
     
     return render_template('admin/dashboard/index.html', 
-                         total_users=total_users, 
-                         total_articles=total_articles,
-                         active_subscriptions=active_subscriptions,
-                         recent_users=recent_users)
+                         total_users=stats['total_users'], 
+                         total_articles=stats['total_articles'],
+                         active_subscriptions=stats['active_subscriptions'],
+                         recent_users=stats_service.recent_users(5))
 
 @bp.route('/users')
 @login_required
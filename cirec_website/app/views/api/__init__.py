@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('api', __name__)
 
-from app.views.api import search
\ No newline at end of file
+from app.views.api import search, articles
\ No newline at end of file
@@ -0,0 +1,23 @@
+from flask import jsonify, request
+from app.views.api import bp
+from app.services.content.article_service import list_articles
+from app.utils.decorators import read_only
+
+@bp.route('/articles', methods=['GET'])
+@read_only
+def articles():
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    page, next_cursor = list_articles(request.args.get('cursor'), limit=per_page)
+    
+    return jsonify({
+        'articles': [
+            {
+                'id': article.id,
+                'title': article.title,
+                'author': article.author,
+                'created_at': article.created_at.isoformat() if article.created_at else None,
+                'view_count': article.view_count
+            } for article in page
+        ],
+        'next_cursor': next_cursor
+    })
@@ -1,25 +1,37 @@
-from flask import jsonify, request
+from flask import jsonify, request, current_app
 from app.views.api import bp
-from app.models.article import Article
+from app.services.content.article_service import RESULT_COLUMNS, get_articles_by_ids, snippets
+from app.services.search import search_manager
+from app.services.search.search_manager import filters_from_args, mode_from_args
+from app.utils.decorators import read_only
 
 @bp.route('/search', methods=['GET'])
+@read_only
 def search():
     query = request.args.get('q', '')
+    mode = mode_from_args(request.args, current_app.config.get('SEARCH_DEFAULT_MODE', 'hybrid'))
     if not query:
         return jsonify({'results': []})
     
-    # Simple keyword search for now
-    results = Article.query.filter(
-        Article.title.contains(query) | 
-        Article.content.contains(query)
-    ).limit(20).all()
+    filters = filters_from_args(request.args)
+    hits = search_manager.search(query, filters=filters, mode=mode, limit=20)
+    results = get_articles_by_ids((doc_id for doc_id, _, _ in hits), columns=RESULT_COLUMNS)
+    excerpts = snippets([article.id for article in results], query,
+                        passages={doc_id: passages for doc_id, _, passages in hits})
+    
+    facets = search_manager.facet_counts(query, filters=filters, hits=hits)
     
     return jsonify({
+        'mode': mode,
+        'facets': {kind: [{'value': value, 'label': label, 'count': count} for value, label, count in values]
+                   for kind, values in facets.items()},
         'results': [
             {
                 'id': article.id,
                 'title': article.title,
-                'summary': article.summary or article.content[:100] + '...' if article.content else '',
+                'summary': article.summary or article.auto_summary or article.preview or '',
+                'snippet': str(excerpts[article.id]) if article.id in excerpts else None,
+                'word_count': article.word_count,
                 'author': article.author
             } for article in results
         ]
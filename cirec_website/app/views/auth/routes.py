@@ -3,6 +3,9 @@ from flask_login import login_user, logout_user, login_required, current_user
 from app.views.auth import bp
 from app.models.user import User
 from app.extensions import db
+from app.services.auth import auth_service
+from app.services.auth.password_reset import generate_reset_token, verify_reset_token
+from app.services.email import email_service
 from datetime import datetime
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -10,11 +13,14 @@ def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
-        user = User.query.filter_by(email=email).first()
+        user, error = auth_service.authenticate(email, password, request.remote_addr)
         
-        if user and user.check_password(password):
+        if error == 'throttled':
+            flash('Too many login attempts. Please wait a minute and try again.', 'error')
+            return render_template('auth/login.html'), 429
+        if user:
             login_user(user)
-            # Update last login
+            # Update last login (and the password hash, if it was upgraded)
             user.last_login = datetime.utcnow()
             db.session.commit()
             
@@ -70,6 +76,8 @@ def register():
             company=company,
             telephone=telephone,
             account_type=account_type,
+            monthly_news=monthly_news or None,
+            newsletter=bool(request.form.get('newsletter')),
             subscription_status='pending'  # Will be activated after payment
         )
         user.set_password(password)
@@ -77,6 +85,7 @@ def register():
         try:
             db.session.add(user)
             db.session.commit()
+            email_service.send_welcome_email(user)
             flash('Registration successful! Please check your email for account activation.', 'success')
             return redirect(url_for('auth.login'))
         except Exception as e:
@@ -92,8 +101,7 @@ def forgot_password():
         email = request.form.get('email')
         user = User.query.filter_by(email=email).first()
         if user:
-            # TODO: Implement password reset email logic
-            # For now, just show success message
+            email_service.send_password_reset_email(user, generate_reset_token(user))
             flash('Password reset instructions have been sent to your email address. Please check your inbox and follow the instructions to reset your password.', 'success')
         else:
             flash('If an account with this email exists, you will receive password reset instructions.', 'info')
@@ -102,7 +110,11 @@ def forgot_password():
 
 @bp.route('/reset-password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
-    # TODO: Implement token verification and password reset
+    user = verify_reset_token(token)
+    if user is None:
+        flash('This password reset link is invalid or has expired.', 'error')
+        return redirect(url_for('auth.forgot_password'))
+    
     if request.method == 'POST':
         new_password = request.form.get('password')
         confirm_password = request.form.get('confirm_password')
@@ -111,7 +123,8 @@ def reset_password(token):
             flash('Passwords do not match', 'error')
             return render_template('auth/reset_password.html', token=token)
         
-        # TODO: Update user password with token verification
+        user.set_password(new_password)
+        db.session.commit()
         flash('Your password has been reset successfully', 'success')
         return redirect(url_for('auth.login'))
     
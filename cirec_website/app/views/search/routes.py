@@ -1,75 +1,49 @@
-from flask import render_template, request, redirect, url_for, jsonify, abort
+from flask import render_template, request, redirect, url_for, jsonify, abort, current_app
 from flask_login import login_required, current_user
+from sqlalchemy.orm import load_only
 from app.views.search import bp
 from app.models.article import Article
-from app.extensions import db
-from sqlalchemy import or_, and_
-from datetime import datetime, timedelta
+from app.services.content import page_cache
+from app.services.content.article_service import RESULT_COLUMNS, get_articles_by_ids, snippets
+from app.services.search import autocomplete, search_manager
+from app.services.search.search_manager import filters_from_args, mode_from_args
+from app.utils.decorators import read_only
 
 @bp.route('/')
+@read_only
 def search():
     query = request.args.get('q', '')
+    mode = mode_from_args(request.args, current_app.config.get('SEARCH_DEFAULT_MODE', 'hybrid'))
     results = []
+    excerpts = {}
+    filters = filters_from_args(request.args)
+    hits = []
     
     if query:
-        # Get filter parameters
-        date_range = request.args.get('date_range')
-        category = request.args.get('category')
-        company = request.args.get('company')
-        product = request.args.get('product')
-        region = request.args.get('region')
-        doc_type = request.args.get('doc_type')
-        
-        # Build base query
-        search_query = Article.query.filter_by(is_published=True)
-        
-        # Apply text search
-        if query:
-            search_conditions = or_(
-                Article.title.contains(query),
-                Article.content.contains(query),
-                Article.summary.contains(query)
-            )
-            search_query = search_query.filter(search_conditions)
-        
-        # Apply filters
-        if date_range:
-            date_filters = {
-                '1_month': datetime.utcnow() - timedelta(days=30),
-                '3_months': datetime.utcnow() - timedelta(days=90),
-                '6_months': datetime.utcnow() - timedelta(days=180),
-                '1_year': datetime.utcnow() - timedelta(days=365)
-            }
-            if date_range in date_filters:
-                search_query = search_query.filter(
-                    Article.created_at >= date_filters[date_range]
-                )
-        
-        if company:
-            search_query = search_query.filter(
-                or_(
-                    Article.title.contains(company),
-                    Article.content.contains(company)
-                )
-            )
-        
-        if product:
-            search_query = search_query.filter(
-                or_(
-                    Article.title.contains(product),
-                    Article.content.contains(product)
-                )
-            )
-        
-        # Execute search
-        results = search_query.order_by(Article.created_at.desc()).limit(50).all()
+        hits = search_manager.search(query, filters=filters, mode=mode, limit=50)
+        results = get_articles_by_ids((doc_id for doc_id, _, _ in hits), columns=RESULT_COLUMNS)
+        if results:
+            excerpts = snippets([article.id for article in results], query,
+                               passages={doc_id: passages for doc_id, _, passages in hits})
+            autocomplete.record_query(query)
     
-    return render_template('search/search.html', query=query, results=results)
+    facets = search_manager.facet_counts(query, filters=filters, hits=hits)
+    return render_template('search/search.html', query=query, mode=mode, results=results,
+                           snippets=excerpts, facets=facets)
 
 @bp.route('/preview/<int:id>')
+@read_only
+@page_cache.cached_page(article_arg='id')
 def preview_article(id):
     """Show article preview - available to all users"""
-    article = Article.query.get_or_404(id)
+    article = (Article.query.options(load_only(*RESULT_COLUMNS, Article.updated_at))
+               .filter_by(id=id).first_or_404())
+    etag = page_cache.make_etag('preview', id, article.updated_at, page_cache.user_variant())
+    if page_cache.revalidating():
+        unchanged = page_cache.not_modified(etag, article.updated_at,
+                                            private=current_user.is_authenticated)
+        if unchanged is not None:
+            return unchanged
     
     # Create preview version with limited content
     preview_data = {
@@ -77,48 +51,22 @@ def preview_article(id):
         'title': article.title,
         'author': article.author,
         'created_at': article.created_at,
-        'summary': article.summary[:200] + '...' if article.summary else None,
-        'content': article.content[:300] + '...' if article.content else None,
+        'summary': article.summary or article.auto_summary,
+        'content': article.preview,
         'is_preview': True
     }
     
-    return render_template('search/article_preview.html', article=preview_data)
+    response = current_app.make_response(render_template('search/article_preview.html', article=preview_data))
+    return page_cache.set_validators(response, etag, article.updated_at,
+                                     private=current_user.is_authenticated)
 
 @bp.route('/suggestions')
+@read_only
 def search_suggestions():
     """API endpoint for search suggestions"""
-    query = request.args.get('q', '').lower()
+    query = request.args.get('q', '')
     
-    if len(query) < 2:
+    if len(query.strip()) < 2:
         return jsonify([])
     
-    # Get suggestions from article titles
-    suggestions = Article.query.filter(
-        Article.title.ilike(f'%{query}%')
-    ).limit(10).all()
-    
-    results = []
-    for article in suggestions:
-        # Extract relevant parts of the title
-        title = article.title.lower()
-        if query in title:
-            results.append(article.title)
-    
-    # Add some predefined suggestions
-    predefined = [
-        'Russian petrochemical industry',
-        'Gazprom chemical production',
-        'Sibur polymer market',
-        'LUKOIL refinery capacity',
-        'Russian fertilizer exports',
-        'Chemical industry Moscow',
-        'Ethylene production Russia',
-        'Polymer market analysis'
-    ]
-    
-    # Filter predefined suggestions
-    for suggestion in predefined:
-        if query in suggestion.lower() and suggestion not in results:
-            results.append(suggestion)
-    
-    return jsonify(results[:8])  # Return max 8 suggestions
\ No newline at end of file
+    return jsonify(autocomplete.complete(query, limit=8))  # Return max 8 suggestions
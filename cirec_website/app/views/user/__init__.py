@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('user', __name__)
 
-from app.views.user import routes
\ No newline at end of file
+from app.views.user import issues, routes
\ No newline at end of file
@@ -0,0 +1,58 @@
+from flask import abort, jsonify, redirect, request, url_for
+from flask_login import login_required
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.content import issue_files
+from app.utils.decorators import read_only, subscription_required
+from app.views.user import bp
+
+
+@bp.route('/issues/<int:issue_id>')
+@login_required
+@subscription_required
+@read_only
+def download_issue(issue_id):
+    """The original issue PDF; ``?inline=1`` opens it in the browser."""
+    issue = issue_files.get_issue(issue_id)
+    return issue_files.send_issue(issue, as_attachment=not request.args.get('inline'))
+
+
+@bp.route('/issues/<int:issue_id>/pages')
+@login_required
+@subscription_required
+@read_only
+def issue_pages(issue_id):
+    """Page count and page URLs for the previewer."""
+    issue = issue_files.get_issue(issue_id)
+    return jsonify({
+        'id': issue.id,
+        'filename': issue.filename,
+        'pages': issue.page_count,
+        'download_url': url_for('user.download_issue', issue_id=issue.id),
+        'page_urls': [url_for('user.issue_page', issue_id=issue.id, page=page)
+                      for page in range(1, (issue.page_count or 0) + 1)],
+    })
+
+
+@bp.route('/issues/<int:issue_id>/pages/<int:page>')
+@login_required
+@subscription_required
+@read_only
+def issue_page(issue_id, page):
+    """One page of an issue as a single-page PDF."""
+    issue = issue_files.get_issue(issue_id)
+    return issue_files.send_page(issue, page)
+
+
+@bp.route('/article/<int:id>/issue')
+@login_required
+@subscription_required
+@read_only
+def article_issue(id):
+    """The issue an article comes from, opened in the browser."""
+    article = db.session.get(Article, id)
+    issue = issue_files.issue_for_article(article) if article is not None else None
+    if issue is None:
+        abort(404)
+    return redirect(url_for('user.download_issue', issue_id=issue.id, inline=1))
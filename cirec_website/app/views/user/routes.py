@@ -1,14 +1,20 @@
-from flask import render_template, redirect, url_for, request, flash
+from flask import render_template, redirect, url_for, request, flash, abort, current_app
 from flask_login import login_required, current_user
 from app.views.user import bp
 from app.models.article import Article
 from app.extensions import db
+from app.services.auth.session_cache import get_current_user_model
+from app.services.content import page_cache, view_counter
+from app.services.content.article_service import list_articles
+from app.services.payment import subscription_manager
+from app.utils.decorators import read_only, subscription_required
 from datetime import datetime
 
 @bp.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
-    recent_articles = Article.query.filter_by(is_published=True).limit(10).all()
+    recent_articles, _ = list_articles(limit=10)
     return render_template('user/dashboard/index.html', articles=recent_articles)
 
 @bp.route('/profile')
@@ -25,17 +31,30 @@ def subscription():
 
 @bp.route('/articles')
 @login_required
+@read_only
 def articles():
-    articles = Article.query.filter_by(is_published=True).all()
-    return render_template('user/articles/list.html', articles=articles)
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    articles, next_cursor = list_articles(request.args.get('cursor'), limit=per_page)
+    return render_template('user/articles/list.html', articles=articles, next_cursor=next_cursor)
 
 @bp.route('/article/<int:id>')
 @login_required
+@subscription_required
 def view_article(id):
-    article = Article.query.get_or_404(id)
-    article.view_count += 1
-    db.session.commit()
-    return render_template('user/articles/view.html', article=article)
+    # Check the client's copy against updated_at before loading the body
+    row = db.session.query(Article.updated_at).filter(Article.id == id).first()
+    if row is None:
+        abort(404)
+    etag = page_cache.make_etag('article', id, row.updated_at, page_cache.user_variant())
+    view_counter.record_view(id)
+    if page_cache.revalidating():
+        unchanged = page_cache.not_modified(etag, row.updated_at, private=True)
+        if unchanged is not None:
+            return unchanged
+    
+    article = db.session.get(Article, id)
+    response = current_app.make_response(render_template('user/articles/view.html', article=article))
+    return page_cache.set_validators(response, etag, row.updated_at, private=True)
 
 @bp.route('/subscription/upgrade', methods=['POST'])
 @login_required
@@ -46,14 +65,8 @@ def upgrade_subscription():
     
     # TODO: Implement actual payment processing
     # For now, just activate subscription
-    current_user.subscription_status = 'active'
-    current_user.subscription_start = datetime.utcnow()
-    
-    # Set end date based on plan
-    if plan_type == 'basic':
-        current_user.subscription_end = datetime.utcnow().replace(month=datetime.utcnow().month + 3)
-    else:
-        current_user.subscription_end = datetime.utcnow().replace(year=datetime.utcnow().year + 1)
+    subscription_manager.activate(get_current_user_model(), plan_type,
+                                  auto_renew=bool(request.form.get('auto_renew')))
     
     db.session.commit()
     flash('Subscription upgraded successfully!', 'success')
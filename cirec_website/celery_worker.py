@@ -0,0 +1,14 @@
+# Start a worker with:
+# celery -A celery_worker.celery worker --loglevel=info
+# (requires CELERY_BROKER_URL, e.g. redis://localhost:6379/1)
+
+from app import create_app
+from app.services.tasks.task_queue import queue
+
+# Modules that define tasks
+from app.services.content import pdf_processor
+from app.services.email import email_service
+from app.services.search import semantic_search
+
+app = create_app()
+celery = queue.celery
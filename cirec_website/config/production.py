@@ -0,0 +1,32 @@
+import os
+
+
+def engine_options(uri):
+    """Connection pool settings for a server database.
+
+    Every gunicorn worker holds up to ``pool_size + max_overflow``
+    connections, so size these against the server's connection limit
+    divided by the number of workers. SQLite URIs keep the driver's
+    default pool.
+    """
+    if not uri or uri.startswith('sqlite'):
+        return {}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 5),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 10),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT') or 30),
+        # Reconnect before the server or a proxy drops idle connections
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE') or 1800),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'True').lower() == 'true',
+    }
+    timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS') or 30000)
+    if timeout and uri.startswith('postgresql'):
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % timeout}
+    return options
+
+
+def replica_binds(uri):
+    """``SQLALCHEMY_BINDS`` entry for the read replica, if one is configured."""
+    if not uri:
+        return {}
+    return {'replica': dict(engine_options(uri), url=uri)}
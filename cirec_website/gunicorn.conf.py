@@ -0,0 +1,45 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# With preload_app the master imports the app and loads the heavy
+# subsystems once (app.preload); forked workers share those pages
+# copy-on-write. Set GUNICORN_PRELOAD=False to load them per worker on
+# first use instead, e.g. to pick up code changes with a HUP reload.
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:8000'
+workers = int(os.environ.get('GUNICORN_WORKERS') or multiprocessing.cpu_count() * 2 + 1)
+threads = int(os.environ.get('GUNICORN_THREADS') or 1)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 60)
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+
+def on_starting(server):
+    # Per-worker metric files from the previous run would be summed in
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.startswith('metrics-'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from app import preload
+    from wsgi import app
+    preload(app)
+    server.log.info('Preloaded search and PDF subsystems')
+
+
+def post_fork(server, worker):
+    # Connections opened in the master are not safe to share
+    if preload_app:
+        from app.extensions import db
+        from app.services.monitoring import metrics
+        from wsgi import app
+        # Preloading ran queries; the master reports no figures of its own
+        metrics.registry.clear()
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
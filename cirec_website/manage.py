@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import os
+import click
 from flask.cli import FlaskGroup
 from app import create_app, db
 from app.models.user import User
@@ -23,18 +24,99 @@ def drop_db():
 @cli.command("seed_db")
 def seed_db():
     """Seeds the database with initial data."""
-    # Create admin user
-    admin = User(
-        email='admin@cirec.net',
-        username='admin',
-        first_name='Admin',
-        last_name='User',
-        is_admin=True
-    )
-    admin.set_password('admin123')
-    db.session.add(admin)
-    db.session.commit()
-    print("Database seeded with initial data!")
+    # Admin account from ADMIN_EMAIL / ADMIN_PASSWORD; re-running is harmless
+    from app.utils.bulk_loader import admin_record, load_records
+    report = load_records('users', [admin_record(app.config)], workers=1, defer_indexes=False)
+    if report['counts']['inserted']:
+        print("Database seeded with initial data!")
+    else:
+        print("Admin account already present; nothing to seed.")
+
+@cli.command("backup")
+@click.option("--incremental", is_flag=True, help="Only articles changed since the last backup.")
+@click.option("--dir", "directory", help="Where backups are kept (default: BACKUP_DIR).")
+@click.option("--workers", type=int, help="Tables dumped at once (default: BACKUP_WORKERS).")
+def backup(incremental, directory, workers):
+    """Writes a compressed, checksummed backup of the database."""
+    from app.utils.backup import BackupError, backup as write_backup
+    try:
+        path, manifest = write_backup(directory, incremental=incremental, workers=workers)
+    except BackupError as exc:
+        raise click.ClickException(str(exc))
+    rows = sum(entry['rows'] for entry in manifest['tables'].values())
+    print(f"Wrote {path}: {rows} rows in {manifest['seconds']} s")
+
+@cli.command("restore")
+@click.argument("path")
+@click.option("--workers", type=int, help="Tables loaded at once (default: BACKUP_WORKERS).")
+@click.option("--keep-indexes", is_flag=True, help="Do not drop secondary indexes during the load.")
+@click.confirmation_option(prompt="Replace the database contents with this backup?")
+def restore(path, workers, keep_indexes):
+    """Restores a backup, with the backups it builds on."""
+    from app.utils.backup import BackupError, restore as load_backup
+    try:
+        report = load_backup(path, workers=workers, defer_indexes=not keep_indexes)
+    except BackupError as exc:
+        raise click.ClickException(str(exc))
+    print(f"Restored {' + '.join(report['backups'])} in {report['seconds']} s")
+
+@cli.command("build_semantic_index")
+def build_semantic_index():
+    """Embeds every published article into the semantic index."""
+    from app.services.search import semantic_search
+    engine = semantic_search.rebuild()
+    print(f"Semantic index holds {engine.store.count} passage vectors.")
+
+@cli.command("refresh_article_previews")
+def refresh_article_previews():
+    """Recomputes previews, summaries, word counts, snippet offsets and passages."""
+    from app.services.content.article_service import refresh_derived_fields
+    count = refresh_derived_fields()
+    print(f"Refreshed {count} articles.")
+
+@cli.command("send_issue_notice")
+@click.argument("issue_number", type=int)
+@click.option("--url", required=True, help="Link to the issue in the archive.")
+@click.option("--audience", default="active_subscribers", help="active_subscribers or newsletter.")
+@click.option("--resume", "campaign_id", type=int, help="Resume an earlier campaign instead.")
+def send_issue_notice(issue_number, url, audience, campaign_id):
+    """Emails the notice for a new CMN issue to subscribers."""
+    from app.services.email import newsletter
+    if campaign_id is None:
+        campaign_id = newsletter.create_campaign(
+            'issue_notice', audience=audience, issue_number=issue_number, url=url).id
+    result = newsletter.run_campaign(campaign_id)
+    if result is None:
+        print(f"Campaign {campaign_id} is finished or already being sent.")
+    else:
+        print(f"Campaign {campaign_id}: {result['sent']} sent, {result['failed']} failed.")
+
+@cli.command("process_subscriptions")
+def process_subscriptions():
+    """Renews and expires due subscriptions; run daily from cron."""
+    from app.services.payment import subscription_manager
+    result = subscription_manager.process_subscriptions()
+    print(f"Renewed {result['renewed']}, expired {result['expired']} subscriptions.")
+
+@cli.command("startup_report")
+@click.option("--preload", is_flag=True, help="Also run the gunicorn preload hook.")
+@click.option("--top", default=15, help="Number of packages to list.")
+@click.option("--max-import-ms", type=float, help="Fail when startup imports take longer than this.")
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON.")
+def startup_report(preload, top, max_import_ms, as_json):
+    """Reports import time and memory of a fresh app start."""
+    import json
+    from app.utils.startup_report import measure
+    report = measure(preload=preload, top=top)
+    if as_json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Imports: {report['import_ms']} ms, {report['modules']} modules")
+        print("RSS: " + ", ".join(f"{stage} {mb} MB" for stage, mb in report['rss_mb'].items()))
+        for name, ms in report['packages_ms']:
+            print(f"  {ms:8.1f} ms  {name}")
+    if max_import_ms is not None and report['import_ms'] > max_import_ms:
+        raise click.ClickException(f"Startup imports took {report['import_ms']} ms (limit {max_import_ms} ms)")
 
 if __name__ == '__main__':
     cli()
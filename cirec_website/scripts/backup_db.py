@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Back up the database to compressed per-table files, or restore it.
+
+    python scripts/backup_db.py backup                   # full backup into BACKUP_DIR
+    python scripts/backup_db.py backup --incremental     # articles changed since the last one
+    python scripts/backup_db.py verify instance/backups/20261018T093000-incr
+    python scripts/backup_db.py restore instance/backups/20261018T093000-incr --yes
+
+Restoring an incremental backup also reads the backups it builds on;
+the restored tables are emptied first.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.backup import BackupError, backup, list_backups, restore, verify_backup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    dump = commands.add_parser('backup', help='write a new backup')
+    dump.add_argument('--incremental', action='store_true', help='only articles changed since the last backup')
+    dump.add_argument('--dir', help='where backups are kept (default: BACKUP_DIR)')
+    dump.add_argument('--workers', type=int, default=None, help='tables dumped at once (default: BACKUP_WORKERS)')
+    listing = commands.add_parser('list', help='list complete backups')
+    listing.add_argument('--dir', help='where backups are kept (default: BACKUP_DIR)')
+    check = commands.add_parser('verify', help='check the checksums of a backup and its bases')
+    check.add_argument('path')
+    load = commands.add_parser('restore', help='replace the database contents with a backup')
+    load.add_argument('path')
+    load.add_argument('--workers', type=int, default=None, help='tables loaded at once (default: BACKUP_WORKERS)')
+    load.add_argument('--keep-indexes', action='store_true', help='do not drop secondary indexes during the load')
+    load.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        try:
+            if args.command == 'backup':
+                path, manifest = backup(args.dir, incremental=args.incremental, workers=args.workers)
+                rows = sum(entry['rows'] for entry in manifest['tables'].values())
+                print('Wrote %s: %d rows in %.1f s' % (path, rows, manifest['seconds']))
+            elif args.command == 'list':
+                print('\n'.join(list_backups(args.dir)))
+            elif args.command == 'verify':
+                print('%d files verified' % verify_backup(args.path))
+            else:
+                if not args.yes and input('Replace the database contents with %s? [y/N] ' % args.path).lower() != 'y':
+                    raise SystemExit('Aborted')
+                report = restore(args.path, workers=args.workers, defer_indexes=not args.keep_indexes)
+                print(json.dumps(report, indent=2))
+        except BackupError as exc:
+            raise SystemExit(str(exc))
+
+
+if __name__ == '__main__':
+    main()
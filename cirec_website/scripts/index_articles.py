@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Ingest CMN issue PDFs into articles.
+
+    python scripts/index_articles.py ../data/*.pdf --workers 4
+
+Files whose content hash was already ingested are skipped, so the whole
+archive can be re-run after adding new issues.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.services.content.pdf_processor import ingest_files
+
+
+def expand(patterns):
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.pdf')
+        yield from sorted(glob.glob(pattern)) or [pattern]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='PDF files, directories or glob patterns')
+    parser.add_argument('--workers', type=int, default=None, help='extraction processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=500, help='rows per bulk insert')
+    parser.add_argument('--force', action='store_true', help='re-ingest files even if unchanged')
+    parser.add_argument('--embed', action='store_true', help='update the semantic index afterwards')
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        report = ingest_files(list(expand(args.paths)), workers=args.workers,
+                              force=args.force, batch_size=args.batch_size)
+        if args.embed:
+            from app.services.search import semantic_search
+            semantic_search.sync()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
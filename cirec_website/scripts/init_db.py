@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""Create the database tables, optionally with the admin account.
+
+    python scripts/init_db.py --seed
+
+Existing tables are left alone unless ``--drop`` is given.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.extensions import db
+from app.utils.bulk_loader import admin_record, load_records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drop', action='store_true', help='drop all tables first (destroys data)')
+    parser.add_argument('--seed', action='store_true', help='create the admin account from ADMIN_EMAIL / ADMIN_PASSWORD')
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    with app.app_context():
+        if args.drop:
+            db.drop_all()
+            print('Dropped all tables.')
+        db.create_all()
+        print('Tables created.')
+        if args.seed:
+            report = load_records('users', [admin_record(app.config)], workers=1, defer_indexes=False)
+            print('Admin account: %s.' % ('created' if report['counts']['inserted'] else 'already present'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Load legacy subscribers or articles from CSV, JSON or SQL dumps.
+
+    python scripts/migrate_old_data.py users legacy/members.csv.gz
+    python scripts/migrate_old_data.py articles legacy/cms.sql --table news --map content=news_body
+
+Records already in the database are skipped, and progress is
+checkpointed after every batch, so an interrupted migration is resumed
+by running the same command again.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.bulk_loader import TARGETS, BulkLoader, Checkpoint, source_signature
+from app.utils.record_sources import read_records
+
+
+def parse_mapping(pairs):
+    mapping = {}
+    for pair in pairs:
+        target, sep, source = pair.partition('=')
+        if not sep:
+            raise SystemExit('--map takes column=legacy_column, got %r' % pair)
+        mapping[target.strip()] = source.strip()
+    return mapping
+
+
+def report_progress(position, counts, rate):
+    print('  %d records: %d inserted, %d skipped, %d invalid (%.0f rows/s)'
+          % (position, counts['inserted'], counts['skipped'], counts['invalid'], rate), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('kind', choices=sorted(TARGETS), help='what the records are')
+    parser.add_argument('paths', nargs='+', help='.csv, .json, .jsonl or .sql files, optionally .gz')
+    parser.add_argument('--format', choices=('csv', 'json', 'sql'), help='override the format taken from the extension')
+    parser.add_argument('--table', help='table to read from a SQL dump')
+    parser.add_argument('--map', action='append', default=[], metavar='COLUMN=LEGACY',
+                        help='read COLUMN from the legacy field LEGACY (repeatable)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per COPY / executemany')
+    parser.add_argument('--workers', type=int, default=None, help='hashing processes (default: CPU count)')
+    parser.add_argument('--checkpoint-dir', help='where checkpoints are kept (default: instance/checkpoints)')
+    parser.add_argument('--restart', action='store_true', help='ignore existing checkpoints')
+    parser.add_argument('--keep-indexes', action='store_true', help='do not drop secondary indexes during the load')
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    checkpoint_dir = args.checkpoint_dir or os.path.join(app.instance_path, 'checkpoints')
+    loader = BulkLoader(args.kind, batch_size=args.batch_size, workers=args.workers,
+                        defer_indexes=not args.keep_indexes, mapping=parse_mapping(args.map),
+                        progress=report_progress)
+    reports = {}
+    with app.app_context():
+        for path in args.paths:
+            checkpoint_path = os.path.join(checkpoint_dir, '%s-%s.json' % (args.kind, os.path.basename(path)))
+            if args.restart and os.path.exists(checkpoint_path):
+                os.unlink(checkpoint_path)
+            checkpoint = Checkpoint(checkpoint_path, source_signature(path))
+            print('Loading %s from %s' % (args.kind, path), file=sys.stderr)
+            reports[path] = loader.load(read_records(path, fmt=args.format, table=args.table),
+                                        checkpoint=checkpoint)
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
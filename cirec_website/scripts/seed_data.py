@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Seed a fresh database: the admin account, plus any seed files.
+
+    python scripts/seed_data.py
+    python scripts/seed_data.py --users seed/staff.csv --articles seed/sample_articles.jsonl
+
+Seed files go through the bulk loader, so re-running the script only
+adds what is missing.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.bulk_loader import admin_record, load_records
+from app.utils.record_sources import read_records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', action='append', default=[], help='file of user records (repeatable)')
+    parser.add_argument('--articles', action='append', default=[], help='file of article records (repeatable)')
+    parser.add_argument('--no-admin', action='store_true', help='do not create the admin account')
+    parser.add_argument('--workers', type=int, default=None, help='hashing processes (default: CPU count)')
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    reports = {}
+    with app.app_context():
+        if not args.no_admin:
+            reports['admin'] = load_records('users', [admin_record(app.config)], workers=1, defer_indexes=False)
+        for kind, paths in (('users', args.users), ('articles', args.articles)):
+            for path in paths:
+                reports[path] = load_records(kind, read_records(path), workers=args.workers)
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Smoke runs of the benchmark suite.
+
+Each run is a subprocess: search indexes and caches are per-process
+singletons, so a run against one database must not see another's.
+Set CIREC_BENCHMARK_DATABASE_URL to a scratch Postgres database to run
+the suite there too; it drops and recreates every table.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytestmark = pytest.mark.benchmark
+
+
+def run(tmp_path, *extra):
+    output = tmp_path / 'bench.json'
+    subprocess.run(
+        [sys.executable, '-m', 'tests.benchmarks.run_benchmarks', '--articles', '300', '--users', '10',
+         '--requests', '10', '--warmup', '2', '--concurrency', '2', '--bcrypt-rounds', '4',
+         '--output', str(output), *extra],
+        cwd=ROOT, check=True, timeout=300,
+    )
+    return json.loads(output.read_text())
+
+
+def check(report):
+    targets = {(r['target'], r['transport']) for r in report['results']}
+    assert len(targets) == 12
+    for result in report['results']:
+        assert result['errors'] == 0, result
+        assert result['requests'] == 10
+        assert result['latency_ms']['p50'] <= result['latency_ms']['p99']
+
+
+def test_sqlite(tmp_path):
+    report = run(tmp_path)
+    assert report['meta']['dialect'] == 'sqlite'
+    assert report['meta']['articles'] == 300
+    check(report)
+
+
+@pytest.mark.skipif(not os.environ.get('CIREC_BENCHMARK_DATABASE_URL'),
+                    reason='CIREC_BENCHMARK_DATABASE_URL is not set')
+def test_postgres(tmp_path):
+    report = run(tmp_path, '--database-url', os.environ['CIREC_BENCHMARK_DATABASE_URL'], '--reset')
+    assert report['meta']['dialect'] == 'postgresql'
+    check(report)
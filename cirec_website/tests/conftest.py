@@ -0,0 +1,38 @@
+import pytest
+
+from app import create_app
+from app.extensions import db
+from app.services.tasks import task_queue
+from config import TestingConfig
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: runs the benchmark suite on a small corpus')
+
+
+@pytest.fixture
+def config_overrides():
+    """Settings a test module adds to the app's config; override to use."""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, config_overrides):
+    """An app on an empty in-memory database, with its files under tmp_path."""
+    class Config(TestingConfig):
+        SEMANTIC_INDEX_PATH = str(tmp_path / 'semantic_index')
+        AUTOCOMPLETE_SNAPSHOT_PATH = str(tmp_path / 'autocomplete.json')
+        ISSUE_PAGE_CACHE_DIR = str(tmp_path / 'issue_pages')
+        BACKUP_DIR = str(tmp_path / 'backups')
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+
+    for name, value in config_overrides.items():
+        setattr(Config, name, value)
+    app = create_app(Config)
+    # Jobs queued by an earlier test must not run against this one
+    task_queue.queue.broker = task_queue.LocalBroker()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
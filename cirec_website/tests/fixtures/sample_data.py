@@ -0,0 +1,162 @@
+"""Synthetic CMN-style corpus for tests and benchmarks.
+
+Articles follow the shape of CIREC Monthly News items: a short
+"<Country> <product> <measure>, <period>" headline and a few hundred
+words of trade and production figures naming real producers, so term
+statistics, title entities and snippet windows behave like the archive.
+"""
+import random
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models.article import Article
+from app.models.user import User
+from app.services.content.article_service import derived_fields, store_passages, store_term_offsets
+from app.services.content.entity_extractor import store_entities
+from app.utils.security import hash_password
+
+COUNTRIES = {
+    'Russia': 'Russian', 'Poland': 'Polish', 'Czech Republic': 'Czech', 'Hungary': 'Hungarian',
+    'Romania': 'Romanian', 'Ukraine': 'Ukrainian', 'Kazakhstan': 'Kazakh', 'Belarus': 'Belarusian',
+    'Slovakia': 'Slovak', 'Bulgaria': 'Bulgarian', 'Serbia': 'Serbian', 'Uzbekistan': 'Uzbek',
+    'Azerbaijan': 'Azeri', 'Turkmenistan': 'Turkmen', 'Croatia': 'Croatian',
+}
+COMPANIES = [
+    'Sibur', 'Gazprom', 'LUKOIL', 'Rosneft', 'Nizhnekamskneftekhim', 'Kazanorgsintez', 'Acron',
+    'EuroChem', 'PhosAgro', 'Metafrax Chemicals', 'Shchekinoazot', 'Tatneft', 'PKN Orlen',
+    'Grupa Azoty', 'Synthos', 'Ciech', 'Anwil', 'MOL', 'Unipetrol', 'Orlen Unipetrol', 'Spolana',
+    'Slovnaft', 'Duslo', 'Azomures', 'Oltchim', 'Neochim', 'Petrohemija', 'Nitrogenmuvek',
+    'KazMunayGas', 'Navoiyazot', 'SOCAR', 'Grodno Azot', 'Naftan', 'Belaruskali', 'Rivneazot',
+]
+PRODUCTS = [
+    'methanol', 'ammonia', 'urea', 'ammonium nitrate', 'polyethylene', 'polypropylene', 'PVC',
+    'caprolactam', 'benzene', 'styrene', 'ethylene', 'propylene', 'butadiene', 'synthetic rubber',
+    'polystyrene', 'PET', 'sulphuric acid', 'caustic soda', 'nitrogen fertilizers',
+    'potash fertilizers', 'phosphate fertilizers', 'melamine', 'acetic acid', 'phenol', 'acetone',
+    'toluene', 'xylenes', 'MTBE', 'glycols', 'carbon black', 'titanium dioxide', 'soda ash',
+]
+MEASURES = ['production', 'exports', 'imports', 'domestic sales', 'consumption', 'prices', 'capacity',
+            'trade']
+PERIODS = ['Jan-Mar', 'Jan-Jun', 'Jan-Sep', 'Jan-Dec', 'Jan-May', 'Jan-Jul']
+PERIOD_WORDS = {
+    'Jan-Mar': 'January to March', 'Jan-Jun': 'the first six months', 'Jan-Sep': 'January to September',
+    'Jan-Dec': 'the whole year', 'Jan-May': 'January to May', 'Jan-Jul': 'January to July',
+}
+VERBS = ['increased', 'reduced', 'raised', 'cut', 'boosted', 'lowered']
+PLANS = ['modernisation of the {product} unit', 'a new {product} plant', 'expansion of {product} capacity',
+         'a feasibility study for {product}', 'debottlenecking of the {product} line']
+QUERY_TERMS = PRODUCTS + [c.lower() for c in COMPANIES] + [name.lower() for name in COUNTRIES]
+
+
+def _tons(rng):
+    return '{:,}'.format(rng.randint(1, 2_000) * rng.choice((10, 100, 1000)) + rng.randint(0, 999))
+
+
+def _sentence(rng, country, product, period, year):
+    company, other = rng.sample(COMPANIES, 2)
+    words = PERIOD_WORDS[period]
+    templates = [
+        '{company} {verb} {product} {measure} to {a} tons in {words} {year} against {b} tons in the '
+        'same period in {prev}.',
+        '{country} {measure} of {product} totalled {a} tons in {words} {year}, compared with {b} tons '
+        'a year earlier.',
+        'Average {product} prices rose from € {price1} per ton in {prev} to € {price2} per ton in {year}.',
+        '{other} was the main supplier to {country}, shipping {a} tons against {b} tons in {words} {prev}.',
+        '{company} plans {plan} at its site, with completion scheduled for {later}.',
+        'Shipments from {other} declined from {b} tons to {a} tons, partly due to maintenance at the '
+        '{product} unit.',
+        'Domestic demand for {product} in {country} remained weak as consumers reduced stocks.',
+    ]
+    template = rng.choice(templates)
+    return template.format(
+        company=company, other=other, verb=rng.choice(VERBS), product=product,
+        measure=rng.choice(MEASURES), a=_tons(rng), b=_tons(rng), words=words, year=year,
+        prev=year - 1, later=year + rng.randint(1, 4), country=country,
+        price1='%.1f' % rng.uniform(200, 1800), price2='%.1f' % rng.uniform(200, 1800),
+        plan=rng.choice(PLANS).format(product=product),
+    )
+
+
+def generate_article(rng, index, start=datetime(2015, 1, 1)):
+    country, adjective = rng.choice(list(COUNTRIES.items()))
+    product = rng.choice(PRODUCTS)
+    period = rng.choice(PERIODS)
+    created_at = start + timedelta(days=index // 25, minutes=index % 25)
+    year = created_at.year
+    title = '%s %s %s, %s %d' % (adjective, product, rng.choice(MEASURES), period, year)
+    paragraphs = []
+    for _ in range(rng.randint(3, 7)):
+        paragraphs.append(' '.join(_sentence(rng, country, product, period, year)
+                                   for _ in range(rng.randint(3, 6))))
+    return {
+        'title': title[:200],
+        'content': '\n'.join(paragraphs),
+        'author': None,
+        'source_file': 'CMN%03d.pdf' % (index // 75 + 1),
+        'created_at': created_at,
+        'updated_at': created_at,
+        'is_published': rng.random() > 0.02,
+        'view_count': rng.randint(0, 500),
+    }
+
+
+def load_articles(count, seed=1, batch_size=1000, offsets=True):
+    """Bulk-insert ``count`` synthetic articles; returns the number inserted."""
+    rng = random.Random(seed)
+    table = Article.__table__
+    last_id = db.session.query(db.func.max(Article.id)).scalar() or 0
+    for start in range(0, count, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, count)):
+            article = generate_article(rng, index)
+            article.update(derived_fields(article['content']))
+            batch.append(article)
+        db.session.execute(table.insert(), batch)
+        if offsets:
+            ids = [row.id for row in db.session.query(Article.id)
+                   .filter(Article.id > last_id).order_by(Article.id)]
+            contents = list(zip(ids, (a['content'] for a in batch)))
+            store_term_offsets(db.session.connection(), contents)
+            store_passages(db.session.connection(), contents)
+            store_entities(db.session.connection(), ((i, a['title'], a['content']) for i, a in zip(ids, batch)))
+            last_id = ids[-1]
+        db.session.commit()
+    return count
+
+
+def load_users(count, password='benchmark-password', seed=1, active_share=0.7):
+    """Insert ``count`` users sharing one password hash; returns their emails."""
+    rng = random.Random(seed)
+    # One hash for everyone: hashing is the slow part of creating users
+    password_hash = hash_password(password)
+    now = datetime.utcnow()
+    rows = []
+    for i in range(count):
+        active = rng.random() < active_share
+        rows.append({
+            'email': 'user%d@example.com' % i, 'username': 'user%d' % i,
+            'first_name': 'User', 'last_name': str(i), 'company': rng.choice(COMPANIES),
+            'password_hash': password_hash, 'is_admin': False, 'is_active': True,
+            'created_at': now - timedelta(days=rng.randint(0, 2000)),
+            'account_type': rng.choice(('single', 'corporate')),
+            'subscription_status': 'active' if active else 'expired',
+            'subscription_start': now - timedelta(days=200),
+            'subscription_end': now + timedelta(days=165) if active else now - timedelta(days=35),
+            'subscription_plan': 'full', 'auto_renew': False, 'newsletter': True,
+        })
+    for start in range(0, len(rows), 1000):
+        db.session.execute(User.__table__.insert(), rows[start:start + 1000])
+    db.session.commit()
+    return [row['email'] for row in rows if row['subscription_status'] == 'active']
+
+
+def sample_queries(count, seed=2):
+    """Search queries of one to three terms drawn from the corpus vocabulary."""
+    rng = random.Random(seed)
+    return [' '.join(rng.sample(QUERY_TERMS, rng.randint(1, 3))) for _ in range(count)]
+
+
+def sample_prefixes(count, seed=3):
+    """Autocomplete prefixes of two to six characters."""
+    rng = random.Random(seed)
+    return [term[:rng.randint(2, max(2, min(len(term), 6)))] for term in rng.choices(QUERY_TERMS, k=count)]
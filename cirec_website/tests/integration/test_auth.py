@@ -0,0 +1,81 @@
+import pytest
+
+from app.extensions import db
+from app.models.user import User
+from app.services.auth import auth_service
+from app.utils.security import BCRYPT_PREFIX
+
+
+@pytest.fixture
+def config_overrides():
+    return {'LOGIN_ACCOUNT_BURST': 3, 'LOGIN_ACCOUNT_RATE': 0.001}
+
+
+@pytest.fixture(autouse=True)
+def throttle(app):
+    # The throttle is a per-process singleton; start each test with full buckets
+    auth_service._throttle = None
+    yield
+    auth_service._throttle = None
+
+
+def add_user(app, **settings):
+    """A reader whose password was hashed with ``settings``."""
+    previous = {name: app.config[name] for name in settings}
+    app.config.update(settings)
+    user = User(email='reader@example.com', username='reader', first_name='Reader', last_name='One')
+    user.set_password('correct horse')
+    app.config.update(previous)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def login(client, password, email='reader@example.com'):
+    return client.post('/auth/login', data={'email': email, 'password': password})
+
+
+@pytest.mark.parametrize('settings', [
+    {'PASSWORD_HASH_METHOD': 'pbkdf2', 'PASSWORD_PBKDF2_ITERATIONS': 1000},
+    {'PASSWORD_BCRYPT_ROUNDS': 5},
+])
+def test_outdated_hashes_become_bcrypt_sha256_at_login(app, settings):
+    user = add_user(app, **settings)
+    old_hash = user.password_hash
+
+    assert login(app.test_client(), 'correct horse').status_code == 302
+
+    db.session.expire_all()
+    assert user.password_hash != old_hash
+    assert user.password_hash.startswith(BCRYPT_PREFIX + '$2b$04$')
+    assert user.check_password('correct horse')
+
+
+def test_current_hashes_are_left_alone(app):
+    user = add_user(app)
+    old_hash = user.password_hash
+
+    assert login(app.test_client(), 'correct horse').status_code == 302
+
+    db.session.expire_all()
+    assert user.password_hash == old_hash
+
+
+def test_failed_logins_lock_the_account(app):
+    add_user(app)
+    client = app.test_client()
+    for _ in range(3):
+        assert login(client, 'wrong').status_code == 200
+
+    # Even the right password is refused until the bucket refills, and
+    # without checking it
+    assert login(client, 'correct horse').status_code == 429
+    assert login(client, 'correct horse', email='  reader@example.com ').status_code == 429
+
+
+def test_successful_logins_do_not_use_up_the_account(app):
+    add_user(app)
+    client = app.test_client()
+    for _ in range(5):
+        assert login(client, 'correct horse').status_code == 302
+        client.get('/auth/logout')
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.content.article_service import decode_cursor, encode_cursor, list_articles
+
+
+@pytest.fixture
+def articles(app):
+    """Three dated articles and two undated legacy imports, published."""
+    start = datetime(2024, 1, 1)
+    with db.engine.begin() as connection:
+        connection.execute(Article.__table__.insert(), [
+            {'title': 'Dated %d' % i, 'content': '', 'is_published': True,
+             'created_at': start + timedelta(days=i)} for i in range(3)
+        ] + [
+            {'title': 'Undated %d' % i, 'content': '', 'is_published': True,
+             'created_at': None} for i in range(2)
+        ])
+    return db.session.query(Article).all()
+
+
+def walk(limit):
+    titles, cursor = [], None
+    while True:
+        page, cursor = list_articles(cursor, limit=limit)
+        titles += [article.title for article in page]
+        if cursor is None:
+            return titles
+
+
+def test_cursor_of_an_undated_article_round_trips(articles):
+    undated = next(article for article in articles if article.created_at is None)
+    assert decode_cursor(encode_cursor(undated)) == (None, undated.id)
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3])
+def test_pages_cross_from_undated_to_dated_articles(articles, limit):
+    assert walk(limit) == ['Undated 1', 'Undated 0', 'Dated 2', 'Dated 1', 'Dated 0']
+
+
+@pytest.mark.parametrize('per_page, expected', [('0', 1), ('-5', 1), ('2', 2), ('1000', 5)])
+def test_per_page_is_clamped(app, articles, per_page, expected):
+    response = app.test_client().get('/api/articles?per_page=' + per_page)
+    assert response.status_code == 200
+    assert len(response.get_json()['articles']) == expected
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.search import autocomplete
+
+
+@pytest.fixture(autouse=True)
+def service(app):
+    # The service is a per-process singleton; each test gets its own snapshot
+    autocomplete._service = None
+    autocomplete._pending.clear()
+    yield autocomplete.get_service()
+    autocomplete._service = None
+    autocomplete._pending.clear()
+
+
+def sync(service):
+    # As if SEARCH_INDEX_REFRESH_SECONDS had passed
+    service._synced -= service.sync_interval
+    service.ensure()
+
+
+def test_titles_committed_late_by_another_process_are_suggested(service):
+    db.session.add(Article(title='Urea exports rise', content=''))
+    db.session.commit()
+    service.ensure()
+    synced_at = service.index.synced_at
+
+    # Stamped before the snapshot's watermark, committed after it, and
+    # without this process's change listeners seeing it
+    with db.engine.begin() as connection:
+        connection.execute(Article.__table__.insert().values(
+            title='Methanol plant in Gubakha', content='', is_published=True,
+            updated_at=synced_at - timedelta(seconds=5)))
+    sync(service)
+
+    assert 'Methanol plant in Gubakha' in service.complete('methanol')
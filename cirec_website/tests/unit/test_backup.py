@@ -0,0 +1,95 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.article import Article, ArticleTermOffset
+from app.models.user import User
+from app.utils import backup
+
+
+@pytest.fixture
+def config_overrides(tmp_path):
+    # Backups are read and restored by worker threads, so the database
+    # must be a file rather than one in-memory connection
+    return {'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'cirec.db'),
+            'BACKUP_WATERMARK_MARGIN_SECONDS': 60}
+
+
+def insert_article(title, updated_at):
+    """An article written by another process, as of ``updated_at``."""
+    with db.engine.begin() as connection:
+        return connection.execute(Article.__table__.insert().values(
+            title=title, content='', is_published=True, created_at=updated_at,
+            updated_at=updated_at)).inserted_primary_key[0]
+
+
+def next_backup(**options):
+    # Backups are named to the second
+    time.sleep(1.1)
+    return backup.backup(workers=2, **options)
+
+
+def empty_database():
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def titles():
+    db.session.expire_all()
+    return sorted(title for title, in db.session.query(Article.title))
+
+
+def test_full_and_incremental_restore_into_an_empty_database(app):
+    hour_ago = datetime.utcnow() - timedelta(hours=1)
+    db.session.add(User(email='reader@example.com', username='reader', first_name='Reader', last_name='One'))
+    db.session.commit()
+    edited = insert_article('Edited', hour_ago)
+    insert_article('Untouched', hour_ago - timedelta(minutes=10))
+    deleted = insert_article('Deleted', hour_ago)
+    full, manifest = backup.backup(workers=2)
+    assert manifest['tables']['articles']['rows'] == 3
+
+    db.session.get(Article, edited).title = 'Edited again'
+    db.session.delete(db.session.get(Article, deleted))
+    added = Article(title='Added', content='Metafrax starts a methanol plant.')
+    db.session.add(added)
+    db.session.commit()
+    added_id = added.id
+    incremental, manifest = next_backup(incremental=True)
+
+    assert manifest['base'] == os.path.basename(full)
+    # Only the articles changed since the full backup (less the margin)
+    assert manifest['tables']['articles']['rows'] == 2
+    assert manifest['tables']['users']['rows'] == 1
+
+    empty_database()
+    report = backup.restore(incremental, workers=2)
+
+    assert report['backups'] == [os.path.basename(full), os.path.basename(incremental)]
+    assert titles() == ['Added', 'Edited again', 'Untouched']
+    assert User.query.one().email == 'reader@example.com'
+    assert db.session.query(ArticleTermOffset).filter_by(article_id=added_id, term='methanol').count() == 1
+    # New articles are numbered after the restored ones
+    article = Article(title='After the restore', content='')
+    db.session.add(article)
+    db.session.commit()
+    assert article.id == added_id + 1
+
+
+def test_rows_committed_inside_the_margin_reach_the_next_incremental(app):
+    insert_article('Early', datetime.utcnow() - timedelta(hours=1))
+    _, manifest = backup.backup(workers=2)
+    watermark = datetime.fromisoformat(manifest['watermark'])
+
+    # Stamped before the full backup's watermark, committed after it
+    insert_article('Late commit', watermark - timedelta(seconds=30))
+    incremental, manifest = next_backup(incremental=True)
+
+    assert manifest['tables']['articles']['rows'] == 2
+    empty_database()
+    backup.restore(incremental, workers=2)
+    assert titles() == ['Early', 'Late commit']
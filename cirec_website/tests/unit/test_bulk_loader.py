@@ -0,0 +1,65 @@
+import pytest
+
+from app.extensions import db
+from app.models.article import Article
+from app.models.user import User
+from app.utils.bulk_loader import Target, load_records
+
+ARTICLES = [
+    {'id': 1, 'title': 'Legacy one', 'body': 'Acron raised urea exports. Shipments doubled.'},
+    {'id': 2, 'title': 'Legacy two', 'body': 'Sibur cut polyethylene output.'},
+    {'title': 'Without an id', 'body': 'Metafrax starts a methanol plant.', 'date': '2020-01-02'},
+]
+
+
+def articles():
+    db.session.expire_all()
+    return [(article.id, article.legacy_id, article.title) for article in Article.query.order_by(Article.id)]
+
+
+def test_targets_must_say_how_rows_are_keyed():
+    with pytest.raises(TypeError):
+        Target()
+
+
+def test_articles_take_new_ids_and_keep_their_legacy_ids(app):
+    db.session.add(Article(title='Written by the app', content=''))
+    db.session.commit()
+
+    report = load_records('articles', ARTICLES, workers=1)
+
+    assert report['counts'] == {'read': 3, 'inserted': 3, 'skipped': 0, 'invalid': 0}
+    # Legacy id 1 does not collide with the app's article 1
+    assert articles() == [(1, None, 'Written by the app'), (2, 1, 'Legacy one'),
+                          (3, 2, 'Legacy two'), (4, None, 'Without an id')]
+    loaded = db.session.get(Article, 2)
+    assert loaded.content == ARTICLES[0]['body']
+    assert loaded.auto_summary and loaded.word_count == 6
+
+
+def test_loading_again_skips_what_is_there(app):
+    load_records('articles', ARTICLES, workers=1)
+
+    report = load_records('articles', ARTICLES, workers=1)
+
+    assert report['counts'] == {'read': 3, 'inserted': 0, 'skipped': 3, 'invalid': 0}
+    # The app carries on numbering after the loaded articles
+    article = Article(title='Written after the load', content='')
+    db.session.add(article)
+    db.session.commit()
+    assert article.id == 4
+
+
+def test_subscribers_are_keyed_by_email(app):
+    records = [
+        {'email': 'Reader@Example.com', 'name': 'Anna Petrova', 'subscription_end': '2030-01-01'},
+        {'email': 'reader@example.com', 'name': 'Anna Petrova again'},
+        {'email': 'not an address'},
+    ]
+
+    report = load_records('users', records, workers=1)
+
+    assert report['counts'] == {'read': 3, 'inserted': 1, 'skipped': 1, 'invalid': 1}
+    user = User.query.one()
+    assert (user.email, user.first_name, user.last_name, user.subscription_status) == \
+        ('reader@example.com', 'Anna', 'Petrova', 'active')
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.search import facets
+
+
+@pytest.fixture(autouse=True)
+def index(app):
+    # The index is a per-process singleton; each test builds its own
+    facets._dirty.clear()
+    facets._state.update(built=False, synced_at=None, checked=0.0)
+    yield facets.facet_index
+    facets._dirty.clear()
+    facets._state.update(built=False, synced_at=None, checked=0.0)
+
+
+def refresh():
+    # As if SEARCH_INDEX_REFRESH_SECONDS had passed
+    facets._state['checked'] = 0.0
+    facets.ensure_index()
+
+
+def recent():
+    return facets.candidates({'date_range': '1_month'})
+
+
+def test_rows_committed_late_by_another_process_are_filtered(app):
+    article = Article(title='Urea exports rise', content='Acron raised urea exports.')
+    db.session.add(article)
+    db.session.commit()
+    refresh()
+    synced_at = facets._state['synced_at']
+
+    # Stamped before the last refresh, committed after it, and without
+    # this process's change listeners seeing it
+    with db.engine.begin() as connection:
+        late_id = connection.execute(Article.__table__.insert().values(
+            title='Methanol plant', content='', is_published=True, created_at=datetime.utcnow(),
+            updated_at=synced_at - timedelta(seconds=5))).inserted_primary_key[0]
+    refresh()
+
+    assert recent() == {article.id, late_id}
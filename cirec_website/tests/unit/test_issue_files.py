@@ -0,0 +1,154 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+
+from app.extensions import db
+from app.models.article import Article, SourceFile
+from app.models.user import User
+from app.services.content import issue_files
+
+
+def write_pdf(path, pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=300)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        writer.write(fh)
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    return data
+
+
+def add_issue(path, pages=3):
+    data = write_pdf(str(path), pages)
+    issue = SourceFile(filename=os.path.basename(path), file_path=str(path), size=len(data),
+                       sha256=hashlib.sha256(data).hexdigest(), page_count=pages)
+    db.session.add(issue)
+    db.session.commit()
+    return issue, data
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    user = User(email='reader@example.com', username='reader', first_name='Reader', last_name='One',
+                subscription_status='active', subscription_end=datetime.utcnow() + timedelta(days=30))
+    db.session.add(user)
+    db.session.commit()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def issue(app, tmp_path):
+    return add_issue(tmp_path / 'issues' / 'cmn-412.pdf')
+
+
+def test_issues_are_sent_whole_and_kept_private(client, issue):
+    issue, data = issue
+    response = client.get('/user/issues/%d' % issue.id)
+
+    assert response.status_code == 200
+    assert response.data == data
+    assert response.mimetype == 'application/pdf'
+    assert response.accept_ranges == 'bytes'
+    assert response.cache_control.private and not response.cache_control.public
+    assert response.headers['Content-Disposition'].startswith('attachment')
+
+
+def test_range_requests_get_part_of_the_file(client, issue):
+    issue, data = issue
+    response = client.get('/user/issues/%d' % issue.id, headers={'Range': 'bytes=10-19'})
+
+    assert response.status_code == 206
+    assert response.data == data[10:20]
+    assert response.headers['Content-Range'] == 'bytes 10-19/%d' % len(data)
+
+
+def test_current_copies_are_answered_with_304(client, issue):
+    issue, _ = issue
+    etag = client.get('/user/issues/%d' % issue.id).headers['ETag']
+
+    response = client.get('/user/issues/%d' % issue.id, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.cache_control.private and not response.cache_control.public
+    assert response.data == b''
+
+
+def test_issues_sharing_a_filename_are_told_apart(client, issue, tmp_path):
+    first, first_data = issue
+    second, second_data = add_issue(tmp_path / 'later' / 'cmn-412.pdf', pages=2)
+
+    assert client.get('/user/issues/%d' % first.id).data == first_data
+    assert client.get('/user/issues/%d' % second.id).data == second_data
+    assert client.get('/user/issues/%d/pages' % second.id).get_json()['pages'] == 2
+
+
+def test_articles_open_their_own_issue(client, issue, tmp_path):
+    first, _ = issue
+    second, _ = add_issue(tmp_path / 'later' / 'cmn-412.pdf', pages=2)
+    article = Article(title='Urea exports rise', content='', source_file='cmn-412.pdf',
+                      file_path=first.file_path)
+    db.session.add(article)
+    db.session.commit()
+
+    response = client.get('/user/article/%d/issue' % article.id)
+    assert response.status_code == 302
+    assert response.location.endswith('/user/issues/%d?inline=1' % first.id)
+
+
+def test_nginx_sends_files_under_the_accel_root(app, client, issue, tmp_path):
+    issue, _ = issue
+    app.config.update(ISSUE_ACCEL_REDIRECT='/protected-issues/', ISSUE_ACCEL_ROOT=str(tmp_path / 'issues'))
+
+    response = client.get('/user/issues/%d' % issue.id)
+
+    assert response.headers['X-Accel-Redirect'] == '/protected-issues/cmn-412.pdf'
+    assert response.data == b''
+    assert response.cache_control.private
+
+
+@pytest.mark.parametrize('path', [
+    '/srv/issues-old/cmn-412.pdf',  # shares the root's prefix, not its directory
+    '/srv/issues/../secret/cmn-412.pdf',
+    '/etc/passwd',
+])
+def test_files_outside_the_accel_root_are_not_redirected(app, path):
+    app.config.update(ISSUE_ACCEL_REDIRECT='/protected-issues/', ISSUE_ACCEL_ROOT='/srv/issues')
+    with app.test_request_context():
+        assert issue_files._accel_path(path) is None
+        assert issue_files._accel_path('/srv/issues/2024/cmn-412.pdf') == '/protected-issues/2024/cmn-412.pdf'
+
+
+def test_pages_are_cut_once_and_served_from_the_rendition_cache(client, issue):
+    issue, _ = issue
+    response = client.get('/user/issues/%d/pages/2' % issue.id)
+
+    assert response.status_code == 200
+    path = issue_files.page_path(issue, 2)
+    with open(path, 'rb') as fh:
+        assert response.data == fh.read()
+    assert len(PdfReader(path).pages) == 1
+
+    # A second request reads the cached rendition rather than the issue
+    with open(path, 'wb') as fh:
+        fh.write(b'%PDF-cached')
+    assert client.get('/user/issues/%d/pages/2' % issue.id).data == b'%PDF-cached'
+    assert client.get('/user/issues/%d/pages/4' % issue.id).status_code == 404
+
+
+def test_page_answers_carry_their_own_validators(client, issue):
+    issue, _ = issue
+    first = client.get('/user/issues/%d/pages/1' % issue.id)
+    second = client.get('/user/issues/%d/pages/2' % issue.id)
+    assert first.headers['ETag'] != second.headers['ETag']
+
+    response = client.get('/user/issues/%d/pages/1' % issue.id, headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304
+    assert response.cache_control.private
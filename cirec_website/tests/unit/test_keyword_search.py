@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.search import keyword_search
+
+
+@pytest.fixture(autouse=True)
+def index(app):
+    # The index is a per-process singleton; start each test empty
+    keyword_search.keyword_index.clear()
+    keyword_search._dirty.clear()
+    keyword_search._state.update(built=False, synced_at=None, checked=0.0)
+    yield keyword_search.keyword_index
+    keyword_search.keyword_index.clear()
+    keyword_search._state.update(built=False, synced_at=None, checked=0.0)
+
+
+def refresh():
+    # As if SEARCH_INDEX_REFRESH_SECONDS had passed
+    keyword_search._state['checked'] = 0.0
+    keyword_search.ensure_index()
+
+
+def test_rows_committed_late_by_another_process_are_indexed(app):
+    db.session.add(Article(title='Urea exports rise', content='Acron raised urea exports.'))
+    db.session.commit()
+    refresh()
+    synced_at = keyword_search._state['synced_at']
+
+    # Another worker stamped its row before our refresh, but committed after
+    # it; a Core insert skips this process's change listeners, like a commit
+    # in another process would
+    with db.engine.begin() as connection:
+        connection.execute(Article.__table__.insert().values(
+            title='Methanol plant', content='Metafrax starts a methanol plant.', is_published=True,
+            updated_at=synced_at - timedelta(seconds=5)))
+    refresh()
+
+    assert [title for title, in db.session.query(Article.title).filter(
+        Article.id.in_([doc_id for doc_id, _, _ in keyword_search.search('methanol')]))] == ['Methanol plant']
+
+
+def test_deletes_in_another_process_leave_the_index(app):
+    article = Article(title='Urea exports rise', content='Acron raised urea exports.')
+    db.session.add(article)
+    db.session.commit()
+    refresh()
+    assert keyword_search.search('urea')
+
+    with db.engine.begin() as connection:
+        connection.execute(Article.__table__.delete())
+    refresh()
+
+    assert keyword_search.search('urea') == []
@@ -0,0 +1,39 @@
+import json
+
+from app.services.monitoring import metrics
+
+
+def worker_registry(requests):
+    registry = metrics.Registry()
+    latency = registry.histogram('cirec_http_request_duration_seconds', 'Request latency.', ('endpoint',))
+    errors = registry.counter('cirec_errors_total', 'Errors.', ('endpoint',))
+    for seconds in requests:
+        latency.observe(seconds, 'main.index')
+    errors.inc('main.index')
+    return registry
+
+
+def test_shared_directory_sums_every_worker(tmp_path):
+    this_worker = worker_registry([0.02, 0.3])
+    other_worker = worker_registry([0.02])
+    (tmp_path / 'metrics-1.json').write_text(json.dumps(other_worker.state()))
+
+    text = metrics.SharedDirectory(str(tmp_path), this_worker).render()
+
+    assert 'cirec_errors_total{endpoint="main.index"} 2' in text
+    assert 'cirec_http_request_duration_seconds_count{endpoint="main.index"} 3' in text
+    assert 'cirec_http_request_duration_seconds_bucket{endpoint="main.index",le="0.025"} 2' in text
+    # The worker's own figures are left as they were
+    assert this_worker.metrics['cirec_errors_total'].state() == [[['main.index'], 1]]
+
+
+def test_dump_is_throttled(tmp_path):
+    registry = worker_registry([0.02])
+    shared = metrics.SharedDirectory(str(tmp_path), registry, interval=60)
+    shared.dump()
+    registry.metrics['cirec_errors_total'].inc('main.index')
+    shared.dump()
+
+    files = list(tmp_path.glob('metrics-*.json'))
+    assert len(files) == 1
+    assert json.loads(files[0].read_text())['cirec_errors_total'] == [[['main.index'], 1]]
@@ -0,0 +1,150 @@
+import email
+import socketserver
+import threading
+from email.message import EmailMessage
+
+import pytest
+
+from app.extensions import db, mail
+from app.models.user import User
+from app.services.email import newsletter
+from app.services.email.email_service import deliver_batch
+from app.services.email.newsletter import SMTPPool
+from app.services.tasks.task_queue import Retry
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail, like a local debugging server."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost debugging server')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            verb = line.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'RCPT':
+                address = line.split(':', 1)[1].strip().strip('<>')
+                self.reply(self.server.rcpt_replies.get(address, '250 OK'))
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b'.\r\n', b''):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                self.server.messages.append(email.message_from_bytes(b''.join(lines)))
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), DebuggingSMTPHandler)
+        self.messages = []
+        self.rcpt_replies = {}
+
+
+@pytest.fixture
+def smtp_server(app):
+    server = DebuggingSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.server_address[1],
+                      MAIL_USE_TLS=False, MAIL_USE_SSL=False)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def add_subscriber(n, account_type='single'):
+    user = User(email='reader%d@example.com' % n, username='reader%d' % n,
+                first_name='Reader', last_name=str(n), account_type=account_type,
+                subscription_status='active')
+    db.session.add(user)
+    return user
+
+
+def test_campaign_is_sent_through_the_pool(app, smtp_server):
+    for n in range(7):
+        add_subscriber(n, account_type='corporate' if n % 2 else 'single')
+    db.session.commit()
+    campaign = newsletter.create_campaign('issue_notice', issue_number=412, url='https://example.com/412')
+
+    counts = newsletter.run_campaign(campaign.id, chunk_size=3, pool_size=2, rate=0)
+
+    assert counts == {'sent': 7, 'failed': 0, 'variants': 2}
+    assert sorted(message['To'] for message in smtp_server.messages) == \
+        sorted('reader%d@example.com' % n for n in range(7))
+    assert smtp_server.messages[0]['Subject'] == 'CIREC Monthly News: Issue 412 is out'
+
+
+def test_unexpected_errors_still_produce_a_result(app, smtp_server):
+    config = dict(app.config)
+
+    def connect():
+        connection = newsletter.smtp_connection(config)
+        send = connection.send_message
+
+        def send_message(message):
+            if message['To'] == 'bad@example.com':
+                raise ValueError('cannot encode message')
+            return send(message)
+
+        connection.send_message = send_message
+        return connection
+
+    with SMTPPool(connect, size=2) as pool:
+        for n, address in enumerate(['a@example.com', 'bad@example.com', 'b@example.com', 'c@example.com']):
+            message = EmailMessage()
+            message['To'] = address
+            message.set_content('Hello')
+            pool.submit(n, message)
+        results = dict(pool.result() for _ in range(4))
+
+    assert results == {0: None, 1: 'cannot encode message', 2: None, 3: None}
+    assert len(smtp_server.messages) == 3
+
+
+@pytest.fixture
+def outbox_smtp(app, smtp_server):
+    # Flask-Mail read its settings (and suppressed sending) at init_app
+    app.extensions['mail'] = mail.init_mail(dict(app.config, MAIL_SUPPRESS_SEND=False,
+                                                 MAIL_USERNAME=None, MAIL_PASSWORD=None))
+    return smtp_server
+
+
+def batch(*addresses):
+    return [{'subject': 'Hello', 'recipients': [address], 'body': 'Hello',
+             'sender': 'news@example.com'} for address in addresses]
+
+
+def test_deliver_batch_drops_permanently_refused_mail(outbox_smtp):
+    outbox_smtp.rcpt_replies['gone@example.com'] = '550 No such user'
+
+    assert deliver_batch(batch('a@example.com', 'gone@example.com', 'b@example.com')) == 2
+    assert [message['To'] for message in outbox_smtp.messages] == ['a@example.com', 'b@example.com']
+
+
+def test_deliver_batch_retries_from_a_transient_failure(outbox_smtp):
+    outbox_smtp.rcpt_replies['busy@example.com'] = '451 Try again later'
+    messages = batch('a@example.com', 'busy@example.com', 'b@example.com')
+
+    with pytest.raises(Retry) as retry:
+        deliver_batch(messages)
+
+    assert retry.value.call_args == (messages[1:],)
+    assert [message['To'] for message in outbox_smtp.messages] == ['a@example.com']
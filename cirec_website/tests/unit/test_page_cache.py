@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.article import Article
+from app.models.user import User
+from app.services.content import page_cache, view_counter
+
+
+@pytest.fixture(autouse=True)
+def counter(app):
+    yield
+    # Article views buffered here must not be flushed into a later test's database
+    if view_counter._counter is not None:
+        view_counter._counter.buffer.drain()
+        view_counter._counter = None
+
+
+def add_article(title):
+    article = Article(title=title, content='Sibur cut polyethylene production at Tobolsk.')
+    db.session.add(article)
+    db.session.commit()
+    return article
+
+
+def log_in(client, **fields):
+    user = User(email='reader@example.com', username='reader', first_name='Reader', last_name='One', **fields)
+    db.session.add(user)
+    db.session.commit()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return user
+
+
+def test_anonymous_pages_are_served_from_the_store(app):
+    client = app.test_client()
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.cache_control.public
+
+
+def test_editing_an_article_retires_only_its_pages(app):
+    client = app.test_client()
+    edited, other = add_article('Polyethylene output'), add_article('Urea exports')
+    for article in (edited, other):
+        assert client.get('/search/preview/%d' % article.id).headers['X-Cache'] == 'MISS'
+    client.get('/')
+
+    edited.title = 'Polyethylene output falls'
+    db.session.commit()
+
+    response = client.get('/search/preview/%d' % edited.id)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'Polyethylene output falls' in response.data
+    assert client.get('/search/preview/%d' % other.id).headers['X-Cache'] == 'HIT'
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+
+
+def test_not_modified_answers_match_the_page(app):
+    client = app.test_client()
+    article = add_article('Polyethylene output')
+    log_in(client, subscription_status='active', subscription_end=datetime.utcnow() + timedelta(days=30))
+
+    page = client.get('/user/article/%d' % article.id)
+    assert page.status_code == 200 and page.cache_control.private
+
+    response = client.get('/user/article/%d' % article.id, headers={'If-None-Match': page.headers['ETag']})
+    assert response.status_code == 304
+    assert response.cache_control.private
+    assert not response.cache_control.public
+
+
+def test_null_store_caches_nothing(app):
+    app.extensions['page_cache'] = page_cache.NullPageStore()
+    client = app.test_client()
+    client.get('/')
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+
+
+class UnreachableStore(page_cache.MemoryPageStore):
+    """A shared store whose server is down."""
+
+    def generations(self, names):
+        return None
+
+
+def test_pages_render_uncached_while_the_store_is_unreachable(app):
+    app.extensions['page_cache'] = UnreachableStore()
+    client = app.test_client()
+    article = add_article('Polyethylene output')
+
+    for url in ('/', '/search/preview/%d' % article.id):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert 'X-Cache' not in response.headers
+
+
+def test_signed_in_requests_survive_an_unreachable_store(app):
+    app.extensions['page_cache'] = UnreachableStore()
+    client = app.test_client()
+    log_in(client)
+    assert client.get('/user/profile').status_code == 200
+
+
+@pytest.mark.parametrize('value', [(b'<html>\xd0\x9f</html>', 'text/html; charset=utf-8'), '<p>fragment</p>'])
+def test_stored_values_round_trip_through_json(value):
+    assert page_cache.loads(page_cache.dumps(value)) == value
@@ -0,0 +1,73 @@
+import pytest
+
+from app.extensions import db
+from app.models.article import Article
+from app.services.search import semantic_search
+from app.services.tasks import task_queue
+
+
+@pytest.fixture(autouse=True)
+def engine(app):
+    # The engine is a per-process singleton; give each test its own store
+    semantic_search._engine = None
+    yield
+    semantic_search._engine = None
+
+
+def add_article(title, content, published=True):
+    article = Article(title=title, content=content, is_published=published)
+    db.session.add(article)
+    db.session.commit()
+    return article
+
+
+def test_sync_embeds_published_articles_and_search_ranks_them():
+    urea = add_article('Urea exports rise', 'Acron raised urea exports to Brazil and India.')
+    add_article('Polyethylene output', 'Sibur cut polyethylene production at Tobolsk.')
+    add_article('Draft note', 'Unpublished methanol figures.', published=False)
+
+    engine = semantic_search.sync()
+
+    assert engine.store.count == 2
+    hits = semantic_search.search('urea exports')
+    assert hits[0][0] == urea.id
+
+
+def test_search_never_embeds():
+    add_article('Urea exports rise', 'Acron raised urea exports to Brazil and India.')
+    engine = semantic_search.get_engine()
+    calls = []
+    encode = engine.embedder.encode
+    engine.embedder.encode = lambda texts, **kwargs: calls.append(len(texts)) or encode(texts, **kwargs)
+
+    assert semantic_search.search('urea') == []
+    assert calls == [1]  # the query only
+    assert engine.store.count == 0
+
+
+def test_edits_are_embedded_by_the_background_task():
+    semantic_search.sync()
+    article = add_article('Methanol plant', 'Metafrax Chemicals starts a new methanol plant.')
+    assert semantic_search.search('methanol plant') == []
+
+    task_queue.queue.run_pending()
+
+    assert semantic_search.search('methanol plant')[0][0] == article.id
+
+
+def test_deleting_before_the_first_embed():
+    store = semantic_search.get_engine().store
+    store.replace([1, 2], [], [])
+    assert store.count == 0
+
+
+def test_the_task_drops_deleted_articles():
+    article = add_article('Urea exports rise', 'Acron raised urea exports to Brazil and India.')
+    task_queue.queue.run_pending()
+    assert semantic_search.search('urea')[0][0] == article.id
+
+    db.session.delete(article)
+    db.session.commit()
+    task_queue.queue.run_pending()
+
+    assert semantic_search.search('urea') == []
@@ -0,0 +1,18 @@
+from app.extensions import db
+from app.models.article import Article
+from app.services.content.article_service import derived_fields, refresh_derived_fields
+
+
+def test_refresh_derived_fields_keeps_the_editors_summary(app):
+    content = 'Acron raised urea exports to Brazil. Shipments to India doubled.'
+    lead = derived_fields(content)['auto_summary']
+    # An editor may well have chosen the lead sentence as the summary
+    article = Article(title='Urea exports rise', content=content, summary=lead)
+    db.session.add(article)
+    db.session.commit()
+
+    assert refresh_derived_fields() == 1
+
+    db.session.expire_all()
+    assert article.summary == lead
+    assert article.auto_summary == lead
@@ -0,0 +1,87 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from app.extensions import db
+from app.models.user import User
+from app.services.payment import subscription_manager
+from app.services.payment.subscription_manager import add_months, expire_due, renew_due
+
+
+@pytest.mark.parametrize('when, months, expected', [
+    (datetime(2023, 11, 30), 3, datetime(2024, 2, 29)),
+    (datetime(2024, 11, 30), 3, datetime(2025, 2, 28)),
+    (datetime(2024, 10, 15, 9, 30), 3, datetime(2025, 1, 15, 9, 30)),
+    (datetime(2024, 1, 31), 1, datetime(2024, 2, 29)),
+    (datetime(2024, 3, 31), 12, datetime(2025, 3, 31)),
+])
+def test_add_months_clamps_to_the_end_of_the_month(when, months, expected):
+    assert add_months(when, months) == expected
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def config_overrides(request):
+    """Run on SQLite, and on Postgres when TEST_POSTGRES_URL names a scratch database."""
+    if request.param == 'sqlite':
+        return {}
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    pytest.importorskip('psycopg2')
+    return {'SQLALCHEMY_DATABASE_URI': url}
+
+
+def add_user(n, end, plan='basic', auto_renew=False, status='active'):
+    user = User(email='reader%d@example.com' % n, username='reader%d' % n, first_name='Reader',
+                last_name=str(n), subscription_status=status, subscription_plan=plan,
+                subscription_end=end, auto_renew=auto_renew)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def ends():
+    db.session.expire_all()
+    return {user.username: (user.subscription_status, user.subscription_end)
+            for user in User.query.order_by(User.id)}
+
+
+def test_renew_due_extends_by_calendar_months(app):
+    add_user(1, datetime(2024, 11, 30), plan='basic', auto_renew=True)
+    add_user(2, datetime(2024, 10, 15), plan='full', auto_renew=True)
+    add_user(3, datetime(2024, 11, 30), plan='basic')
+    add_user(4, datetime(2025, 3, 1), plan='basic', auto_renew=True)
+
+    assert renew_due(now=datetime(2024, 12, 1)) == 2
+
+    assert ends() == {
+        'reader1': ('active', datetime(2025, 2, 28)),
+        'reader2': ('active', datetime(2025, 10, 15)),
+        'reader3': ('active', datetime(2024, 11, 30)),
+        'reader4': ('active', datetime(2025, 3, 1)),
+    }
+
+
+def test_expire_due_expires_only_ended_subscriptions(app, monkeypatch):
+    monkeypatch.setattr(subscription_manager, 'BATCH_SIZE', 2)
+    for n in range(5):
+        add_user(n, datetime(2024, 11, 30))
+    add_user(5, datetime(2025, 1, 1))
+    add_user(6, datetime(2024, 1, 1), status='inactive')
+
+    assert expire_due(now=datetime(2024, 12, 1)) == 5
+
+    statuses = {name: status for name, (status, _) in ends().items()}
+    assert statuses == dict({'reader%d' % n: 'expired' for n in range(5)},
+                            reader5='active', reader6='inactive')
+
+
+def test_process_subscriptions_renews_before_expiring(app):
+    add_user(1, datetime(2024, 11, 30), auto_renew=True)
+    add_user(2, datetime(2024, 11, 30))
+
+    assert subscription_manager.process_subscriptions(now=datetime(2024, 12, 1)) == \
+        {'renewed': 1, 'expired': 1}
+    assert ends() == {'reader1': ('active', datetime(2025, 2, 28)),
+                      'reader2': ('expired', datetime(2024, 11, 30))}
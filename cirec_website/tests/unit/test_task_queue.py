@@ -0,0 +1,70 @@
+import pytest
+
+from app.services.tasks.task_queue import LocalBroker, Retry, TaskQueue
+
+
+@pytest.fixture
+def queue(app):
+    queue = TaskQueue()
+    queue.init_app(app)  # TASK_WORKERS = 0: jobs wait for run_pending
+    return queue
+
+
+def test_delay_queues_the_call_with_its_arguments(queue):
+    calls = []
+
+    @queue.task('test.record')
+    def record(article_ids, reason=None):
+        calls.append((article_ids, reason))
+
+    record.delay([3, 1], reason='edit')
+    assert calls == []
+
+    assert queue.run_pending() == 1
+    assert calls == [([3, 1], 'edit')]
+
+
+def test_failed_jobs_are_retried_until_max_retries(queue):
+    attempts = []
+
+    @queue.task('test.flaky', max_retries=2, retry_delay=60)
+    def flaky():
+        attempts.append(1)
+        raise RuntimeError('down')
+
+    flaky.delay()
+    # The first retry is due in a minute; only run what is due now
+    assert queue.run_pending(ignore_eta=False) == 1
+    assert len(attempts) == 1
+
+    queue.run_pending()
+    assert len(attempts) == 3
+    assert queue.run_pending() == 0
+
+
+def test_retry_continues_with_the_remaining_work(queue):
+    sent = []
+
+    @queue.task('test.send', retry_delay=0)
+    def send(addresses):
+        sent.append(addresses[0])
+        if len(addresses) > 1:
+            raise Retry(addresses[1:])
+
+    send.delay(['a@example.com', 'b@example.com', 'c@example.com'])
+    queue.run_pending()
+
+    assert sent == ['a@example.com', 'b@example.com', 'c@example.com']
+
+
+def test_local_broker_hands_out_jobs_when_due():
+    broker = LocalBroker()
+    broker.put({'name': 'later'}, eta=float('inf'))
+    broker.put({'name': 'now'})
+
+    assert broker.get(timeout=0)['name'] == 'now'
+    broker.done()
+    assert broker.get(timeout=0) is None
+    assert broker.get(timeout=0, due_only=False)['name'] == 'later'
+    broker.done()
+    assert broker.join(timeout=0)
@@ -0,0 +1,122 @@
+import hashlib
+import os
+
+import pytest
+
+from app.extensions import db
+from app.models.article import SourceFile
+from app.models.user import User
+from app.services.content import uploads
+
+DATA = b'%PDF-0123456789'  # four parts of 4, 4, 4 and 3 bytes
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def part(index):
+    return DATA[index * 4:(index + 1) * 4]
+
+
+@pytest.fixture
+def config_overrides():
+    return {'UPLOAD_PART_SIZE': 4}
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    admin = User(email='admin@example.com', username='admin', first_name='Ad', last_name='Min', is_admin=True)
+    db.session.add(admin)
+    db.session.commit()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+    return client
+
+
+def create(client, **fields):
+    fields.setdefault('filename', 'CMN 412.pdf')
+    fields.setdefault('size', len(DATA))
+    return client.post('/admin/content/uploads', json=fields)
+
+
+def put(client, upload_id, index, data, digest=None):
+    return client.put('/admin/content/uploads/%s/parts/%d' % (upload_id, index), data=data,
+                      headers={'X-Part-SHA256': digest or sha(data)})
+
+
+def test_parts_that_do_not_match_their_hash_are_rejected(app, client):
+    upload = create(client).get_json()
+
+    response = put(client, upload['id'], 0, b'zzzz', digest=sha(part(0)))
+
+    assert response.status_code == 400
+    assert 'does not match' in response.get_json()['error']
+    assert os.listdir(uploads._partial_dir(upload['id'])) == [uploads.MANIFEST]
+    assert client.get('/admin/content/uploads/' + upload['id']).get_json()['missing'] == [0, 1, 2, 3]
+
+
+def test_an_interrupted_upload_resumes_with_the_missing_parts(client):
+    upload = create(client).get_json()
+    assert upload['parts'] == 4
+    for index in (0, 2):
+        assert put(client, upload['id'], index, part(index)).status_code == 200
+
+    state = client.get('/admin/content/uploads/' + upload['id']).get_json()
+    assert state['missing'] == [1, 3]
+    assert state['received'] == {'0': sha(part(0)), '2': sha(part(2))}
+    assert client.post('/admin/content/uploads/%s/complete' % upload['id']).status_code == 409
+
+    for index in state['missing']:
+        put(client, upload['id'], index, part(index))
+    result = client.post('/admin/content/uploads/%s/complete' % upload['id']).get_json()
+
+    assert result['status'] == 'queued'
+    assert result['sha256'] == sha(DATA)
+    with open(os.path.join(uploads.stored_path(sha(DATA)), 'CMN_412.pdf'), 'rb') as fh:
+        assert fh.read() == DATA
+
+
+def test_a_part_sent_again_with_another_hash_replaces_the_first(client):
+    upload = create(client).get_json()
+    put(client, upload['id'], 0, b'zzzz')
+    put(client, upload['id'], 0, b'zzzz')  # a retry of the same part is a no-op
+
+    state = put(client, upload['id'], 0, part(0)).get_json()
+
+    assert state['received'] == {'0': sha(part(0))}
+    parts = [name for name in os.listdir(uploads._partial_dir(upload['id'])) if name.endswith('.part')]
+    assert parts == ['00000-%s.part' % sha(part(0))]
+
+
+def test_a_declared_hash_is_checked_on_completion(client):
+    upload = create(client, sha256=sha(b'another file')).get_json()
+    for index in range(4):
+        put(client, upload['id'], index, part(index))
+
+    response = client.post('/admin/content/uploads/%s/complete' % upload['id'])
+    assert response.status_code == 400
+    assert 'does not match' in response.get_json()['error']
+
+
+def test_known_files_are_not_sent_again(client):
+    upload = create(client).get_json()
+    for index in range(4):
+        put(client, upload['id'], index, part(index))
+    client.post('/admin/content/uploads/%s/complete' % upload['id'])
+
+    result = create(client, filename='CMN 412 again.pdf', sha256=sha(DATA).upper()).get_json()
+    assert result['status'] == 'duplicate'
+    assert result['duplicate_of'] == 'CMN_412.pdf'
+    assert 'id' not in result
+
+
+def test_ingested_issues_are_duplicates_too(client):
+    db.session.add(SourceFile(filename='cmn-412.pdf', file_path='/srv/issues/cmn-412.pdf', sha256=sha(DATA)))
+    db.session.commit()
+
+    result = create(client, sha256=sha(DATA)).get_json()
+    assert result['status'] == 'duplicate'
+    assert result['duplicate_of'] == 'cmn-412.pdf'